@@ -0,0 +1,329 @@
+'''
+Batch mode of RasterLab.
+
+Applies one of the engine operations to every image in the given directories,
+files or glob patterns and writes the results to an output directory, without
+Tk. Files are processed by a pool of worker processes and reported as soon as
+they finish.
+
+Uncompressed rasters (.npy, .raw, .bmp) are memory-mapped instead of decoded.
+Results of .npy and .raw files are written as the same format, keeping their
+type; with --tile-size the tiles are written straight into the output file.
+
+Results keep their path relative to the given directory (or to the directory
+part of a glob pattern), files of the same name from different inputs get a
+number appended. Outputs which would overwrite an input are refused.
+
+Example:
+
+    python batch.py examples -o output/batch filter --option 10 -a 5
+    python batch.py "examples/*.jpg" -o output/otsu --workers 4 segment --mode 3
+'''
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import glob
+import os
+import sys
+import time
+import numpy as np
+import cv2 as cv
+import engine
+import mapped
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp') + mapped.MAPPED_EXTENSIONS
+# results of these are written as arrays rather than encoded images
+ARRAY_EXTENSIONS = ('.npy', '.raw')
+
+
+def run_negate(image, params):
+    return engine.negate(image)
+
+
+def run_threshold(image, params):
+    return engine.threshold(image, params["value"], not params["multilevel"])
+
+
+def run_posterize(image, params):
+    return engine.posterize(image, params["bins"])
+
+
+def run_stretch(image, params):
+    if params["range"]:
+        return engine.stretch(image, *params["range"])
+    return engine.stretch(image)
+
+
+def run_filter(image, params):
+    return engine.apply_filter(image, params["option"], params["edge"], params["a"], params["b"], params["c"],
+                               tile_size=params["tile_size"], out=params.get("out"))
+
+
+def run_morph(image, params):
+    return engine.morph(image, params["operation"], params["shape"], params["edge"], params["size"],
+                        tile_size=params["tile_size"], out=params.get("out"))
+
+
+def run_mask_filter(image, params):
+    return engine.mask_filter(image, params["stages"], params["mask"], params["edge"],
+                              tile_size=params["tile_size"], out=params.get("out"))
+
+
+def run_skeletonize(image, params):
+    return engine.skeletonize(image)
+
+
+def run_segment(image, params):
+    return engine.segment(image, params["mode"], params["value"])
+
+
+def segment_flags(params) -> int:
+    return cv.IMREAD_COLOR if params["mode"] == 4 else cv.IMREAD_GRAYSCALE
+
+
+# operation name -> (decode flags or a function choosing them, operation)
+OPERATIONS: Dict[str, Tuple[Any, Callable]] = {
+    "negate": (cv.IMREAD_UNCHANGED, run_negate),
+    "threshold": (cv.IMREAD_GRAYSCALE, run_threshold),
+    "posterize": (cv.IMREAD_UNCHANGED, run_posterize),
+    "stretch": (cv.IMREAD_GRAYSCALE, run_stretch),
+    "filter": (cv.IMREAD_COLOR, run_filter),
+    "morph": (cv.IMREAD_COLOR, run_morph),
+    "mask-filter": (cv.IMREAD_COLOR, run_mask_filter),
+    "skeletonize": (cv.IMREAD_GRAYSCALE, run_skeletonize),
+    "segment": (segment_flags, run_segment),
+}
+
+
+def glob_root(pattern: str) -> str:
+    '''
+    Returns the directory part of a glob pattern before its first wildcard.
+    '''
+    parts = pattern.split(os.sep)
+    for index, part in enumerate(parts):
+        if glob.has_magic(part):
+            return os.sep.join(parts[:index])
+    return os.path.dirname(pattern)
+
+
+def expand_inputs(inputs: List[str]) -> List[Tuple[str, str]]:
+    '''
+    Expands directories and glob patterns into (image file, directory it was found in) pairs.
+    '''
+    found: List[Tuple[str, str]] = []
+    for item in inputs:
+        if os.path.isdir(item):
+            root = item
+            candidates = [os.path.join(item, name) for name in os.listdir(item)]
+        elif glob.has_magic(item):
+            root = glob_root(item)
+            candidates = glob.glob(item)
+        else:
+            root = os.path.dirname(item)
+            candidates = [item]
+        found += [(path, root) for path in sorted(candidates)
+                  if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)]
+    return found
+
+
+def collect_inputs(inputs: List[str]) -> List[str]:
+    '''
+    Expands directories and glob patterns into a sorted list of image files.
+    '''
+    return sorted(set(path for path, _ in expand_inputs(inputs)))
+
+
+def file_identity(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino
+
+
+def output_paths(inputs: List[str], output_dir: str) -> Dict[str, str]:
+    '''
+    Returns where the result of every image file is written, by input path.
+    Paths relative to their input directory are kept and repeated ones numbered,
+    raises ValueError if an output is one of the input files.
+    '''
+    destinations: Dict[str, str] = {}
+    taken = set()
+    for path, root in expand_inputs(inputs):
+        if path in destinations:
+            continue
+        name = os.path.relpath(path, root or os.curdir)
+        base, extension = os.path.splitext(name)
+        number = 1
+        while os.path.normcase(name) in taken:
+            number += 1
+            name = f"{base}_{number}{extension}"
+        taken.add(os.path.normcase(name))
+        destinations[path] = os.path.join(output_dir, name)
+    # links and differently spelled paths resolve to the same file
+    identities = {file_identity(path): path for path in destinations}
+    for path, destination in destinations.items():
+        if os.path.exists(destination) and file_identity(destination) in identities:
+            raise ValueError(f"{destination} would overwrite the input {identities[file_identity(destination)]}")
+    return dict(sorted(destinations.items()))
+
+
+def read_image(path: str, flags: int) -> np.ndarray:
+    '''
+    Maps an uncompressed raster or decodes the file.
+    '''
+    view = mapped.open_mapped(path)
+    if view is not None:
+        return mapped.convert(view, flags)
+    image = cv.imread(path, flags)
+    if image is None:
+        raise ValueError("can't decode the file")
+    return image
+
+
+def write_array(path: str, run: Callable, image: np.ndarray, params: Dict[str, Any]) -> None:
+    '''
+    Runs the operation letting tiled operations write into a memory-mapped output file.
+    '''
+    created: List[np.ndarray] = []
+
+    def allocate(shape, dtype) -> np.ndarray:
+        created.append(mapped.create(path, shape, dtype))
+        return created[0]
+
+    result = run(image, dict(params, out=allocate))
+    if created:
+        created[0].flush()
+    else:
+        mapped.save(path, result)
+
+
+def init_worker() -> None:
+    '''
+    Workers already run in parallel, keep OpenCV from spawning its own threads in each one.
+    '''
+    cv.setNumThreads(1)
+
+
+def process_file(path: str, destination: str, operation: str, params: Dict[str, Any]) -> Tuple[str, Optional[str], float, Optional[str]]:
+    '''
+    Decodes, processes and writes one file.
+    Returns the input path, the output path, the time it took and an error message, if any.
+    '''
+    start = time.perf_counter()
+    try:
+        flags, run = OPERATIONS[operation]
+        if callable(flags):
+            flags = flags(params)
+        image = read_image(path, flags)
+        os.makedirs(os.path.dirname(destination) or os.curdir, exist_ok=True)
+        if destination.lower().endswith(ARRAY_EXTENSIONS):
+            write_array(destination, run, image, params)
+        elif not cv.imwrite(destination, engine.to_uint8(run(image, params))):
+            raise ValueError(f"can't write {destination}")
+        return path, destination, time.perf_counter() - start, None
+    except Exception as error:
+        return path, None, time.perf_counter() - start, f"{type(error).__name__}: {error}"
+
+
+def run_batch(destinations: Dict[str, str], operation: str, params: Dict[str, Any],
+              workers: Optional[int] = None, out=sys.stdout) -> int:
+    '''
+    Processes the files (input path -> output path) in a process pool, reporting each one as it finishes.
+    Returns the number of files which failed.
+    '''
+    paths = list(destinations)
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        futures = [pool.submit(process_file, path, destinations[path], operation, params) for path in paths]
+        for done, future in enumerate(as_completed(futures), start=1):
+            path, destination, seconds, error = future.result()
+            if error is None:
+                print(f"[{done}/{len(paths)}] {path} -> {destination} ({seconds:.3f} s)", file=out)
+            else:
+                failed += 1
+                print(f"[{done}/{len(paths)}] {path} failed: {error} ({seconds:.3f} s)", file=out)
+    elapsed = time.perf_counter() - start
+    throughput = len(paths) / elapsed if elapsed else 0.0
+    print(f"Processed {len(paths) - failed}/{len(paths)} images in {elapsed:.2f} s "
+          f"({throughput:.2f} images/s)", file=out)
+    return failed
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="batch.py", description="Apply a RasterLab operation to many images.")
+    parser.add_argument("inputs", nargs="+",
+                        help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", default="output",
+                        help="directory for the results (default: output)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="process filters and morph operations in tiles of this size")
+    operations = parser.add_subparsers(dest="command", required=True)
+
+    operations.add_parser("negate", help="invert the colors")
+
+    sub = operations.add_parser("threshold", help="simple or multilevel threshold")
+    sub.add_argument("--value", type=int, default=2,
+                     help="threshold, or number of bins with --multilevel")
+    sub.add_argument("--multilevel", action="store_true")
+
+    sub = operations.add_parser("posterize", help="posterization")
+    sub.add_argument("--bins", type=int, required=True)
+
+    sub = operations.add_parser("stretch", help="histogram stretch")
+    sub.add_argument("--range", type=int, nargs=4, metavar=("P1", "P2", "Q3", "Q4"),
+                     help="stretch P1-P2 to Q3-Q4 instead of the full range")
+
+    sub = operations.add_parser("filter", help="filter menu options")
+    sub.add_argument("--option", type=int, required=True,
+                     help="0 gaussian, 1 blur, 2 sobel, 3 laplacian, 4 canny, 5-7 sharpen, 8 prewitt, 10 median")
+    sub.add_argument("--edge", type=int, default=1,
+                     help="0 isolated, 1 reflect, 2 replicate")
+    sub.add_argument("-a", type=int, default=0)
+    sub.add_argument("-b", type=int, default=0)
+    sub.add_argument("-c", type=int, default=0)
+
+    sub = operations.add_parser("morph", help="morphological operations")
+    sub.add_argument("--operation", type=int, required=True,
+                     help="1 erosion, 2 dilation, 3 open, 4 close")
+    sub.add_argument("--shape", type=int, default=2, help="1 rombus, 2 square")
+    sub.add_argument("--edge", type=int, default=2,
+                     help="1 constant, 2 replicate, 3 reflect, 4 reflect101, 5 wrap")
+    sub.add_argument("--size", type=int, default=3)
+
+    sub = operations.add_parser("mask-filter", help="one or two stage mask filter")
+    sub.add_argument("--stages", type=int, default=1)
+    sub.add_argument("--mask", type=int, default=1, help="1 sharpen, 2 smoothen")
+    sub.add_argument("--edge", type=int, default=2,
+                     help="1 constant, 2 replicate, 3 reflect")
+
+    operations.add_parser("skeletonize", help="skeletonization")
+
+    sub = operations.add_parser("segment", help="segmentation")
+    sub.add_argument("--mode", type=int, required=True,
+                     help="1 normal, 2 adaptive, 3 otsu, 4 watershed")
+    sub.add_argument("--value", type=int, default=127,
+                     help="threshold of normal segmentation")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    params = {key: value for key, value in vars(args).items()
+              if key not in ("inputs", "output", "workers", "command")}
+    try:
+        destinations = output_paths(args.inputs, args.output)
+    except ValueError as error:
+        print(f"Refusing to run: {error}.", file=sys.stderr)
+        return 1
+    if not destinations:
+        print("No images found.", file=sys.stderr)
+        return 1
+    failed = run_batch(destinations, args.command, params, args.workers)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
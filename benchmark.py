@@ -0,0 +1,401 @@
+'''
+Benchmark suite of RasterLab.
+
+Runs every engine operation available in the GUI against the images in
+examples/ and against synthetic images upscaled from lena.bmp to 1, 10 and 50
+megapixels. For each case the median and 95th percentile of the latency and the
+peak of memory allocated (tracemalloc) are reported.
+
+Results are compared with a stored baseline and cases slower (or hungrier)
+than the threshold are flagged as regressions. Outputs are compared with
+stored golden digests, so a faster implementation can be checked to still
+give the same results.
+
+Example:
+
+    python benchmark.py --sizes 1 10 --save-baseline --save-golden
+    python benchmark.py --sizes 1 10 --only filter morph
+    python benchmark.py --no-examples --sizes 50 --repeat 3
+
+Baselines depend on the machine and aren't meant to be shared; golden digests
+depend only on the code (and the OpenCV version). They are checked against the
+original implementation (reference.py) with --reference, which runs only the
+reference and is slow on large images:
+
+    python benchmark.py --sizes --reference
+
+A case which raises is reported as failed and, like regressions and changed
+outputs, makes the run exit with status 1.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import time
+import numpy as np
+import cv2 as cv
+from PIL import Image
+import display
+import engine
+import export
+import histogram
+import reference
+import shared
+import tracing
+
+
+BENCHMARK_DIR = "benchmarks"
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+GOLDEN_PATH = os.path.join(BENCHMARK_DIR, "golden.json")
+EXAMPLES = "examples"
+DEFAULT_SIZES = (1, 10, 50)
+DEFAULT_REPEAT = 5
+# relative slowdown (or memory growth) counted as a regression
+DEFAULT_THRESHOLD = 0.25
+# time and memory differences smaller than these are noise
+TIME_SLACK = 0.005
+MEMORY_SLACK = 1024 * 1024
+SYNTHETIC_SOURCE = os.path.join(EXAMPLES, "lena.bmp")
+STITCH_IMAGES = [os.path.join(EXAMPLES, name) for name in ("first.jpg", "second.jpg", "third.jpg")]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+CUSTOM_KERNEL = [[0, -1, 0], [-1, 5, -1], [0, -1, 0]]
+
+# Inputs of a case: "color" (BGR), "gray", "binary" (Otsu segmented gray),
+# "pair" (the color image and its mirror image) or "stitch" (images to stitch).
+Inputs = Dict[str, Any]
+
+# reused like the buffer of a live preview window
+DISPLAY_BUFFER = display.DisplayBuffer()
+
+# operations run in a worker process by the transport cases, cheap so that moving the arrays dominates
+TRANSPORT_OPERATIONS = [("negate", {})]
+# arena and worker process of the transport cases, created on first use
+TRANSPORT: Dict[str, Any] = {}
+
+
+def transport_pool() -> Tuple[shared.SharedArrays, ProcessPoolExecutor]:
+    if not TRANSPORT:
+        # the arena first, see shared.SharedArrays
+        TRANSPORT["arrays"] = shared.SharedArrays()
+        TRANSPORT["pool"] = ProcessPoolExecutor(max_workers=1)
+    return TRANSPORT["arrays"], TRANSPORT["pool"]
+
+
+def transport_pickled(image: np.ndarray) -> np.ndarray:
+    arrays, pool = transport_pool()
+    return pool.submit(shared.run_pickled, image, TRANSPORT_OPERATIONS).result()
+
+
+def transport_shared(image: np.ndarray) -> np.ndarray:
+    arrays, pool = transport_pool()
+    with arrays.put(image) as source, arrays.empty(image.shape, image.dtype) as target:
+        result = pool.submit(shared.run, source.descriptor, target.descriptor, TRANSPORT_OPERATIONS).result()
+        # a private copy like the pickled result, the block is reused
+        return target.view(result).copy()
+
+
+# case name -> (input kind, operation)
+CASES: Dict[str, Tuple[str, Callable[[Any], Any]]] = {
+    "negate": ("color", engine.negate),
+    "threshold": ("gray", lambda image: engine.threshold(image, 127)),
+    "threshold multilevel": ("gray", lambda image: engine.threshold(image, 4, False)),
+    "posterize": ("color", lambda image: engine.posterize(image, 4)),
+    "stretch": ("gray", engine.stretch),
+    "stretch range": ("gray", lambda image: engine.stretch(image, 50, 200, 0, 255)),
+    "histogram": ("color", histogram.channel_histograms),
+    "histogram hs": ("color", lambda image: histogram.color_histogram(image, "hs")),
+    "histogram ab": ("color", lambda image: histogram.color_histogram(image, "ab")),
+    "histogram rgb": ("color", lambda image: histogram.color_histogram(image, "rgb")),
+    "line profile": ("gray", lambda image: engine.line_profile(
+        image, (0, 0), (image.shape[1] - 1, image.shape[0] - 1))),
+    "find objects": ("gray", engine.find_objects),
+    "draw contours": ("gray", engine.draw_contours),
+    "filter gaussian": ("color", lambda image: engine.apply_filter(image, 0, 1)),
+    "filter blur": ("color", lambda image: engine.apply_filter(image, 1, 1)),
+    "filter sobel": ("color", lambda image: engine.apply_filter(image, 2, 1, 1, 0, 3)),
+    "filter laplacian": ("color", lambda image: engine.apply_filter(image, 3, 1, cv.CV_64F)),
+    "filter canny": ("color", lambda image: engine.apply_filter(image, 4, 1, 100, 200)),
+    "filter sharpen a": ("color", lambda image: engine.apply_filter(image, 5, 1)),
+    "filter sharpen b": ("color", lambda image: engine.apply_filter(image, 6, 1)),
+    "filter sharpen c": ("color", lambda image: engine.apply_filter(image, 7, 1)),
+    "filter prewitt": ("color", lambda image: engine.apply_filter(image, 8, 1, 0)),
+    "filter custom": ("color", lambda image: engine.apply_filter(image, 9, 1, CUSTOM_KERNEL)),
+    "filter median": ("color", lambda image: engine.apply_filter(image, 10, 1, 5)),
+    "morph erode": ("color", lambda image: engine.morph(image, 1, 2, 2, 3)),
+    "morph dilate": ("color", lambda image: engine.morph(image, 2, 2, 2, 3)),
+    "morph open": ("color", lambda image: engine.morph(image, 3, 1, 2, 3)),
+    "morph close": ("color", lambda image: engine.morph(image, 4, 1, 2, 3)),
+    "mask filter": ("color", lambda image: engine.mask_filter(image, 1, 1, 2)),
+    "mask filter two stage": ("color", lambda image: engine.mask_filter(image, 2, 1, 2)),
+    "skeletonize": ("binary", engine.skeletonize),
+    "segment normal": ("gray", lambda image: engine.segment(image, 1, 127)),
+    "segment adaptive": ("gray", lambda image: engine.segment(image, 2)),
+    "segment otsu": ("gray", lambda image: engine.segment(image, 3)),
+    "segment watershed": ("color", lambda image: engine.segment(image, 4)),
+    "two point add": ("pair", lambda pair: engine.two_point(*pair, 0)),
+    "two point subtract": ("pair", lambda pair: engine.two_point(*pair, 1)),
+    "two point blend": ("pair", lambda pair: engine.two_point(*pair, 2, 0.5, 0.5)),
+    "two point and": ("pair", lambda pair: engine.two_point(*pair, 3)),
+    "two point or": ("pair", lambda pair: engine.two_point(*pair, 4)),
+    "two point not": ("pair", lambda pair: engine.two_point(*pair, 5)),
+    "two point xor": ("pair", lambda pair: engine.two_point(*pair, 6)),
+    "stitch": ("stitch", lambda images: engine.stitch(images, True)),
+    "stitch cropped": ("stitch", lambda images: engine.stitch(images, False)),
+    "display color": ("color", lambda image: DISPLAY_BUFFER.update(image)),
+    "display gray": ("gray", lambda image: DISPLAY_BUFFER.update(image)),
+    "display image color": ("color", lambda image: display.to_image(image)),
+    "encode jpeg": ("color", lambda image: export.encode(image, ".jpg")),
+    "encode jpeg progressive": ("color", lambda image: export.encode(image, ".jpg", {"jpeg_progressive": True})),
+    "encode png fast": ("color", lambda image: export.encode(image, ".png", {"png_compression": 1})),
+    "encode tiff": ("color", lambda image: export.encode(image, ".tiff")),
+    "transport pickle": ("color", transport_pickled),
+    "transport shared": ("color", transport_shared),
+}
+
+
+def make_inputs(color: np.ndarray) -> Inputs:
+    '''
+    Prepares every input kind from one color image.
+    '''
+    gray = cv.cvtColor(color, cv.COLOR_BGR2GRAY)
+    return {
+        "color": color,
+        "gray": gray,
+        "binary": engine.segment(gray, 3),
+        "pair": (color, cv.flip(color, 1)),
+    }
+
+
+def synthetic(megapixels: float, source: str = SYNTHETIC_SOURCE) -> np.ndarray:
+    '''
+    Upscales the source image to a square of about the given number of megapixels.
+    '''
+    side = int(math.sqrt(megapixels * 1e6))
+    return cv.resize(cv.imread(source, cv.IMREAD_COLOR), (side, side), interpolation=cv.INTER_CUBIC)
+
+
+def corpus(sizes: List[float], examples: bool = True) -> List[Tuple[str, Inputs]]:
+    '''
+    Returns (name, inputs) of every benchmarked image, the example images first.
+    '''
+    images: List[Tuple[str, Inputs]] = []
+    if examples:
+        for path in sorted(glob.glob(os.path.join(EXAMPLES, "*"))):
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((os.path.basename(path), make_inputs(cv.imread(path, cv.IMREAD_COLOR))))
+        stitch_inputs = {"stitch": [cv.imread(path, cv.IMREAD_COLOR) for path in STITCH_IMAGES]}
+        images.append(("stitch set", stitch_inputs))
+    for megapixels in sizes:
+        images.append((f"synthetic {megapixels:g} MP", make_inputs(synthetic(megapixels))))
+    return images
+
+
+def digest(result: Any) -> str:
+    '''
+    Returns a digest of an operation result, arrays are hashed with their shape and type, images with their size and mode.
+    '''
+    sha = hashlib.sha256()
+    if isinstance(result, np.ndarray):
+        sha.update(f"{result.shape} {result.dtype}".encode())
+        sha.update(np.ascontiguousarray(result).tobytes())
+    elif isinstance(result, Image.Image):
+        sha.update(f"{result.size} {result.mode}".encode())
+        sha.update(result.tobytes())
+    elif isinstance(result, (list, tuple)) and all(isinstance(item, np.ndarray) for item in result):
+        for item in result:
+            sha.update(digest(item).encode())
+    else:
+        # dictionaries of measurements, rounded to be stable
+        sha.update(json.dumps(result, sort_keys=True, default=lambda value: round(float(value), 6)).encode())
+    return sha.hexdigest()
+
+
+def seeded(operation: Callable[[Any], Any], argument: Any) -> Any:
+    '''
+    Runs an operation with the random generators seeded, so its output can be compared.
+    '''
+    # contours are drawn in random colors and the stitcher uses RANSAC
+    random.seed(0)
+    cv.setRNGSeed(0)
+    return operation(argument)
+
+
+def run_case(operation: Callable[[Any], Any], argument: Any, repeat: int) -> Dict[str, Any]:
+    '''
+    Runs an operation once with memory tracing (which also warms up) and then repeat times timed.
+    '''
+    memory = tracing.tracer.memory
+    tracing.tracer.set_memory(True)
+    try:
+        with tracing.span("benchmark", "benchmark") as current:
+            result = seeded(operation, argument)
+    finally:
+        tracing.tracer.set_memory(memory)
+    times: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation(argument)
+        times.append(time.perf_counter() - start)
+    return {
+        "median": float(np.median(times)),
+        "p95": float(np.percentile(times, 95)),
+        "memory": current.peak_memory,
+        "digest": digest(result),
+    }
+
+
+def load(path: str) -> Dict[str, Any]:
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save(path: str, data: Dict[str, Any]) -> None:
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(data, file, indent=1, sort_keys=True)
+
+
+def compare(result: Dict[str, Any], baseline: Optional[Dict[str, Any]], threshold: float) -> List[str]:
+    '''
+    Returns descriptions of the ways the result regressed compared to the baseline.
+    '''
+    if baseline is None:
+        return []
+    problems: List[str] = []
+    if result["median"] > baseline["median"] * (1 + threshold) + TIME_SLACK:
+        problems.append(f"time x{result['median'] / baseline['median']:.2f}")
+    if (result["memory"] is not None and baseline.get("memory") is not None
+            and result["memory"] > baseline["memory"] * (1 + threshold) + MEMORY_SLACK):
+        problems.append(f"memory +{(result['memory'] - baseline['memory']) / 2 ** 20:.1f} MB")
+    return problems
+
+
+def run_suite(images: List[Tuple[str, Inputs]], cases: List[str], repeat: int, threshold: float,
+              baseline: Dict[str, Any], golden: Dict[str, str], out=sys.stdout) -> Dict[str, Any]:
+    '''
+    Benchmarks the cases on every image which has their input kind.
+    Returns the results by case id ("case @ image") and the ids which regressed, changed output or failed.
+    '''
+    results: Dict[str, Any] = {}
+    regressions: List[str] = []
+    mismatches: List[str] = []
+    failures: Dict[str, str] = {}
+    print(f"{'case':<50} {'median ms':>10} {'p95 ms':>10} {'peak MB':>9}  status", file=out)
+    for image_name, inputs in images:
+        for name in cases:
+            kind, operation = CASES[name]
+            if kind not in inputs:
+                continue
+            case_id = f"{name} @ {image_name}"
+            try:
+                result = run_case(operation, inputs[kind], repeat)
+            except Exception as error:
+                failures[case_id] = f"{type(error).__name__}: {error}"
+                print(f"{case_id:<50} FAILED: {failures[case_id]}", file=out)
+                continue
+            results[case_id] = result
+            status = compare(result, baseline.get(case_id), threshold)
+            if status:
+                regressions.append(case_id)
+            if case_id in golden and golden[case_id] != result["digest"]:
+                mismatches.append(case_id)
+                status.append("OUTPUT CHANGED")
+            memory = "" if result["memory"] is None else f"{result['memory'] / 2 ** 20:.1f}"
+            print(f"{case_id:<50} {result['median'] * 1000:>10.2f} {result['p95'] * 1000:>10.2f} {memory:>9}  "
+                  f"{', '.join(status) or 'ok'}", file=out)
+    return {"results": results, "regressions": regressions, "mismatches": mismatches, "failures": failures}
+
+
+def check_reference(images: List[Tuple[str, Inputs]], cases: List[str], golden: Dict[str, str],
+                    out=sys.stdout) -> Dict[str, Any]:
+    '''
+    Runs the original implementation of the cases and compares its outputs with the golden digests,
+    or with the outputs of the engine for cases without one.
+    Returns the ids which differ, except the ones changed by design (reference.CHANGED).
+    '''
+    checked: List[str] = []
+    differences: List[str] = []
+    for image_name, inputs in images:
+        for name in cases:
+            if name not in reference.CASES or CASES[name][0] not in inputs:
+                continue
+            kind, operation = reference.CASES[name]
+            case_id = f"{name} @ {image_name}"
+            expected = golden.get(case_id)
+            if expected is None:
+                expected = digest(seeded(CASES[name][1], inputs[kind]))
+            try:
+                status = "ok" if digest(seeded(operation, inputs[kind])) == expected else "DIFFERENT"
+            except Exception as error:
+                status = f"reference failed: {type(error).__name__}: {error}"
+            if status != "ok" and name in reference.CHANGED:
+                status = f"changed by design: {reference.CHANGED[name]}"
+            elif status != "ok":
+                differences.append(case_id)
+            checked.append(case_id)
+            print(f"{case_id:<50} {status}", file=out)
+    return {"checked": checked, "differences": differences}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="Benchmark the RasterLab operations.")
+    parser.add_argument("--sizes", type=float, nargs="*", default=list(DEFAULT_SIZES),
+                        help="megapixels of the synthetic images (default: 1 10 50)")
+    parser.add_argument("--no-examples", action="store_true", help="skip the images in examples/")
+    parser.add_argument("--only", nargs="+", metavar="WORD",
+                        help="run only the cases whose name contains one of the words")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="timed runs of every case (default: 5)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown counted as a regression (default: 0.25)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--save-golden", action="store_true", help="store the outputs as the golden ones")
+    parser.add_argument("--output", help="also write the results as JSON")
+    parser.add_argument("--reference", action="store_true",
+                        help="check the golden outputs against the original implementation instead of benchmarking")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    cases = [name for name in CASES if not args.only or any(word in name for word in args.only)]
+    if args.list:
+        print("\n".join(f"{name} ({CASES[name][0]})" for name in cases))
+        return 0
+    baseline = load(args.baseline)
+    golden = load(args.golden)
+    if args.reference:
+        check = check_reference(corpus(args.sizes, not args.no_examples), cases, golden)
+        print(f"{len(check['checked'])} cases, {len(check['differences'])} differ from the original implementation")
+        return 1 if check["differences"] else 0
+    report = run_suite(corpus(args.sizes, not args.no_examples), cases, args.repeat, args.threshold,
+                       baseline, golden)
+    results = report["results"]
+    if args.save_baseline:
+        baseline.update({case_id: {key: result[key] for key in ("median", "p95", "memory")}
+                         for case_id, result in results.items()})
+        save(args.baseline, baseline)
+    if args.save_golden:
+        golden.update({case_id: result["digest"] for case_id, result in results.items()})
+        save(args.golden, golden)
+    if args.output:
+        save(args.output, report)
+    print(f"{len(results)} cases, {len(report['regressions'])} regressions, "
+          f"{len(report['mismatches'])} changed outputs, {len(report['failures'])} failed")
+    return 1 if report["regressions"] or report["mismatches"] or report["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+'''
+Display conversion of RasterLab.
+
+Engine results are ndarrays in OpenCV conventions: BGR(A) channel order and
+any of 8-bit, 16-bit, signed or float types. They are converted straight into
+8-bit PIL images for the viewer. 8-bit results are shown as they are, other
+types are mapped linearly from a display window (low, high) to 0-255, by
+default the value range of the result.
+
+Repeatedly shown frames (e.g. live previews) go through a `DisplayBuffer`,
+which converts every frame into the same preallocated buffer and shares it
+with its PIL image, so no array or image is allocated per frame:
+
+    frames = DisplayBuffer()
+    view.set_image(frames.update(result))  # repaints the tiles in place
+'''
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+import time
+import weakref
+import numpy as np
+import cv2 as cv
+from PIL import Image
+import tracing
+
+
+Window = Tuple[float, float]
+
+# id of a read-only image made by to_image -> the array it views, see image_buffer
+_buffers: Dict[int, np.ndarray] = {}
+
+
+def value_range(array: np.ndarray) -> Window:
+    '''
+    Returns the smallest and largest finite value of the array.
+    '''
+    if array.dtype.kind == 'f':
+        finite = array[np.isfinite(array)]
+        if finite.size == 0:
+            return 0.0, 0.0
+        return float(finite.min()), float(finite.max())
+    return float(array.min()), float(array.max())
+
+
+def default_window(array: np.ndarray) -> Optional[Window]:
+    '''
+    Returns the display window used for an array, None for 8-bit arrays shown as they are.
+    '''
+    if array.dtype == np.uint8:
+        return None
+    if array.dtype == np.bool_:
+        return 0.0, 1.0
+    return value_range(array)
+
+
+def to_uint8(array: np.ndarray, window: Optional[Window] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+    '''
+    Maps values from the window to 0-255, values outside of it are clipped.
+    Without a window 8-bit arrays are returned as they are and others are normalized to their value range.
+    out is an 8-bit array of the same shape to write into.
+    '''
+    if window is None:
+        window = default_window(array)
+        if window is None:
+            return array
+    low, high = window
+    scale = 255.0 / (high - low) if high > low else 0.0
+    # values are clipped to the window first, so the absolute value taken by OpenCV changes nothing; NaN maps to 0
+    clipped = np.clip(np.nan_to_num(array.astype(np.float32, copy=False)), low, high)
+    if out is None:
+        return cv.convertScaleAbs(clipped, alpha=scale, beta=-low * scale)
+    return cv.convertScaleAbs(clipped, out, alpha=scale, beta=-low * scale)
+
+
+def to_image(array: np.ndarray, window: Optional[Window] = None) -> Image.Image:
+    '''
+    Converts a result array into a PIL image for display, BGR(A) channels are swapped into RGB(A).
+    '''
+    pixels = to_uint8(array, window)
+    if pixels.ndim == 3 and pixels.shape[2] == 1:
+        pixels = pixels[:, :, 0]
+    if pixels.ndim == 2:
+        pixels, mode = np.ascontiguousarray(pixels), 'L'
+    elif pixels.shape[2] == 4:
+        pixels, mode = cv.cvtColor(pixels, cv.COLOR_BGRA2RGBA), 'RGBA'
+    else:
+        pixels, mode = cv.cvtColor(pixels[:, :, :3], cv.COLOR_BGR2RGB), 'RGB'
+    image = Image.fromarray(pixels, mode)
+    if image.readonly:
+        # PIL views the array instead of copying it, and doesn't tell which one
+        key = id(image)
+        _buffers[key] = pixels
+        weakref.finalize(image, _buffers.pop, key, None)
+    return image
+
+
+def image_buffer(image: Image.Image) -> Optional[np.ndarray]:
+    '''
+    Returns the array a read-only image made by to_image views, None for other images.
+    '''
+    return _buffers.get(id(image))
+
+
+def from_image(image: Image.Image) -> np.ndarray:
+    '''
+    Converts a PIL image into an 8-bit array in OpenCV channel order.
+    '''
+    if image.mode == 'L':
+        return np.asarray(image)
+    if image.mode == 'RGBA':
+        return cv.cvtColor(np.asarray(image), cv.COLOR_RGBA2BGRA)
+    return cv.cvtColor(np.asarray(image.convert('RGB')), cv.COLOR_RGB2BGR)
+
+
+class DisplayBuffer:
+    '''
+    Converts frames for display into a reused buffer.
+    The returned PIL image shares the buffer's memory, so it changes with the next update.
+    Conversions are skipped for 8-bit single channel frames, which are shown as they are.
+    '''
+
+    def __init__(self, history: int = 30) -> None:
+        self.buffer: Optional[np.ndarray] = None
+        self.image: Optional[Image.Image] = None
+        # intermediate 8-bit frame of types other than 8-bit
+        self._scaled: Optional[np.ndarray] = None
+        # seconds the last conversions took
+        self.times: Deque[float] = deque(maxlen=history)
+
+    def _allocate(self, shape: Tuple[int, ...], mode: str) -> np.ndarray:
+        if self.buffer is None or self.buffer.shape != shape:
+            self.buffer = np.empty(shape, np.uint8)
+            self.image = None
+        if self.image is None or self.image.mode != mode:
+            size = (shape[1], shape[0])
+            self.image = Image.frombuffer(mode, size, self.buffer, 'raw', mode, 0, 1)
+        return self.buffer
+
+    def update(self, array: np.ndarray, window: Optional[Window] = None) -> Image.Image:
+        '''
+        Converts a frame in OpenCV conventions into the buffer and returns its image.
+        '''
+        start = time.perf_counter()
+        with tracing.span("display convert", "render") as current:
+            current.input(array)
+            image = self._convert(array, window)
+        self.times.append(time.perf_counter() - start)
+        return image
+
+    def _convert(self, array: np.ndarray, window: Optional[Window]) -> Image.Image:
+        if array.ndim == 3 and array.shape[2] == 1:
+            array = array[:, :, 0]
+        if array.dtype != np.uint8 or window is not None:
+            if self._scaled is None or self._scaled.shape != array.shape:
+                self._scaled = np.empty(array.shape, np.uint8)
+            array = to_uint8(array, window, self._scaled)
+        if array.ndim == 2:
+            if array.flags.c_contiguous:
+                # already in the layout of an "L" image, it's wrapped without copying
+                self.buffer, self.image = None, None
+                return Image.frombuffer('L', (array.shape[1], array.shape[0]), array, 'raw', 'L', 0, 1)
+            np.copyto(self._allocate(array.shape, 'L'), array)
+            return self.image
+        # color images are 4 bytes per pixel in PIL, so RGBA is the only layout it can share
+        buffer = self._allocate((array.shape[0], array.shape[1], 4), 'RGBA')
+        code = cv.COLOR_BGRA2RGBA if array.shape[2] == 4 else cv.COLOR_BGR2RGBA
+        cv.cvtColor(array[:, :, :4] if array.shape[2] > 4 else array, code, buffer)
+        return self.image
+
+    def stats(self) -> Tuple[float, float]:
+        '''
+        Returns the mean time of the recent conversions in milliseconds and the frame rate it allows.
+        '''
+        if not self.times:
+            return 0.0, 0.0
+        mean = sum(self.times) / len(self.times)
+        return mean * 1000, 1 / mean if mean > 0 else float("inf")
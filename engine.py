@@ -0,0 +1,640 @@
+'''
+Headless processing engine of RasterLab.
+
+Every operation available in the GUI is exposed here as a plain function taking
+an ndarray (plus explicit parameters) and returning a new ndarray, so it can be
+used from scripts, worker processes and tests without a display.
+
+Point operations (negate, threshold, posterize, stretch) are channel order
+agnostic. Neighbourhood operations follow OpenCV conventions and expect BGR
+color images, as returned by `cv.imread`.
+
+Operations are recorded by the tracer (see tracing.py), stages of multi-step
+operations as nested spans.
+'''
+from typing import Any, Dict, List, Optional, Tuple
+import random
+import numpy as np
+import cv2 as cv
+import imutils
+import lazy
+import point_ops
+import histogram
+import tiling
+import tracing
+
+
+# only the line profile needs scipy, which is slow to import
+ndimage = lazy.module("scipy.ndimage")
+
+
+# edge modes used by the morph and mask filter menus
+BORDER_MODES: Dict[int, int] = {
+    1: cv.BORDER_CONSTANT,
+    2: cv.BORDER_REPLICATE,
+    3: cv.BORDER_REFLECT,
+    4: cv.BORDER_REFLECT101,
+    5: cv.BORDER_WRAP,
+}
+
+# edge modes used by the filter menu (padding added before filtering)
+PADDING_MODES: Dict[int, int] = {
+    0: cv.BORDER_ISOLATED,
+    1: cv.BORDER_REFLECT,
+    2: cv.BORDER_REPLICATE,
+}
+
+FILTER_PADDING = 10
+
+SHARPEN_KERNELS: Dict[int, np.ndarray] = {
+    5: np.array([
+        [0, -1, 0],
+        [-1, 5, -1],
+        [0, -1, 0]
+    ]),
+    6: np.array([
+        [-1, -1, -1],
+        [-1, 9, -1],
+        [-1, -1, -1]
+    ]),
+    7: np.array([
+        [1, -2, 1],
+        [-2, 5, -2],
+        [1, -2, 1]
+    ]),
+}
+
+# 0-N, 1-W, 2-E, 3-S, 4-NE, 5-NW, 6-SW, 7-SE
+PREWITT_KERNELS: Dict[int, np.ndarray] = {
+    0: np.array([
+        [1, 1, 1],
+        [1, -2, 1],
+        [-1, -1, -1]
+    ]),
+    1: np.array([
+        [1, 1, -1],
+        [1, -2, -1],
+        [1, 1, -1]
+    ]),
+    2: np.array([
+        [-1, 1, 1],
+        [-1, -2, 1],
+        [-1, 1, 1]
+    ]),
+    3: np.array([
+        [-1, -1, -1],
+        [1, -2, 1],
+        [1, 1, 1]
+    ]),
+    4: np.array([
+        [1, 1, 1],
+        [-1, -2, 1],
+        [-1, -1, 1]
+    ]),
+    5: np.array([
+        [1, 1, 1],
+        [1, -2, -1],
+        [1, -1, -1]
+    ]),
+    6: np.array([
+        [1, -1, -1],
+        [1, -2, -1],
+        [1, 1, 1]
+    ]),
+    7: np.array([
+        [-1, -1, 1],
+        [-1, -2, 1],
+        [1, 1, 1]
+    ]),
+}
+
+FILTER_TITLES: Dict[int, str] = {
+    0: 'Gaussian',
+    1: 'Blur',
+    2: 'edge_sobel',
+    3: 'edge_laplacian',
+    4: 'edge_canny',
+    5: 'sharpen_a',
+    6: 'sharpen_b',
+    7: 'sharpen_c',
+    8: 'Prewitt',
+    9: 'Custom',
+    10: 'Median',
+}
+
+MORPH_TITLES: Dict[int, str] = {
+    1: 'erosion',
+    2: 'dilution',
+    3: 'open',
+    4: 'close',
+}
+
+SEGMENTATION_TITLES: Dict[int, str] = {
+    1: "normal thersholding",
+    2: "adaptive thersholding",
+    3: "otsu thersholding",
+    4: "watershedding",
+}
+
+TWO_POINT_TITLES: Dict[int, str] = {
+    0: 'addition',
+    1: 'subtraction',
+    2: 'blend',
+    3: 'and',
+    4: 'or',
+    5: 'not',
+    6: 'xor',
+}
+
+SMOOTHEN_MASK = np.ones((3, 3))
+SHARPEN_MASK = np.array([
+    [1, -2, 1],
+    [-2, 4, -2],
+    [1, -2, 1]
+])
+
+
+def color_channels(image: np.ndarray) -> int:
+    '''
+    Returns the number of color channels of the image, not counting alpha.
+    '''
+    if image.ndim == 2:
+        return 1
+    return 3 if image.shape[2] >= 3 else image.shape[2]
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    '''
+    Returns a greyscale version of a BGR(a) image. Greyscale images are returned as they are.
+    '''
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv.cvtColor(image, cv.COLOR_BGRA2GRAY)
+    return cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+
+
+def to_bgr(image: np.ndarray) -> np.ndarray:
+    '''
+    Returns a 3 channel BGR version of a greyscale or BGRA image.
+    '''
+    if image.ndim == 2:
+        return cv.cvtColor(image, cv.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv.cvtColor(image, cv.COLOR_BGRA2BGR)
+    return image
+
+
+def to_uint8(image: np.ndarray) -> np.ndarray:
+    '''
+    Returns an 8-bit version of a result, taking absolute values of signed and float outputs.
+    '''
+    if image.dtype == np.uint8:
+        return image
+    return cv.convertScaleAbs(image)
+
+
+def border_mode(option: int) -> int:
+    '''
+    Translates an edge mode option from the menus into an OpenCV border type.
+    '''
+    try:
+        return BORDER_MODES[option]
+    except KeyError:
+        raise ValueError(f"Unknown edge mode: {option}") from None
+
+
+@tracing.traced()
+def negate(image: np.ndarray) -> np.ndarray:
+    '''
+    Invert color values on given image. Works on RGB(a) and greyscale arrays, alpha is kept.
+    '''
+    return point_ops.apply_lut(image, point_ops.negate_lut())
+
+
+@tracing.traced()
+def threshold(image: np.ndarray, value: int = 2, simple: bool = True) -> np.ndarray:
+    '''
+    Perform a threshold operation on a greyscale array.
+    Depending on the simple flag value is interpreted as an actual threshold or a number of bins.
+    '''
+    if simple:
+        return point_ops.apply_lut(image, point_ops.threshold_lut(value))
+    return point_ops.apply_lut(image, point_ops.multilevel_lut(value, 255))
+
+
+@tracing.traced()
+def posterize(image: np.ndarray, bins: int) -> np.ndarray:
+    '''
+    Perform posterization on an array, alpha is kept.
+    '''
+    return point_ops.apply_lut(image, point_ops.multilevel_lut(bins, 256))
+
+
+@tracing.traced()
+def stretch(image: np.ndarray, p1: Optional[int] = None, p2: Optional[int] = None,
+            q3: Optional[int] = None, q4: Optional[int] = None, hist: Optional[np.ndarray] = None) -> np.ndarray:
+    '''
+    Performs a histogram value stretch on a greyscale array.
+    If not all 4 parameters are given it defaults to maximum stretch, using hist when it's already known.
+    '''
+    if p1 is None or p2 is None or q3 is None or q4 is None:
+        if hist is None:
+            hist = histogram.gray_histogram(image)
+        start, end = histogram.value_range(hist)
+        q3, q4 = 0, 255
+    else:
+        start, end = int(p1), int(p2)
+        q3, q4 = int(q3), int(q4)
+    return point_ops.apply_lut(image, point_ops.stretch_lut(start, end, q3, q4))
+
+
+def pad(image: np.ndarray, edge_option: int, size: int = FILTER_PADDING) -> np.ndarray:
+    '''
+    Adds a border around the image using the filter menu edge modes.
+    Unknown options leave the image as it is.
+    '''
+    if edge_option not in PADDING_MODES:
+        return image
+    return cv.copyMakeBorder(
+        image, size, size, size, size,
+        PADDING_MODES[edge_option], None, value=0
+    )
+
+
+def filter_kernel(filter_option: int, a: Any = 0) -> Optional[np.ndarray]:
+    '''
+    Returns the convolution kernel used by a filter option, None if it doesn't use one.
+    '''
+    if filter_option in SHARPEN_KERNELS:
+        return SHARPEN_KERNELS[filter_option]
+    if filter_option == 8:
+        return PREWITT_KERNELS[int(a)]
+    if filter_option == 9:
+        return np.asarray(a)
+    return None
+
+
+def convolve(image: np.ndarray, filter_option: int, a: Any = 0, b: Any = 0, c: Any = 0) -> np.ndarray:
+    '''
+    Applies a filter option on an already padded image.
+    '''
+    match filter_option:
+        case 0:
+            return cv.GaussianBlur(image, (5, 5), 0)
+        case 1:
+            return cv.blur(image, (5, 5))
+        case 2:
+            return cv.Sobel(image, cv.CV_64F, a, b, c)
+        case 3:
+            return cv.Laplacian(image, a)
+        case 4:
+            return cv.Canny(image, a, b)
+        case 5 | 6 | 7 | 8 | 9:
+            return cv.filter2D(image, -1, filter_kernel(filter_option, a))
+        case 10:
+            return cv.medianBlur(image, a)
+    raise ValueError(f"Unknown filter option: {filter_option}")
+
+
+def filter_radius(filter_option: int, a: Any = 0, c: Any = 0) -> Optional[int]:
+    '''
+    Returns how far from a pixel the filter option reaches, None if the result isn't local (Canny).
+    '''
+    match filter_option:
+        case 0 | 1:
+            return 2
+        case 2:
+            return max(int(c), 1) // 2 or 1
+        case 3:
+            return 1
+        case 4:
+            return None
+        case 10:
+            return int(a) // 2
+    kernel = filter_kernel(filter_option, a)
+    return max(kernel.shape) // 2 if kernel is not None else None
+
+
+@tracing.traced()
+def apply_filter(image: np.ndarray, filter_option: int, edge_option: int, a: Any = 0, b: Any = 0, c: Any = 0,
+                 tile_size: Optional[int] = None, workers: int = 1, out: tiling.Output = None) -> np.ndarray:
+    '''
+    Performs filter operations on an array depending on parameters given.
+    The result keeps the padding added by the edge mode.
+    With tile_size local filters are computed tile by tile, without a padded copy of the image,
+    and written into out (see tiling.run_tiled).
+    '''
+    radius = filter_radius(filter_option, a, c)
+    if tile_size is None or radius is None:
+        return convolve(pad(image, edge_option), filter_option, a, b, c)
+    if edge_option not in PADDING_MODES:
+        return tiling.run_tiled(
+            image, lambda tile: convolve(tile, filter_option, a, b, c), radius,
+            tile_size, workers=workers, out=out)
+    return tiling.run_tiled(
+        image, lambda tile: convolve(tile, filter_option, a, b, c), radius, tile_size,
+        pad=FILTER_PADDING, pad_border=PADDING_MODES[edge_option], workers=workers, out=out)
+
+
+@tracing.traced()
+def two_point(image1: np.ndarray, image2: np.ndarray, option: int, blend_a: float = 1, blend_b: float = 1) -> np.ndarray:
+    '''
+    Performs a two point operation on two compatible arrays.
+    '''
+    match option:
+        case 0:  # add
+            return cv.add(image1, image2)
+        case 1:  # subtract
+            return cv.subtract(image1, image2)
+        case 2:  # blend
+            return cv.addWeighted(image1, float(blend_a), image2, float(blend_b), 0)
+        case 3:  # and
+            return cv.bitwise_and(image1, image2)
+        case 4:  # or
+            return cv.bitwise_or(image1, image2)
+        case 5:  # not
+            return cv.bitwise_not(image1)
+        case 6:  # xor
+            return cv.bitwise_xor(image1, image2)
+    raise ValueError(f"Unknown two point option: {option}")
+
+
+def morph_kernel(shape: int, size: int) -> np.ndarray:
+    '''
+    Generates a structuring element, 1 - rombus, 2 - square.
+    '''
+    match shape:
+        case 1:  # rombus
+            r = size
+            return np.uint8(np.add.outer(*[np.r_[:r, r: -1: -1]]*2) >= r)
+        case 2:  # square
+            return cv.getStructuringElement(cv.MORPH_RECT, (size, size))
+    raise ValueError(f"Unknown kernel shape: {shape}")
+
+
+def morph_radius(operation: int, shape: int, edge: int, size: int, iterations: int = 2) -> Optional[int]:
+    '''
+    Returns how far from a pixel the morph operation reaches, None if the result isn't local (wrapped edges).
+    '''
+    if border_mode(edge) == cv.BORDER_WRAP:
+        return None
+    reach = iterations * (max(morph_kernel(shape, size).shape) // 2)
+    # open and close apply the kernel twice per iteration
+    return 2 * reach if operation in (3, 4) else reach
+
+
+@tracing.traced()
+def morph(image: np.ndarray, operation: int, shape: int, edge: int, size: int, iterations: int = 2,
+          tile_size: Optional[int] = None, workers: int = 1, out: tiling.Output = None) -> np.ndarray:
+    '''
+    Performs a morph operation, 1 - erode, 2 - dilate, 3 - open, 4 - close.
+    With tile_size the operation is computed tile by tile into out.
+    '''
+    kernel = morph_kernel(shape, size)
+    edge_mode = border_mode(edge)
+    radius = morph_radius(operation, shape, edge, size, iterations)
+    if tile_size is not None and radius is not None:
+        return tiling.run_tiled(
+            image, lambda tile: morph(tile, operation, shape, edge, size, iterations),
+            radius, tile_size, workers=workers, out=out)
+    match operation:
+        case 1:  # Erode
+            return cv.erode(image, kernel, iterations=iterations, borderType=edge_mode)
+        case 2:  # Dilate
+            return cv.dilate(image, kernel, iterations=iterations, borderType=edge_mode)
+        case 3:  # Open
+            return cv.morphologyEx(image, cv.MORPH_OPEN, kernel, iterations=iterations, borderType=edge_mode)
+        case 4:  # Close
+            return cv.morphologyEx(image, cv.MORPH_CLOSE, kernel, iterations=iterations, borderType=edge_mode)
+    raise ValueError(f"Unknown morph operation: {operation}")
+
+
+@tracing.traced()
+def mask_filter(image: np.ndarray, stages: int, mask: int, edge: int,
+                tile_size: Optional[int] = None, workers: int = 1, out: tiling.Output = None) -> np.ndarray:
+    '''
+    Performs one (chosen mask) or two stage (smoothen, then sharpen) mask filtering.
+    The result is a float64 array. With tile_size it's computed tile by tile into out.
+    '''
+    edge_mode = border_mode(edge)
+    if tile_size is not None and edge_mode != cv.BORDER_WRAP:
+        return tiling.run_tiled(
+            image, lambda tile: mask_filter(tile, stages, mask, edge), stages, tile_size,
+            workers=workers, out=out)
+    match mask:
+        case 1:
+            chosen_mask = SHARPEN_MASK
+        case 2:
+            chosen_mask = SMOOTHEN_MASK
+        case _:
+            raise ValueError(f"Unknown mask: {mask}")
+    match stages:
+        case 1:  # one stage
+            return cv.filter2D(image, cv.CV_64F, chosen_mask, borderType=edge_mode)
+        case 2:  # two stage
+            result = cv.filter2D(image, cv.CV_64F, SMOOTHEN_MASK, borderType=edge_mode)
+            return cv.filter2D(result, cv.CV_64F, SHARPEN_MASK, borderType=edge_mode)
+    raise ValueError(f"Unknown number of stages: {stages}")
+
+
+@tracing.traced()
+def skeletonize(image: np.ndarray) -> np.ndarray:
+    '''
+    Returns a skeletonized version of a greyscale array.
+    '''
+    img = to_gray(image).copy()  # don't clobber original
+    skel = np.zeros_like(img)
+    kernel = cv.getStructuringElement(cv.MORPH_CROSS, (3, 3))
+
+    while True:
+        eroded = cv.morphologyEx(img, cv.MORPH_ERODE, kernel)
+        temp = cv.morphologyEx(eroded, cv.MORPH_DILATE, kernel)
+        temp = cv.subtract(img, temp)
+        skel = cv.bitwise_or(skel, temp)
+        img[:, :] = eroded[:, :]
+        if cv.countNonZero(img) == 0:
+            break
+
+    return skel
+
+
+def otsu(image: np.ndarray) -> int:
+    '''
+    Returns the Otsu threshold of a greyscale array using its cached histogram.
+    '''
+    return histogram.otsu_threshold(histogram.gray_histogram(image))
+
+
+@tracing.traced()
+def watershed(image: np.ndarray) -> np.ndarray:
+    '''
+    Segments a color array with the watershed algorithm and returns colored markers.
+    '''
+    with tracing.span("watershed: threshold"):
+        img = to_bgr(image).copy()
+        # Convert to greyscale.
+        img_gray = to_gray(img)
+        ret2, thresh = cv.threshold(
+            img_gray, otsu(img_gray), 255, cv.THRESH_BINARY_INV)
+    with tracing.span("watershed: background"):
+        kernel = np.ones((3, 3), np.uint8)
+        # Reduce the noise pollution.
+        opening = cv.morphologyEx(
+            thresh, cv.MORPH_OPEN, kernel, iterations=1)
+        sure_bg = cv.dilate(opening, kernel, iterations=1)
+    with tracing.span("watershed: distance transform"):
+        dist_transform = cv.distanceTransform(opening, cv.DIST_L2, 5)
+        # Find clean objects by distance transforming.
+        ret, sure_fg = cv.threshold(
+            dist_transform, 0.5*dist_transform.max(), 255, 0)
+        sure_fg = np.uint8(sure_fg)
+    with tracing.span("watershed: markers"):
+        # Find uncertain objects.
+        unknown = cv.subtract(sure_bg, sure_fg)
+        # Mark found objects.
+        ret, markers = cv.connectedComponents(sure_fg)
+        markers = markers+1
+        markers[unknown == 255] = 0
+
+    with tracing.span("watershed: flood"):
+        markers2 = cv.watershed(img, markers)
+    with tracing.span("watershed: color map"):
+        return cv.applyColorMap((markers2*10).astype(np.uint8), cv.COLORMAP_JET)
+
+
+@tracing.traced()
+def segment(image: np.ndarray, mode: int, value: int = 0) -> np.ndarray:
+    '''
+    Performs segmentation, 1 - normal, 2 - adaptive, 3 - otsu, 4 - watershed.
+    '''
+    match mode:
+        case 1:
+            ret, result = cv.threshold(to_gray(image), value, 255, cv.THRESH_BINARY)
+            return result
+        case 2:
+            return cv.adaptiveThreshold(to_gray(image), 255, cv.ADAPTIVE_THRESH_MEAN_C,
+                                        cv.THRESH_BINARY, 11, 2)
+        case 3:
+            blur = cv.GaussianBlur(to_gray(image), (5, 5), 0)
+            ret3, result = cv.threshold(
+                blur, otsu(blur), 255, cv.THRESH_BINARY)
+            return result
+        case 4:
+            return watershed(image)
+    raise ValueError(f"Unknown segmentation mode: {mode}")
+
+
+@tracing.traced()
+def crop_stitched(stitched_img: np.ndarray) -> np.ndarray:
+    '''
+    Cuts the largest rectangle without black padding out of a stitched panorama.
+    '''
+    # add black padding to the image
+    stitched_img = cv.copyMakeBorder(
+        stitched_img, 10, 10, 10, 10,
+        cv.BORDER_CONSTANT, (0, 0, 0)
+    )
+    gray = cv.cvtColor(stitched_img, cv.COLOR_BGR2GRAY)
+    # isolate contours as black pixels
+    thresh_img = cv.threshold(gray, 0, 255, cv.THRESH_BINARY)[1]
+
+    contours = cv.findContours(
+        thresh_img.copy(), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+
+    contours = imutils.grab_contours(contours)
+    # from found contours locate area of interest
+    areaOI = max(contours, key=cv.contourArea)
+
+    mask = np.zeros(thresh_img.shape, dtype="uint8")
+    # create area to be cut from the original image
+    x, y, w, h = cv.boundingRect(areaOI)
+    cv.rectangle(mask, (x, y), (x + w, y + h), 255, -1)
+
+    minRectangle = mask.copy()
+    sub = mask.copy()
+    # find the minimum area with the image
+    with tracing.span("crop_stitched: erode loop") as current:
+        iterations = 0
+        while cv.countNonZero(sub) > 0:
+            minRectangle = cv.erode(minRectangle, None)
+            sub = cv.subtract(minRectangle, thresh_img)
+            iterations += 1
+        current.args["iterations"] = iterations
+
+    contours = cv.findContours(
+        minRectangle.copy(), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+
+    contours = imutils.grab_contours(contours)
+    areaOI = max(contours, key=cv.contourArea)
+
+    x, y, w, h = cv.boundingRect(areaOI)
+    # from the original stitched image "cut" only the rectangle
+    return stitched_img[y:y + h, x:x + w]
+
+
+@tracing.traced()
+def stitch(images: List[np.ndarray], raw: bool = True) -> np.ndarray:
+    '''
+    Stitches BGR arrays into a panorama. Unless raw, black padding is cut off.
+    Raises RuntimeError when OpenCV can't stitch the images.
+    '''
+    with tracing.span("stitch: stitcher"):
+        stitcher = cv.Stitcher_create()
+        error, stitched_img = stitcher.stitch(images)
+    if error:
+        raise RuntimeError(f"Stitching failed with status {error}.")
+    if raw:
+        return stitched_img
+    return crop_stitched(stitched_img)
+
+
+@tracing.traced()
+def draw_contours(image: np.ndarray) -> np.ndarray:
+    '''
+    Returns an RGB array with found contours marked in random colors.
+    '''
+    ret, thresh = cv.threshold(to_gray(image), 127, 255, 0)
+    contours, hierarchy = cv.findContours(
+        thresh, cv.RETR_CCOMP, cv.CHAIN_APPROX_NONE)
+    img3 = cv.cvtColor(thresh, cv.COLOR_GRAY2RGB)
+    for cnt in contours:
+        cv.drawContours(img3, [cnt], 0, (random.randrange(
+            50, 200, 25), random.randrange(50, 200, 25), random.randrange(50, 200, 25)), 3)
+    return img3
+
+
+@tracing.traced()
+def find_objects(image: np.ndarray) -> Dict[str, Any]:
+    '''
+    Locates objects on a greyscale array and describes the first one found.
+    Image moments are included under their OpenCV names.
+    '''
+    img = to_gray(image)
+    ret, thresh = cv.threshold(img, 127, 255, 0)
+    contours, hierarchy = cv.findContours(
+        thresh, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
+    data: Dict[str, Any] = {"count": len(contours)}
+    if contours:
+        cnt = contours[0]
+        area = cv.contourArea(cnt)
+        x, y, w, h = cv.boundingRect(cnt)
+        hull_area = cv.contourArea(cv.convexHull(cnt))
+        data["area"] = area
+        data["perimeter"] = cv.arcLength(cnt, True)
+        data["aspect_ratio"] = float(w) / h
+        data["extent"] = float(area) / (w * h)
+        data["solidity"] = float(area) / hull_area if hull_area else 0.0
+        data["equivalent_diameter"] = np.sqrt(4 * area / np.pi)
+    data["moments"] = cv.moments(img)
+    return data
+
+
+@tracing.traced()
+def line_profile(image: np.ndarray, start: Tuple[int, int], end: Tuple[int, int], samples: int = 100) -> np.ndarray:
+    '''
+    Samples values of a greyscale array along the line connecting two (x, y) points.
+    '''
+    x = np.linspace(start[0], end[0], samples)
+    y = np.linspace(start[1], end[1], samples)
+    return ndimage.map_coordinates(image, (y, x))
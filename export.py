@@ -0,0 +1,171 @@
+'''
+Image export of RasterLab.
+
+The format of a saved image follows the extension of its name; encoder knobs
+trade speed for size:
+
+    png_compression   zlib level 0-9, 0 is fastest and largest
+    jpeg_quality      0-100
+    jpeg_progressive  progressive JPEG, smaller but slower to encode
+    webp_quality      0-100, above 100 is lossless
+    tiff_compression  "none", "lzw", "deflate" or "packbits"
+    tiff_rows         rows per strip of TIFF files
+
+Encoding doesn't touch Tk and OpenCV releases the GIL while it encodes, so
+images are saved on worker threads and several of them can be encoded at once.
+Every save is traced and added to the shared `totals`, which report the encode
+throughput. .npy and .raw files are written as arrays, keeping their type.
+'''
+from typing import Any, Dict, List, Optional
+import os
+import threading
+import time
+import numpy as np
+import cv2 as cv
+import engine
+import mapped
+import tracing
+
+
+OUTPUT_DIR = "output"
+DEFAULT_EXTENSION = ".png"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.tif', '.tiff', '.bmp')
+ARRAY_EXTENSIONS = ('.npy', '.raw')
+
+DEFAULT_OPTIONS: Dict[str, Any] = {
+    "png_compression": 3,
+    "jpeg_quality": 95,
+    "jpeg_progressive": False,
+    "webp_quality": 101,
+    "tiff_compression": "lzw",
+    "tiff_rows": 256,
+}
+
+TIFF_COMPRESSION = {
+    "none": 1,
+    "lzw": 5,
+    "deflate": 8,
+    "packbits": 32773,
+}
+
+
+def output_path(name: str, directory: str = OUTPUT_DIR) -> str:
+    '''
+    Returns where an image with the given name is saved, names without a known extension get the default one.
+    '''
+    if not name.lower().endswith(IMAGE_EXTENSIONS + ARRAY_EXTENSIONS):
+        name += DEFAULT_EXTENSION
+    return os.path.join(directory, name)
+
+
+def encode_params(extension: str, options: Optional[Dict[str, Any]] = None) -> List[int]:
+    '''
+    Returns the cv.imwrite parameters of the options for a file extension.
+    '''
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    extension = extension.lower()
+    if extension == '.png':
+        return [cv.IMWRITE_PNG_COMPRESSION, int(options["png_compression"])]
+    if extension in ('.jpg', '.jpeg'):
+        return [cv.IMWRITE_JPEG_QUALITY, int(options["jpeg_quality"]),
+                cv.IMWRITE_JPEG_PROGRESSIVE, int(bool(options["jpeg_progressive"]))]
+    if extension == '.webp':
+        return [cv.IMWRITE_WEBP_QUALITY, int(options["webp_quality"])]
+    if extension in ('.tif', '.tiff'):
+        return [cv.IMWRITE_TIFF_COMPRESSION, TIFF_COMPRESSION[options["tiff_compression"]],
+                cv.IMWRITE_TIFF_ROWSPERSTRIP, int(options["tiff_rows"])]
+    return []
+
+
+def encodable(image: np.ndarray, extension: str) -> np.ndarray:
+    '''
+    Returns the image in a type the format can store: PNG and TIFF keep 16-bit, TIFF keeps float32 too.
+    '''
+    extension = extension.lower()
+    if image.dtype == np.uint8:
+        return image
+    if image.dtype == np.uint16 and extension in ('.png', '.tif', '.tiff'):
+        return image
+    if image.dtype == np.float32 and extension in ('.tif', '.tiff'):
+        return image
+    return engine.to_uint8(image)
+
+
+def encode(image: np.ndarray, extension: str, options: Optional[Dict[str, Any]] = None) -> np.ndarray:
+    '''
+    Encodes an image in OpenCV conventions into the bytes of a file with the given extension.
+    '''
+    ok, encoded = cv.imencode(extension, encodable(image, extension), encode_params(extension, options))
+    if not ok:
+        raise ValueError(f"Can't encode image as {extension}")
+    return encoded
+
+
+class Throughput:
+    '''
+    Totals of finished saves.
+    '''
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.pixels = 0
+        self.bytes = 0
+        # time spent encoding and writing, summed over the threads
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, pixels: int, size: int, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.pixels += pixels
+            self.bytes += size
+            self.seconds += seconds
+
+    def summary(self) -> Dict[str, float]:
+        '''
+        Returns the totals with the throughput of a single encoding thread.
+        '''
+        with self._lock:
+            seconds = self.seconds or float("inf")
+            return {
+                "count": self.count,
+                "bytes": self.bytes,
+                "seconds": self.seconds,
+                "megapixels_per_second": self.pixels / 1e6 / seconds,
+                "megabytes_per_second": self.bytes / 2 ** 20 / seconds,
+            }
+
+
+# totals shared by the whole program
+totals = Throughput()
+
+
+def save(image: np.ndarray, path: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    '''
+    Encodes and writes an image, creating its directory.
+    Returns the path, the size of the file, the seconds it took and the throughput in megapixels per second.
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    start = time.perf_counter()
+    with tracing.span("save", "save", path=path) as current:
+        current.input(image)
+        if extension in ARRAY_EXTENSIONS:
+            mapped.save(path, image)
+            size = os.path.getsize(path)
+        else:
+            encoded = encode(image, extension, options)
+            with open(path, "wb") as file:
+                file.write(encoded.tobytes())
+            size = encoded.nbytes
+        current.args["bytes"] = size
+    seconds = time.perf_counter() - start
+    pixels = image.shape[0] * image.shape[1]
+    totals.add(pixels, size, seconds)
+    return {
+        "path": path,
+        "bytes": size,
+        "seconds": seconds,
+        "megapixels_per_second": pixels / 1e6 / seconds if seconds else float("inf"),
+    }
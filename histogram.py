@@ -0,0 +1,207 @@
+'''
+Histogram engine of RasterLab.
+
+Histograms are fixed size integer arrays of shape (channels, 256) computed with
+a single `np.bincount` over all channels at once. Results are memoized per
+image object (PIL image or ndarray) and an optional version, so every analysis
+of the same image reuses one scan of the pixels.
+
+Joint histograms of two or three channels (hue-saturation, a*-b*, the RGB
+cube) pack the bin of every channel into one index through lookup tables and
+count them with a single `np.bincount` as well. They are memoized next to the
+per-channel histograms.
+'''
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+import threading
+import weakref
+import numpy as np
+import cv2 as cv
+
+
+# number of pixels binned at once, bounds the size of the temporary index array
+CHUNK_PIXELS = 1 << 20
+# packed indices of joint histograms are gathered in chunks which stay in the CPU cache
+JOINT_CHUNK_PIXELS = 1 << 16
+
+# id of the source object -> {kind: (version, result)}
+_cache: Dict[int, Dict[str, Tuple[Any, Any]]] = {}
+_lock = threading.Lock()
+
+
+def as_array(source: Any) -> np.ndarray:
+    '''
+    Returns an ndarray view of a PIL image or an ndarray.
+    '''
+    return source if isinstance(source, np.ndarray) else np.asarray(source)
+
+
+def channel_histograms(image: np.ndarray) -> np.ndarray:
+    '''
+    Counts the values of every channel of an 8-bit array in one pass.
+    Returns an int64 array of shape (channels, 256).
+    '''
+    if image.dtype != np.uint8:
+        raise ValueError("Histograms can only be computed for 8-bit images.")
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    pixels = image.reshape(-1, channels)
+    # shift every channel into its own range of bins
+    offsets = (np.arange(channels, dtype=np.uint16) * 256)[None, :]
+    counts = np.zeros(channels * 256, dtype=np.int64)
+    for start in range(0, pixels.shape[0], CHUNK_PIXELS):
+        chunk = pixels[start:start + CHUNK_PIXELS].astype(np.uint16) + offsets
+        counts += np.bincount(chunk.ravel(), minlength=channels * 256)
+    return counts.reshape(channels, 256)
+
+
+def _forget(key: int) -> None:
+    with _lock:
+        _cache.pop(key, None)
+
+
+def cached(source: Any, kind: str, compute: Callable[[], Any], version: Any = None) -> Any:
+    '''
+    Returns the result of compute for the source object, computing it only once per version.
+    Entries are dropped together with the source object.
+    '''
+    key = id(source)
+    with _lock:
+        entries = _cache.get(key)
+        if entries is not None and kind in entries and entries[kind][0] == version:
+            return entries[kind][1]
+    result = compute()
+    with _lock:
+        if key not in _cache:
+            try:
+                weakref.finalize(source, _forget, key)
+            except TypeError:
+                # objects which can't be weakly referenced aren't cached
+                return result
+            _cache[key] = {}
+        _cache[key][kind] = (version, result)
+    return result
+
+
+def histogram(source: Any, version: Any = None) -> np.ndarray:
+    '''
+    Returns the (channels, 256) histogram of a PIL image or ndarray, memoized per object and version.
+    '''
+    return cached(source, "channels", lambda: channel_histograms(as_array(source)), version)
+
+
+# joint histogram name -> (conversion of RGB pixels or None, channels, value range of each channel, axis labels)
+COLOR_SPACES: Dict[str, Tuple[Optional[int], Tuple[int, ...], Tuple[int, ...], Tuple[str, ...]]] = {
+    "hs": (cv.COLOR_RGB2HSV, (0, 1), (180, 256), ("hue", "saturation")),
+    "ab": (cv.COLOR_RGB2Lab, (1, 2), (256, 256), ("a*", "b*")),
+    "rgb": (None, (0, 1, 2), (256, 256, 256), ("red", "green", "blue")),
+}
+
+
+def bin_lut(bins: int, limit: int, stride: int) -> np.ndarray:
+    '''
+    Returns a table mapping 8-bit values from 0 to limit - 1 to their bin of bins, times stride.
+    '''
+    return (np.minimum(np.arange(256) * bins // limit, bins - 1) * stride).astype(np.intp)
+
+
+def joint_counts(pixels: np.ndarray, channels: Sequence[int], bins: Sequence[int],
+                 ranges: Sequence[int]) -> np.ndarray:
+    '''
+    Counts the combinations of binned values of channels of 8-bit pixels (a C-contiguous (count, channels) array)
+    in one pass. A channel with values 0 to range - 1 is split into its number of equal bins.
+    Returns an int64 array with one axis per channel.
+    '''
+    # bin of every channel times its stride in the packed index, so packing is only lookups and sums
+    strides = [int(np.prod(bins[index + 1:])) for index in range(len(bins))]
+    luts = [bin_lut(count, limit, stride) for count, limit, stride in zip(bins, ranges, strides)]
+    count = pixels.shape[0]
+    # neighbouring channels are read as one little-endian 16-bit value and looked up together
+    terms = []
+    index = 0
+    while index < len(channels):
+        if index + 1 < len(channels) and channels[index + 1] == channels[index] + 1:
+            values = np.ndarray((count,), '<u2', buffer=pixels, offset=channels[index],
+                                strides=(pixels.strides[0],))
+            pair = np.arange(65536)
+            terms.append((values, luts[index][pair & 255] + luts[index + 1][pair >> 8]))
+            index += 2
+        else:
+            terms.append((pixels[:, channels[index]], luts[index]))
+            index += 1
+    size = int(np.prod(bins))
+    counts = np.zeros(size, dtype=np.int64)
+    packed = np.empty(min(JOINT_CHUNK_PIXELS, count), dtype=np.intp)
+    term = np.empty_like(packed)
+    for start in range(0, count, JOINT_CHUNK_PIXELS):
+        length = min(JOINT_CHUNK_PIXELS, count - start)
+        (values, lut), *others = terms
+        np.take(lut, values[start:start + length], out=packed[:length])
+        for values, lut in others:
+            np.take(lut, values[start:start + length], out=term[:length])
+            packed[:length] += term[:length]
+        counts += np.bincount(packed[:length], minlength=size)
+    return counts.reshape(tuple(bins))
+
+
+def color_histogram(image: np.ndarray, space: str, bins: int = 32) -> np.ndarray:
+    '''
+    Returns the joint histogram of an 8-bit RGB(A) array in a space of COLOR_SPACES, with bins per channel.
+    '''
+    if image.dtype != np.uint8 or image.ndim != 3 or image.shape[2] < 3:
+        raise ValueError("Color histograms can only be computed for 8-bit color images.")
+    conversion, channels, ranges, labels = COLOR_SPACES[space]
+    pixels = np.ascontiguousarray(image[:, :, :3])
+    if conversion is not None:
+        pixels = cv.cvtColor(pixels, conversion)
+    return joint_counts(pixels.reshape(-1, 3), channels, [bins] * len(channels), ranges)
+
+
+def joint_histogram(source: Any, space: str, bins: int = 32, version: Any = None) -> np.ndarray:
+    '''
+    Returns the joint histogram of a PIL image or an ndarray in RGB order, memoized per object and version.
+    '''
+    return cached(source, f"joint {space} {bins}", lambda: color_histogram(as_array(source), space, bins), version)
+
+
+def invalidate(source: Any) -> None:
+    '''
+    Drops every cached result of the source object.
+    '''
+    _forget(id(source))
+
+
+def value_range(counts: np.ndarray) -> Tuple[int, int]:
+    '''
+    Returns the lowest and the highest level present in a 256 bin histogram.
+    '''
+    present = np.flatnonzero(counts)
+    if not present.size:
+        return 0, 0
+    return int(present[0]), int(present[-1])
+
+
+def otsu_threshold(counts: np.ndarray) -> int:
+    '''
+    Returns the threshold maximizing the between class variance of a 256 bin histogram.
+    Pixels above the returned level belong to the foreground, as in cv.THRESH_OTSU.
+    '''
+    total = counts.sum()
+    if not total:
+        return 0
+    p = counts / total
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(256))
+    eps = np.finfo(np.float32).eps
+    valid = (np.minimum(omega, 1 - omega) >= eps) & (np.maximum(omega, 1 - omega) <= 1 - eps)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))
+    sigma = np.where(valid, sigma, -1)
+    if sigma.max() < 0:
+        return 0
+    return int(np.argmax(sigma))
+
+
+def gray_histogram(image: np.ndarray, version: Optional[Any] = None) -> np.ndarray:
+    '''
+    Returns the 256 bin histogram of a greyscale array.
+    '''
+    return histogram(image, version)[0]
@@ -0,0 +1,284 @@
+'''
+Undo history of RasterLab.
+
+Operations applied to an image in place are recorded as steps. Only the
+current state of the image is kept whole; every step keeps the operation that
+produced it (to compute it again) and, while memory allows, a delta: the tiles
+of the other state which differ from the one shown. Undoing a step copies the
+current array, restores the tiles of the delta and keeps the replaced tiles as
+the delta for redoing it, so unchanged tiles are never stored twice.
+
+    image_history = History(image)
+    image_history.apply("median", lambda array: engine.apply_filter(array, 10, 1, 5))
+    image_history.undo()  # returns the previous array
+    image_history.redo()
+
+Histories share a `HistoryBudget`. When their deltas take more memory than the
+budget, deltas are dropped starting from the ones cheapest to compute again
+for the bytes they hold; a step without a delta is recomputed when needed
+(undo replays the steps from the original image, redo runs the step again).
+Undoing the first step needs no delta at all, the original image is kept.
+'''
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+import time
+import numpy as np
+import tracing
+
+
+TILE_SIZE = 256
+DEFAULT_BUDGET_BYTES = 256 * 1024 * 1024
+
+Tiles = Dict[Tuple[int, int], np.ndarray]
+
+
+def changed_tiles(old: np.ndarray, new: np.ndarray, tile_size: int = TILE_SIZE) -> Optional[Tiles]:
+    '''
+    Returns copies of the tiles of old which differ in new, None if the arrays differ in shape or type.
+    '''
+    if old.shape != new.shape or old.dtype != new.dtype:
+        return None
+    tiles: Tiles = {}
+    height, width = old.shape[:2]
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            window = (slice(top, top + tile_size), slice(left, left + tile_size))
+            if not np.array_equal(old[window], new[window]):
+                tiles[(top, left)] = old[window].copy()
+    return tiles
+
+
+class Step:
+    '''
+    Operation applied to an image, with the delta to the state on its other side if it's kept.
+    '''
+    __slots__ = ("name", "recipe", "cost", "tiles", "full")
+
+    def __init__(self, name: str, recipe: Callable[[np.ndarray], np.ndarray], cost: float) -> None:
+        self.name = name
+        # computes the state after the step from the state before it
+        self.recipe = recipe
+        # seconds the operation took
+        self.cost = cost
+        # tiles of the other state which differ, or the whole other state if its shape or type differs
+        self.tiles: Optional[Tiles] = None
+        self.full: Optional[np.ndarray] = None
+
+    def __repr__(self) -> str:
+        return f"Step({self.name}, {self.cost * 1000:.1f} ms, {self.memory()} B)"
+
+    def memory(self) -> int:
+        if self.full is not None:
+            return self.full.nbytes
+        if self.tiles is not None:
+            return sum(tile.nbytes for tile in self.tiles.values())
+        return 0
+
+    @property
+    def has_delta(self) -> bool:
+        return self.tiles is not None or self.full is not None
+
+    def store(self, other: np.ndarray, shown: np.ndarray, tile_size: int) -> None:
+        '''
+        Keeps the delta from the shown state to the other one.
+        '''
+        self.tiles = changed_tiles(other, shown, tile_size)
+        self.full = other if self.tiles is None else None
+
+    def drop(self) -> int:
+        freed = self.memory()
+        self.tiles = None
+        self.full = None
+        return freed
+
+    def swap(self, shown: np.ndarray, tile_size: int) -> np.ndarray:
+        '''
+        Returns the other state restored from the delta, which becomes the delta back to the shown state.
+        '''
+        if self.full is not None:
+            other, self.full = self.full, shown
+            self.tiles = None
+            return other
+        other = shown.copy()
+        replaced: Tiles = {}
+        for (top, left), tile in self.tiles.items():
+            window = (slice(top, top + tile_size), slice(left, left + tile_size))
+            replaced[(top, left)] = shown[window].copy()
+            other[window] = tile
+        self.tiles = replaced
+        other.flags.writeable = False
+        return other
+
+
+class HistoryBudget:
+    '''
+    Memory budget shared by histories.
+    '''
+
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_BYTES) -> None:
+        self.budget_bytes = budget_bytes
+        self.histories: List["History"] = []
+        self.drops = 0
+        self._lock = threading.RLock()
+
+    def memory(self) -> int:
+        with self._lock:
+            return sum(history.memory() for history in self.histories)
+
+    def enforce(self) -> None:
+        '''
+        Drops deltas, cheapest to compute again per byte first, until the histories fit in the budget.
+        '''
+        with self._lock:
+            usage = self.memory()
+            if usage <= self.budget_bytes:
+                return
+            candidates = []
+            for history in self.histories:
+                with history._lock:
+                    candidates += [(history.recompute_cost(index) / step.memory(), history, step)
+                                   for index, step in enumerate(history.steps) if step.memory()]
+            for value, history, step in sorted(candidates, key=lambda candidate: candidate[0]):
+                if usage <= self.budget_bytes:
+                    break
+                with history._lock:
+                    usage -= step.drop()
+                self.drops += 1
+
+    def set_budget(self, budget_bytes: int) -> None:
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self.enforce()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "histories": len(self.histories),
+                "steps": sum(len(history.steps) for history in self.histories),
+                "size_bytes": self.memory(),
+                "budget_bytes": self.budget_bytes,
+                "drops": self.drops,
+            }
+
+
+class History:
+    '''
+    Undo and redo steps of one image.
+    Arrays handed out are read-only, they may be shown while the history goes on.
+    '''
+
+    def __init__(self, image: np.ndarray, budget: Optional[HistoryBudget] = None,
+                 tile_size: int = TILE_SIZE) -> None:
+        self.original = image
+        self.current = image
+        self.steps: List[Step] = []
+        # number of applied steps, the ones after it can be redone
+        self.position = 0
+        self.tile_size = tile_size
+        self.budget = budget if budget is not None else HistoryBudget()
+        self._lock = threading.RLock()
+        with self.budget._lock:
+            self.budget.histories.append(self)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    @property
+    def can_undo(self) -> bool:
+        return self.position > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return self.position < len(self.steps)
+
+    def memory(self) -> int:
+        return sum(step.memory() for step in self.steps)
+
+    def recompute_cost(self, index: int) -> float:
+        '''
+        Returns the seconds it would take to get the other state of a step without its delta.
+        '''
+        if index < self.position:
+            # undo replays the steps before it from the original
+            return sum(step.cost for step in self.steps[:index])
+        return self.steps[index].cost
+
+    def _run(self, step: Step, image: np.ndarray) -> np.ndarray:
+        with tracing.span(f"recompute {step.name}", "history"):
+            result = step.recipe(image)
+        result.flags.writeable = False
+        return result
+
+    def apply(self, name: str, recipe: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        '''
+        Runs an operation on the current state and records it, dropping the steps which could be redone.
+        '''
+        with self._lock:
+            start = time.perf_counter()
+            with tracing.span(name, "history"):
+                result = recipe(self.current)
+            result.flags.writeable = False
+            step = Step(name, recipe, time.perf_counter() - start)
+            del self.steps[self.position:]
+            if self.position > 0:
+                # the original is kept anyway, so the first step never needs a delta
+                step.store(self.current, result, self.tile_size)
+            self.steps.append(step)
+            self.position += 1
+            self.current = result
+        self.budget.enforce()
+        return result
+
+    def undo(self) -> Optional[np.ndarray]:
+        '''
+        Returns the state before the last applied step, None if there is nothing to undo.
+        '''
+        with self._lock:
+            if not self.can_undo:
+                return None
+            step = self.steps[self.position - 1]
+            with tracing.span(f"undo {step.name}", "history", recomputed=not step.has_delta and self.position > 1):
+                if step.has_delta:
+                    previous = step.swap(self.current, self.tile_size)
+                else:
+                    previous = self.original
+                    for earlier in self.steps[:self.position - 1]:
+                        previous = self._run(earlier, previous)
+                    step.store(self.current, previous, self.tile_size)
+            self.position -= 1
+            self.current = previous
+        self.budget.enforce()
+        return previous
+
+    def redo(self) -> Optional[np.ndarray]:
+        '''
+        Returns the state after the next undone step, None if there is nothing to redo.
+        '''
+        with self._lock:
+            if not self.can_redo:
+                return None
+            step = self.steps[self.position]
+            with tracing.span(f"redo {step.name}", "history", recomputed=not step.has_delta):
+                if step.has_delta:
+                    following = step.swap(self.current, self.tile_size)
+                    if self.position == 0:
+                        step.drop()
+                else:
+                    following = self._run(step, self.current)
+                    if self.position > 0:
+                        step.store(self.current, following, self.tile_size)
+            self.position += 1
+            self.current = following
+        self.budget.enforce()
+        return following
+
+    def close(self) -> None:
+        '''
+        Drops the steps and leaves the budget.
+        '''
+        with self.budget._lock:
+            if self in self.budget.histories:
+                self.budget.histories.remove(self)
+        with self._lock:
+            self.steps.clear()
+            self.position = 0
@@ -0,0 +1,206 @@
+'''
+Decoded image cache of RasterLab.
+
+Decoded arrays are kept in memory under a byte budget and evicted in least
+recently used order. Entries are keyed by path, modification time, file size
+and decode flags, so a file changed on disk is decoded again; encoded data
+(e.g. uploads) is keyed by its digest. Derived variants (e.g. float32) are
+cached next to the array they come from.
+
+Uncompressed rasters (see mapped.py) aren't decoded at all: a read-only view
+of the memory-mapped file is returned and not counted against the budget,
+since its pages belong to the OS file cache. Bitmaps which need converting
+(e.g. color ones read as greyscale) are decoded by OpenCV as usual, so the
+result doesn't depend on whether the file could be mapped.
+
+Cached arrays are shared between callers and therefore read-only.
+'''
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import hashlib
+import os
+import threading
+import numpy as np
+import cv2 as cv
+import mapped
+import tracing
+
+
+DEFAULT_BUDGET_BYTES = 512 * 1024 * 1024
+
+# derived variants available by name, computed from the decoded array
+VARIANTS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "gray": lambda image: cv.cvtColor(image, cv.COLOR_BGR2GRAY) if image.ndim == 3 else image,
+    "float32": lambda image: image.astype(np.float32),
+}
+
+
+def file_key(path: str) -> Tuple[str, int, int]:
+    '''
+    Returns a key identifying the current contents of a file.
+    '''
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+class ImageCache:
+    '''
+    LRU cache of decoded images limited by the total size of held arrays.
+    '''
+
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_BYTES) -> None:
+        self.budget_bytes = budget_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, key: Hashable) -> Optional[np.ndarray]:
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def _put(self, key: Hashable, image: np.ndarray) -> np.ndarray:
+        image.flags.writeable = False
+        with self._lock:
+            if image.nbytes > self.budget_bytes:
+                # doesn't fit at all, hand it out without caching
+                return image
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= previous.nbytes
+            self._entries[key] = image
+            self.size_bytes += image.nbytes
+            self._evict()
+        return image
+
+    def _evict(self) -> None:
+        while self.size_bytes > self.budget_bytes and self._entries:
+            key, image = self._entries.popitem(last=False)
+            self.size_bytes -= image.nbytes
+            self.evictions += 1
+
+    def read(self, path: str, flags: int = cv.IMREAD_COLOR) -> np.ndarray:
+        '''
+        Returns the decoded image, decoding the file only if it's not cached yet.
+        Uncompressed rasters are memory-mapped instead of decoded.
+        Raises FileNotFoundError if the file can't be decoded.
+        '''
+        key = (file_key(path), flags)
+        image = self._get(key)
+        if image is not None:
+            return image
+        with tracing.span("decode", "decode", path=path) as current:
+            view = mapped.open_mapped(path)
+            if view is not None:
+                image = mapped.convert(view, flags)
+                if np.may_share_memory(image, view):
+                    # zero-copy view of the file, nothing to cache
+                    current.args["mapped"] = True
+                    current.output(image)
+                    return image
+                if not path.lower().endswith('.bmp'):
+                    current.args["mapped"] = True
+                    current.output(image)
+                    return self._put(key, image)
+                # OpenCV converts bitmaps to greyscale with its own rounding, decoding keeps its results
+            image = cv.imread(path, flags)
+            if image is None:
+                raise FileNotFoundError(f"Can't decode image: {path}")
+            current.output(image)
+        return self._put(key, image)
+
+    def decode(self, data: bytes, flags: int = cv.IMREAD_COLOR) -> np.ndarray:
+        '''
+        Returns the decoded image of encoded file contents (e.g. an upload), keyed by their digest.
+        Raises ValueError if the data can't be decoded.
+        '''
+        key = (hashlib.sha1(data).digest(), len(data), flags)
+        image = self._get(key)
+        if image is not None:
+            return image
+        with tracing.span("decode", "decode", bytes=len(data)) as current:
+            image = cv.imdecode(np.frombuffer(data, np.uint8), flags)
+            if image is None:
+                raise ValueError("Can't decode image data")
+            current.output(image)
+        return self._put(key, image)
+
+    def variant(self, path: str, name: str, flags: int = cv.IMREAD_COLOR) -> np.ndarray:
+        '''
+        Returns a derived variant (see VARIANTS) of the decoded image.
+        '''
+        key = (file_key(path), flags, name)
+        image = self._get(key)
+        if image is not None:
+            return image
+        source = self.read(path, flags)
+        with tracing.span(f"variant {name}", "decode", path=path):
+            return self._put(key, VARIANTS[name](source))
+
+    def evict(self, path: str, flags: Optional[int] = None) -> int:
+        '''
+        Drops the decoded image of a file (with the given flags, by default all of them) and its variants.
+        Returns the bytes released from the cache.
+        '''
+        path = os.path.abspath(path)
+        released = 0
+        with self._lock:
+            for key in list(self._entries):
+                # keys of encoded data start with a digest instead of a file key
+                if isinstance(key[0], tuple) and key[0][0] == path and flags in (None, key[1]):
+                    image = self._entries.pop(key)
+                    self.size_bytes -= image.nbytes
+                    released += image.nbytes
+        return released
+
+    def set_budget(self, budget_bytes: int) -> None:
+        '''
+        Changes the memory budget, evicting entries if necessary.
+        '''
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        '''
+        Drops every cached image.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        '''
+        Returns usage counters of the cache.
+        '''
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# cache shared by the whole program
+shared = ImageCache()
+
+
+def imread(path: str, flags: int = cv.IMREAD_COLOR) -> np.ndarray:
+    '''
+    Drop-in replacement of cv.imread using the shared cache.
+    '''
+    return shared.read(path, flags)
@@ -0,0 +1,116 @@
+'''
+Deferred imports of RasterLab.
+
+numpy, OpenCV, scipy and matplotlib take seconds to import, while the main
+menu only needs Tk and PIL. Modules created with `module()` are placeholders
+which import the real module on first attribute access:
+
+    plt = lazy.module("matplotlib.pyplot")
+    ...
+    plt.figure()  # matplotlib is imported here
+
+`warm_up()` imports modules in a background thread once the window is shown,
+so they are usually ready before the user picks an operation. Every import
+done through a placeholder is timed (and traced, see tracing.py); `report()`
+formats the times.
+'''
+from typing import Callable, Dict, Iterable, Optional
+import importlib
+import threading
+import time
+import types
+import tracing
+
+
+# module name -> seconds its import took
+import_times: Dict[str, float] = {}
+# guards the registry of placeholders, each placeholder has its own lock for the import
+_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    '''
+    Placeholder of a module imported on first attribute access.
+    After the import the attributes of the module are copied in, so later accesses cost nothing extra.
+    '''
+
+    def __init__(self, name: str, on_load: Optional[Callable[[types.ModuleType], None]] = None) -> None:
+        super().__init__(name)
+        # name-mangled (_LazyModule__...), so the attributes copied from the module can't replace them
+        self.__on_load = on_load
+        self.__module: Optional[types.ModuleType] = None
+        self.__lock = threading.RLock()
+
+    def _load(self) -> types.ModuleType:
+        with self.__lock:
+            module = self.__module
+            if module is None:
+                module = load(self.__name__)
+                self.__dict__.update(module.__dict__)
+                self.__module = module
+                if self.__on_load is not None:
+                    self.__on_load(module)
+            return module
+
+    # _load is looked up on the class, a module's own _load copied in would shadow it on the instance
+    def __getattr__(self, name: str):
+        return getattr(LazyModule._load(self), name)
+
+    def __dir__(self):
+        return dir(LazyModule._load(self))
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__module is not None else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+_modules: Dict[str, LazyModule] = {}
+
+
+def load(name: str) -> types.ModuleType:
+    '''
+    Imports a module, recording how long it took if it wasn't imported yet.
+    '''
+    start = time.perf_counter()
+    with tracing.span(f"import {name}", "import"):
+        module = importlib.import_module(name)
+    import_times.setdefault(name, time.perf_counter() - start)
+    return module
+
+
+def module(name: str, on_load: Optional[Callable[[types.ModuleType], None]] = None) -> LazyModule:
+    '''
+    Returns the placeholder of a module, on_load is called with the module once it's imported.
+    '''
+    with _lock:
+        if name not in _modules:
+            _modules[name] = LazyModule(name, on_load)
+        return _modules[name]
+
+
+def warm_up(names: Iterable[str], on_done: Optional[Callable[[], None]] = None) -> threading.Thread:
+    '''
+    Imports the modules (through their placeholders, if any) in a background thread.
+    on_done is called from that thread.
+    '''
+    def run() -> None:
+        for name in names:
+            if name in _modules:
+                LazyModule._load(_modules[name])
+            else:
+                load(name)
+        if on_done is not None:
+            on_done()
+
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def report() -> str:
+    '''
+    Formats the recorded import times, slowest first.
+    '''
+    lines = [f"{name:<30} {seconds * 1000:8.1f} ms"
+             for name, seconds in sorted(import_times.items(), key=lambda item: -item[1])]
+    return "\n".join(lines)
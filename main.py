@@ -1,47 +1,60 @@
 
+from __future__ import annotations
+import time
+# measures the time to an interactive menu
+STARTED = time.perf_counter()
+import os
+import sys
 import tkinter as tk
-from tkinter import filedialog
-from typing import Any, Dict, List, Tuple
-from PIL import Image, ImageTk
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import numpy as np
-import scipy.ndimage
-from scipy.signal import convolve2d as conv2
-import cv2 as cv
-import random
-import imutils
+from tkinter import filedialog, ttk
+from typing import Any, Dict, List, Optional
+from PIL import Image
+import lazy
+import session
+import tracing
+import viewer
+import workers
+
+
+def configure_matplotlib(pyplot) -> None:
+    # disables the toolbar for rendered images
+    pyplot.rcParams['toolbar'] = 'None'
+
+
+# Heavy modules are imported on first use, the main menu only needs Tk and PIL.
+plt = lazy.module("matplotlib.pyplot", on_load=configure_matplotlib)
+np = lazy.module("numpy")
+cv = lazy.module("cv2")
+engine = lazy.module("engine")
+histogram = lazy.module("histogram")
+history = lazy.module("history")
+image_cache = lazy.module("image_cache")
+display = lazy.module("display")
+export = lazy.module("export")
+mapped = lazy.module("mapped")
+preview = lazy.module("preview")
+raster = lazy.module("raster")
+tiling = lazy.module("tiling")
+# imported in the background once the menu is shown, most used first
+WARM_UP_MODULES = ["numpy", "cv2", "engine", "histogram", "image_cache", "mapped", "tiling", "display", "raster", "history", "export",
+                   "matplotlib.pyplot", "scipy.ndimage"]
+WARM_UP_DELAY_MS = 100
+# bins per channel of joint color histograms, the RGB cube has bins ** 3 of them
+DEFAULT_JOINT_BINS = 32
+MAX_JOINT_BINS = 128
 
 
 def terminate_all():
     """
     Destroy all the matplotlib figures as well and close the program.
     """
-    plt.close('all')
+    if "matplotlib.pyplot" in sys.modules:
+        plt.close('all')
+    runner.shutdown()
+    opened_images.close()
     root.destroy()
 
 
-class RasterImage:
-    '''
-    Holds information about imported image.
-    '''
-
-    def __init__(self, path) -> None:
-        self.path = path
-        self.object = Image.open(self.path)
-        self.tk_object = ImageTk.PhotoImage(self.object)
-
-    def get_mode(self) -> str:
-        '''
-        Returns the color mode of the image.
-
-        "L" - greyscale
-
-        "RGB" | "RGBa" - color | color transparent
-        '''
-        return self.object.mode()
-
-
 def create_button(root: tk.Toplevel | tk.Tk, text: str, command) -> tk.Button:
     """
     Given the root element, text and command, the function returns a ready tkinter Button element.
@@ -54,19 +67,31 @@ def create_button(root: tk.Toplevel | tk.Tk, text: str, command) -> tk.Button:
                      )
 
 
-opened_images_list: List[RasterImage] = []
-# disables the toolbar for rendered images
-mpl.rcParams['toolbar'] = 'None'
+# images of the open windows, kept under a memory budget
+opened_images = session.Session()
+# id of an image -> viewer of its window
+image_views: Dict[int, viewer.ImageViewer] = {}
+# id of an image -> undo history, started by its first edit in place
+image_histories: Dict[int, Any] = {}
+# id of an image -> its history tasks, the first one running, see submit_history_task
+history_tasks: Dict[int, List] = {}
+# shared by the histories, created with the first one
+history_budget = None
 # stores two last actively used images
+# results have no path, their pixels are kept in "array"; "raster" is the image of the window
 focused_file: Dict[str, Any] = {
     "path": "",
     "mode": "",
-    "image": ""
+    "image": "",
+    "array": None,
+    "raster": None
 }
 previous_file: Dict[str, Any] = {
     "path": "",
     "mode": "",
-    "image": ""
+    "image": "",
+    "array": None,
+    "raster": None
 }
 # globally store coordinates for plotting function
 plot_profile_data: Dict[str, List[int]] = {
@@ -75,18 +100,85 @@ plot_profile_data: Dict[str, List[int]] = {
 }
 
 
-def add_event_listeners(window, image):
+def set_focus(path: str, image: Image.Image, array=None, raster_image=None) -> None:
     '''
-    Add focus event listeners to image object.
+    Makes an image the focused one, the previously focused one is kept for two point operations.
     '''
-    def on_focus(event):
-        global focused_file, previous_file, plot_profile_data
-        previous_file = focused_file
-        focused_file["path"] = ''
-        focused_file["mode"] = image.mode
-        focused_file["image"] = image
+    if focused_file["image"] is image:
+        # the window and its widgets report focus separately
+        return
+    previous_file.update(focused_file)
+    focused_file.update(path=path, mode=image.mode, image=image, array=array, raster=raster_image)
+    tracing.instant("focus", path=focused_file["path"], previous=previous_file["path"])
+
+
+def has_source(source: Dict[str, Any]) -> bool:
+    return bool(source["path"] or source["image"])
+
+
+def read_source(source: Dict[str, Any], flags: int = 1) -> np.ndarray:
+    '''
+    Returns pixels of a focused (or previous) image for the engine, decoding its file or taking the result array.
+    flags are cv.imread flags (1 - color, 0 - greyscale).
+    '''
+    if source["path"]:
+        return image_cache.imread(source["path"], flags)
+    array = source["array"] if source["array"] is not None else display.from_image(source["image"])
+    return mapped.convert(array, flags)
 
+
+def describe_images() -> str:
+    '''
+    Returns the number of opened images and the memory they hold against the budget.
+    '''
+    stats = opened_images.stats()
+    text = f"{stats['images']} ({stats['size_bytes'] / 2 ** 20:.1f} / {stats['budget_bytes'] / 2 ** 20:.0f} MB)"
+    if stats["spilled"]:
+        text += f", {stats['spilled']} spilled"
+    if history_budget is not None:
+        text += f", history {history_budget.memory() / 2 ** 20:.1f} MB"
+    return text
+
+
+def update_memory_label() -> None:
+    memory_label["text"] = f"images: {describe_images()}"
+
+
+def focus_image(raster_image: raster.RasterImage) -> None:
+    '''
+    Makes the image of a window the focused one, reloading it if it was spilled.
+    '''
+    opened_images.touch(raster_image)
+    array = None if raster_image.path else raster_image.array
+    set_focus(raster_image.path, raster_image.image, array, raster_image)
+    update_memory_label()
+
+
+def add_event_listeners(window, raster_image: raster.RasterImage, view=None):
+    '''
+    Add focus event listeners to image object and registers it in the session, closing the window forgets it.
+    '''
+    def on_focus(event):
+        focus_image(raster_image)
+
+    def on_destroy(event):
+        # children report their destruction too
+        if event.widget is window:
+            opened_images.remove(raster_image)
+            image_views.pop(id(raster_image), None)
+            image_history = image_histories.pop(id(raster_image), None)
+            if image_history is not None:
+                image_history.close()
+            update_memory_label()
+
+    opened_images.add(raster_image, view)
+    if view is not None:
+        image_views[id(raster_image)] = view
+    update_memory_label()
     window.bind("<FocusIn>", on_focus)
+    window.bind("<Destroy>", on_destroy)
+    window.bind("<Control-z>", lambda event: step_history(raster_image))
+    window.bind("<Control-y>", lambda event: step_history(raster_image, redo=True))
 
 
 def import_image(root_window: tk.Toplevel):
@@ -94,33 +186,21 @@ def import_image(root_window: tk.Toplevel):
     Asks for the image in file explorer and then imports it to the program, creating a dedicated widget for it.
     """
     root_window.destroy()
-    extensions = [('formats', ['.jpg', '.png', '.bmp', '.jpeg'])]
+    extensions = [('formats', ['.jpg', '.png', '.bmp', '.jpeg', '.npy', '.raw'])]
     file_path = filedialog.askopenfilename(filetypes=extensions)
     if not file_path:
         return
 
-    opened_image = Image.open(file_path)
-    new_img = ImageTk.PhotoImage(opened_image)
-    raster_image = RasterImage(file_path)
-    opened_images_list.insert(0, raster_image)
-    new_window = tk.Toplevel(
-        root, width=opened_image.width, height=opened_image.height)
-    new_window.title(f"RasterLab: {file_path}")
-    new_window.resizable(False, False)
+    raster_image = raster.RasterImage(file_path)
+    # only the visible part of the image is rendered, zooming uses a pyramid
+    new_window, view = show_image(raster_image, file_path)
 
     def on_focus(event):
         """
         Switches the focused_file data to the current image in order for other functions to operate on them. Resets the plot profile data since it's another image.
         """
         global focused_file, previous_file, plot_profile_data, save_button
-        previous_file["path"] = focused_file["path"]
-        previous_file["mode"] = focused_file["mode"]
-        previous_file["image"] = focused_file["image"]
-        focused_file["path"] = file_path
-        focused_file["mode"] = opened_image.mode
-        focused_file["image"] = opened_image
-        print(f"Focused image: {focused_file['path']}")
-        print(f"Previous image: {previous_file['path']}")
+        focus_image(raster_image)
         # reset plot profile data for new image
         try:
             plot_profile_data["start"] = [-1, -1]
@@ -138,35 +218,6 @@ def import_image(root_window: tk.Toplevel):
         except:
             pass
 
-    def on_scroll(event):
-        """
-        Depending on the scroll direction it resizes the image up and down, scaling the entire widget/frame with it.
-        """
-        # get current widget height and width, account for borders (-4)
-        cur_height = new_window.winfo_height() - 4
-        cur_width = new_window.winfo_width() - 4
-        if event.delta == 120:
-            new_width = int(cur_width * 1.05)
-            new_height = int(cur_height * 1.05)
-        elif event.delta == -120:
-            new_width = int(cur_width * 0.95)
-            new_height = int(cur_height * 0.95)
-        else:
-            return
-        # destroy the current image
-        for widget in new_window.winfo_children():
-            widget.destroy()
-        # resize the actual image
-        resized_image = Image.open(file_path).resize((new_width, new_height))
-        new_img = ImageTk.PhotoImage(resized_image)
-        new_window["height"] = new_height
-        new_window["width"] = new_width
-        # render image in the frame of the widget
-        image = tk.Label(new_window, image=new_img)
-        # create a reference for the file
-        image.image = new_img  # type: ignore
-        image.pack()
-
     def on_click(event) -> None:
         """
             Store plot profile endpoints in global variable.
@@ -178,10 +229,10 @@ def import_image(root_window: tk.Toplevel):
             return
 
         if plot_profile_data["start"] == [-1, -1]:
-            plot_profile_data["start"] = [event.x, event.y]
+            plot_profile_data["start"] = view.to_image(event.x, event.y)
 
         elif plot_profile_data["end"] == [-1, -1]:
-            plot_profile_data["end"] = [event.x, event.y]
+            plot_profile_data["end"] = view.to_image(event.x, event.y)
 
             plot_profile_button["state"] = "normal"
         else:
@@ -191,53 +242,39 @@ def import_image(root_window: tk.Toplevel):
 
     # bind certain events to specific functions
     new_window.bind("<FocusIn>", on_focus)
-    new_window.bind("<MouseWheel>", on_scroll)
     new_window.bind("<Button-1>", on_click)
 
-    image = tk.Label(new_window, image=new_img)
-    # it has to be a reference, otherwise the image doesn't load!
-    image.image = new_img  # type: ignore
-    image.pack()
-
-
-def sort_histogram_data(data: Dict[str, int]) -> Dict[str, int]:
-    """
-    Given the probably not full, unsorted dictionary of values, return a sorted dictionary with "blank" zeroes if value doesn't appear.
-    """
-    sorted_data: Dict[str, int] = {}
-    for i in range(256):
-        key = str(i)
-        if key in data.keys():
-            sorted_data[key] = data[key]
-        else:
-            sorted_data[key] = 0
-    return sorted_data
-
 
-def plot_histogram(data: Dict[str, int], label: str = "", color: str = "gray") -> None:
+def plot_histogram(counts: np.ndarray, label: str = "", color: str = "gray") -> None:
     """
-        Displays histogram for one segment of data.
+        Displays histogram for one channel of data.
     """
-    # data doesn't have to be passed sorted so we have to sort it
-    sorted_data = sort_histogram_data(data)
-    plt.bar(list(sorted_data.keys()),
-            list(sorted_data.values()), color=color, width=1)
+    plt.bar(np.arange(256), counts, color=color, width=1)
     # hide tick information on the sides - prevents excessive during resize
     plt.xticks([])
     plt.yticks([])
     plt.title(label)
 
 
-def generate_histogram_table(data: Dict[str, int]) -> None:
+def plot_joint_histogram(counts: np.ndarray, labels, ranges, title: str = "") -> None:
+    """
+        Displays a 2-D histogram as a heatmap, with counts on a logarithmic scale.
+    """
+    plt.imshow(np.log1p(counts).T, origin="lower", aspect="auto", cmap="magma",
+               extent=(0, ranges[0], 0, ranges[1]))
+    plt.xlabel(labels[0])
+    plt.ylabel(labels[1])
+    plt.title(title)
+
+
+def generate_histogram_table(counts: np.ndarray) -> None:
     """
     Creates a new widget with histogram data in form of a copyable text.
     """
-    sorted_data = sort_histogram_data(data)
     new_window = tk.Toplevel(root)
     new_window.resizable(False, False)
     t = tk.Text(new_window, height=256, width=20)
-    for i in sorted_data.keys():
-        t.insert(tk.END, f"{i}: {sorted_data[i]}\n")
+    t.insert(tk.END, "".join(f"{i}: {count}\n" for i, count in enumerate(counts)))
     t.pack()
 
 
@@ -245,70 +282,63 @@ def compose_histogram(mode: str):
     """
     Collects data about the image to render later in a histogram. Some aspects of the program are available depending of the image mode (greyscale, RGB, RGBA.)
     """
-    if focused_file["image"]:
-        new_image = focused_file["image"]
-    elif focused_file["path"]:
-
-        new_image = Image.open(focused_file["path"])
-    elif focused_file == "":
+    new_image = get_focused_image()
+    if new_image is None:
         return
-    pixel_list = list(new_image.getdata())
+    # computed once per image, shared with other analysis options
+    counts = histogram.histogram(new_image)
     match new_image.mode:
         # L for greyscale images, RGB for color images
         case 'L':
-            color_values = {}
-            i = 0
-            while i < len(pixel_list):
-                # if the value is already in the dictionary
-                if f"{pixel_list[i]}" in color_values.keys():
-                    color_values[f"{pixel_list[i]}"] += 1
-                # if the value is not yet in dictionary
-                else:
-                    color_values[f"{pixel_list[i]}"] = 1
-                i += 1
-
             if mode == 'plot':
-                plot_histogram(color_values, 'luma')
-                plt.show()
+                plt.figure()
+                plot_histogram(counts[0], 'luma')
+                plt.show(block=False)
             elif mode == 'array':
-                generate_histogram_table(color_values)
+                generate_histogram_table(counts[0])
 
         case 'RGB' | 'RGBA':
-            r_values = {}
-            g_values = {}
-            b_values = {}
-            i = 0
-            while i < len(pixel_list):
-                red_v = str(pixel_list[i][0])
-                blu_v = str(pixel_list[i][1])
-                grn_v = str(pixel_list[i][2])
-                if red_v in r_values.keys():
-                    r_values[red_v] += 1
-                else:
-                    r_values[red_v] = 1
-
-                if blu_v in g_values.keys():
-                    g_values[blu_v] += 1
-                else:
-                    g_values[blu_v] = 1
-
-                if grn_v in b_values.keys():
-                    b_values[grn_v] += 1
-                else:
-                    b_values[grn_v] = 1
-                i += 1
-            # hide control buttons on figures
-
             if mode == 'plot':
-                plot_histogram(r_values, 'red channel', 'r')
+                plt.figure()
+                plot_histogram(counts[0], 'red channel', 'r')
 
                 plt.figure()
-                plot_histogram(g_values, 'green channel', 'g')
+                plot_histogram(counts[1], 'green channel', 'g')
 
                 plt.figure()
-                plot_histogram(b_values, 'blue channel', 'b')
+                plot_histogram(counts[2], 'blue channel', 'b')
+
+                plt.show(block=False)
 
-                plt.show()
+
+def compose_color_histogram(space: str, bins: str) -> None:
+    """
+    Renders a joint color histogram (see histogram.COLOR_SPACES) of the focused image as a heatmap, the RGB cube as its three projections.
+    It's computed in the background and cached with the other histograms of the image.
+    """
+    new_image = get_focused_image()
+    if new_image is None or new_image.mode not in ('RGB', 'RGBA'):
+        return
+    try:
+        bins = min(max(int(bins), 2), MAX_JOINT_BINS)
+    except ValueError:
+        bins = DEFAULT_JOINT_BINS
+    conversion, channels, ranges, labels = histogram.COLOR_SPACES[space]
+
+    def on_done(counts: np.ndarray) -> None:
+        if counts.ndim == 2:
+            plt.figure()
+            plot_joint_histogram(counts, labels, ranges, f"{labels[0]} - {labels[1]} ({bins} bins)")
+        else:
+            plt.figure(figsize=(12, 4))
+            for index, (first, second) in enumerate(((0, 1), (0, 2), (1, 2)), start=1):
+                plt.subplot(1, 3, index)
+                # the cube summed along the third channel
+                plot_joint_histogram(counts.sum(axis=3 - first - second), (labels[first], labels[second]),
+                                     (ranges[first], ranges[second]), f"{labels[first]} - {labels[second]}")
+        plt.show(block=False)
+
+    runner.submit(f"{space} histogram", histogram.joint_histogram, new_image, space, bins, on_done=on_done)
 
 
 def plot_profile() -> None:
@@ -318,12 +348,8 @@ def plot_profile() -> None:
     global plot_profile_data, focused_file
     x0, y0 = plot_profile_data["start"][0], plot_profile_data["start"][1]
     x1, y1 = plot_profile_data["end"][0], plot_profile_data["end"][1]
-    x = np.linspace(
-        x0, x1, 100)
-    y = np.linspace(
-        y0, y1, 100)
-    z = Image.open(focused_file["path"])
-    zi = scipy.ndimage.map_coordinates(z, (y, x))
+    z = np.asarray(get_focused_image())
+    zi = engine.line_profile(z, (x0, y0), (x1, y1))
 
     fig, axes = plt.subplots(nrows=2)
     axes[0].imshow(z)  # type: ignore
@@ -332,279 +358,369 @@ def plot_profile() -> None:
 
     axes[1].plot(zi)  # type: ignore
 
-    plt.show()
+    plt.show(block=False)
 
 
-def negate_image(window_to_close: tk.Toplevel) -> None:
+def get_focused_image() -> Optional[Image.Image]:
     '''
-    Invert color values on given image. Works on RGB(a) and greyscale objects.
+    Returns the PIL object of the focused image, opening it from disk if necessary.
     '''
-    window_to_close.destroy()
     if focused_file["image"]:
-        new_image = focused_file["image"]
+        return focused_file["image"]
     elif focused_file["path"]:
+        return Image.open(focused_file["path"])
+    return None
 
-        new_image = Image.open(focused_file["path"])
-    elif focused_file == "":
-        return
-    negated_image = ''
 
-    if new_image.mode == 'L':
+def show_image(raster_image: raster.RasterImage, title: str):
+    '''
+    Renders an image in a new focusable window, results can be saved and processed further like imported images.
+    Returns the window and its viewer.
+    '''
+    new_window = tk.Toplevel(root)
+    new_window.title(f"RasterLab: {title}")
+    image = raster_image.image
+    with tracing.span("show image", "render", size=list(image.size)):
+        view = viewer.ImageViewer(new_window, image, reload=lambda: raster_image.image)
+    view.bind()
+    add_event_listeners(new_window, raster_image, view)
+    return new_window, view
 
-        pixel_list: List[int] = list(new_image.getdata())
-        negated_pixel_list: List[int] = []
 
-        # Convert pixel values to their opposites.
-        for pixel in pixel_list:
-            negated_pixel_list.append(abs(pixel - 255))
+def show_processed_image(processed_image: Image.Image) -> None:
+    '''
+    Renders a processed PIL image in a new focusable window.
+    '''
+    raster_image = raster.RasterImage.from_array(display.from_image(processed_image), processed_image)
+    show_image(raster_image, focused_file['path'] or "result")
+
 
-        negated_image = Image.new(new_image.mode, new_image.size)
-        negated_image.putdata(negated_pixel_list)
-    elif new_image.mode == 'RGB' or new_image.mode == 'RGBA':
+def convert_result(result: np.ndarray, window=None):
+    '''
+    Returns the display image and the 8-bit pixels of an engine result.
+    '''
+    with tracing.span("convert result", "render") as current:
+        current.input(result)
+        return display.to_image(result, window), display.to_uint8(result, window)
 
-        pixel_rgb_list: List[List[int]] = list(new_image.getdata())
-        negated_pixel_rgb_list: List[Tuple[int, int, int]] = []
 
-        for pixel in pixel_rgb_list:
-            # Convert pixel values to their opposites.
-            new_pixel = (abs(pixel[0] - 255),
-                         abs(pixel[1] - 255), abs(pixel[2] - 255))
-            negated_pixel_rgb_list.append(new_pixel)
+def show_result(result: np.ndarray, title: str, converted=None) -> None:
+    '''
+    Renders an engine result in a focusable image window.
+    Results other than 8-bit are mapped to 0-255 from a display window, by default their value range,
+    which can be changed below the image.
+    '''
+    image, pixels = converted or convert_result(result)
+    raster_image = raster.RasterImage.from_array(pixels, image)
+    new_window, view = show_image(raster_image, title)
+    window = display.default_window(result)
+    if window is None:
+        return
+
+    controls = tk.Frame(new_window)
+    low = tk.Entry(controls, width=12, font=("Arial", 12))
+    high = tk.Entry(controls, width=12, font=("Arial", 12))
+    low.insert(0, f"{window[0]:g}")
+    high.insert(0, f"{window[1]:g}")
 
-        negated_image = Image.new(new_image.mode, new_image.size)
-        negated_image.putdata(negated_pixel_rgb_list)  # type: ignore
+    def apply() -> None:
+        try:
+            chosen = (float(low.get()), float(high.get()))
+        except ValueError:
+            return
+        image, pixels = convert_result(result, chosen)
+        raster_image.set_array(pixels, image)
+        view.set_image(raster_image.image)
+        focus_image(raster_image)
 
-    new_image = negated_image
+    tk.Label(controls, text="window", font=("Arial", 12)).grid(column=1, row=1, padx=5)
+    low.grid(column=2, row=1, padx=5)
+    high.grid(column=3, row=1, padx=5)
+    create_button(controls, "apply", apply).grid(column=4, row=1, padx=5, pady=5)
+    controls.grid(column=0, row=2, columnspan=2, sticky="w")
 
-    negated_image = ImageTk.PhotoImage(negated_image)
 
-    new_window = tk.Toplevel(
-        root, width=new_image.width, height=new_image.height)
-    # new_window.iconphoto(False, icon)
-    new_window.title(f"RasterLab: {focused_file['path']}")
-    new_window.resizable(False, False)
-    image = tk.Label(new_window, image=negated_image)
-    image.image = negated_image  # type: ignore
+def run_operation(title: str, work, on_error=workers.print_error) -> None:
+    '''
+    Runs an engine operation in the background and shows its result.
+    The result is converted for display in the background as well.
+    '''
+    def task():
+        result = work()
+        return result, convert_result(result)
 
-    add_event_listeners(new_window, new_image)
-    image.pack()
+    runner.submit(title, task, on_done=lambda done: show_result(done[0], title, done[1]), on_error=on_error)
 
 
-def threshold_image(window_to_close: tk.Toplevel, value: str, isSimple: bool) -> None:
+def show_preview(title: str, operation, sliders, on_apply, sources=None) -> None:
     '''
-    Perform a threshold operation on an image object.
-    value variable depending on the isSimple boolean flag is interpeted as number of bins or an actual threshold.
+    Opens a live preview of an operation tuned with sliders, on the focused image by default.
+    The full resolution operation runs when the preview is applied, see preview.LivePreview.
     '''
-    window_to_close.destroy()
-    if not value:
-        value = 2
-    try:
-        value = int(value)
-    except:
+    sources = [dict(source) for source in (sources or [focused_file])]
+    if not all(has_source(source) for source in sources):
         return
+    center = None
+    view = image_views.get(id(sources[0]["raster"]))
+    if view is not None:
+        # crops are taken from the part of the image visible in its window
+        left, top, right, bottom = view.visible_region()
+        center = ((left + right) // 2, (top + bottom) // 2)
+    preview.LivePreview(root, title, [read_source(source) for source in sources], operation, sliders,
+                        on_apply, runner.submit, center)
 
-    if focused_file["image"]:
-        new_image = focused_file["image"]
-    elif focused_file["path"]:
 
-        new_image = Image.open(focused_file["path"])
-    elif focused_file == "":
-        return
+def get_history(raster_image: raster.RasterImage):
+    '''
+    Returns the undo history of an image, starting it on the first edit.
+    '''
+    global history_budget
+    if history_budget is None:
+        history_budget = history.HistoryBudget()
+    if id(raster_image) not in image_histories:
+        image_histories[id(raster_image)] = history.History(raster_image.array, history_budget)
+    return image_histories[id(raster_image)]
 
-    processed_image = ''
 
-    if new_image.mode != 'L':
-        return
+def replace_image(raster_image: raster.RasterImage, image: Image.Image, pixels: np.ndarray) -> None:
+    '''
+    Shows new pixels of an image edited in place.
+    '''
+    # the pixels no longer come from the file
+    raster_image.path = ""
+    raster_image.set_array(pixels, image)
+    if id(raster_image) in image_views:
+        image_views[id(raster_image)].set_image(image)
+    if focused_file["raster"] is raster_image:
+        focused_file.update(path="", mode=image.mode, image=image, array=pixels)
+    update_memory_label()
 
-    pixel_list = list(new_image.getdata())
-    processed_pixel_list: List[int] = []
 
-    goal_table: List[int] = []
+def submit_history_task(raster_image: raster.RasterImage, name: str, task, on_done) -> None:
+    '''
+    Runs edits, undos and redos of an image one at a time, in the order they were requested,
+    so a step can't overtake the one before it nor show its result after a later one.
+    '''
+    key = id(raster_image)
+    pending = history_tasks.setdefault(key, [])
+    pending.append((name, task, on_done))
+    if len(pending) == 1:
+        run_history_task(key)
 
-    for i in range(value):
-        for j in range(int(255/value)):
-            goal_table.append(int(255/value * (i)))
 
-    for pixel in pixel_list:
-        if isSimple:
-            if pixel < (value):
-                processed_pixel_list.append(0)
+def run_history_task(key: int) -> None:
+    pending = history_tasks[key]
+    name, task, on_done = pending[0]
+
+    def finish(callback, outcome) -> None:
+        try:
+            callback(outcome)
+        finally:
+            pending.pop(0)
+            if pending:
+                run_history_task(key)
             else:
-                processed_pixel_list.append(255)
-        else:
-            processed_pixel_list.append(goal_table[pixel])
+                del history_tasks[key]
 
-    print(goal_table)
+    runner.submit(name, task, on_done=lambda result: finish(on_done, result),
+                  on_error=lambda error: finish(workers.print_error, error))
 
-    processed_image = Image.new(new_image.mode, new_image.size)
-    processed_image.putdata(processed_pixel_list)
-    new_image = processed_image
-    processed_image = ImageTk.PhotoImage(processed_image)
 
-    new_window = tk.Toplevel(
-        root, width=new_image.width, height=new_image.height)
-    new_window.title(f"RasterLab: {focused_file['path']}")
-    new_window.resizable(False, False)
-    image = tk.Label(new_window, image=processed_image)
-    image.image = processed_image  # type: ignore
-    add_event_listeners(new_window, new_image)
-    image.pack()
+def edit_image(title: str, raster_image: raster.RasterImage, recipe) -> None:
+    '''
+    Applies an operation to an image in place, in the background. It can be undone.
+    recipe computes the new pixels from the current ones.
+    '''
+    image_history = get_history(raster_image)
 
+    submit_history_task(
+        raster_image,
+        title,
+        lambda: convert_result(image_history.apply(title, recipe)),
+        lambda converted: replace_image(raster_image, *converted)
+    )
 
-def posterize_image(window_to_close: tk.Toplevel, value: str) -> None:
+
+def step_history(raster_image: Optional[raster.RasterImage], redo: bool = False) -> None:
     '''
-    Perform posterization on an image.
-    Works only on RGB(a) images.
+    Undoes (or redoes) the last edit of an image, in the background since the step may have to be computed again.
     '''
-    window_to_close.destroy()
-    try:
-        value = int(value)
-    except:
+    image_history = image_histories.get(id(raster_image))
+    if image_history is None:
         return
 
-    if focused_file["image"]:
-        new_image = focused_file["image"]
-    elif focused_file["path"]:
+    def task():
+        result = image_history.redo() if redo else image_history.undo()
+        return None if result is None else convert_result(result)
+
+    def on_done(converted) -> None:
+        if converted is not None:
+            replace_image(raster_image, *converted)
+
+    submit_history_task(raster_image, "redo" if redo else "undo", task, on_done)
 
-        new_image = Image.open(focused_file["path"])
-    elif focused_file == "":
+
+def run_image_operation(title: str, operation, flags: int = 1, padding: int = 0) -> None:
+    '''
+    Runs an engine operation on the focused image in the background.
+    With "in place" checked its result replaces the focused image and can be undone, otherwise it opens in a new window.
+    flags are cv.imread flags of the input (1 - color, 0 - greyscale).
+    padding is the border the operation adds around the image, cropped off edits in place so the image keeps its size.
+    '''
+    if not has_source(focused_file):
         return
+    source = dict(focused_file)
+    if in_place.get() and source["raster"] is not None:
+        def recipe(array: np.ndarray) -> np.ndarray:
+            result = operation(mapped.convert(array, flags))
+            if padding:
+                result = result[padding:-padding, padding:-padding]
+            # steps keep 8-bit pixels, like the ones shown
+            return display.to_uint8(result)
+
+        edit_image(title, source["raster"], recipe)
+        return
+    run_operation(title, lambda: operation(read_source(source, flags)))
 
-    goal_table: List[int] = []
-    # Define bin values.
-    for i in range(value):
-        for j in range(int(256/value)):
-            goal_table.append(int(256/value * (i)))
-
-    if new_image.mode == 'RGB' or new_image.mode == 'RGBA':
-        # TODO: Reused parts of negate image algoritm, didn't change variable names.
-        pixel_rgb_list: List[List[int]] = list(new_image.getdata())
-        negated_pixel_rgb_list: List[Tuple[int, int, int]] = []
-
-        for pixel in pixel_rgb_list:
-            new_pixel = (goal_table[pixel[0]],
-                         goal_table[pixel[1]],
-                         goal_table[pixel[2]]
-                         )
-            negated_pixel_rgb_list.append(new_pixel)
-
-        negated_image = Image.new(new_image.mode, new_image.size)
-        negated_image.putdata(negated_pixel_rgb_list)  # type: ignore
-
-        new_image = negated_image
-        negated_image = ImageTk.PhotoImage(negated_image)
-    new_window = tk.Toplevel(
-        root, width=new_image.width, height=new_image.height)
-    new_window.title(f"RasterLab: {focused_file['path']}")
-    new_window.resizable(False, False)
-    image = tk.Label(new_window, image=negated_image)
-    image.image = negated_image  # type: ignore
-    add_event_listeners(new_window, new_image)
 
-    image.pack()
+def run_point_operation(name: str, new_image: Image.Image, operation, *args, recipe=None) -> None:
+    '''
+    Runs a point operation from the engine in the background and displays its result.
+    recipe replaces the operation for edits in place, when it needs something other than the pixels.
+    '''
+    if in_place.get() and focused_file["raster"] is not None:
+        edit_image(name, focused_file["raster"], recipe or (lambda array: operation(array, *args)))
+        return
+    mode = new_image.mode
+    runner.submit(
+        name,
+        lambda: operation(np.asarray(new_image), *args),
+        on_done=lambda result: show_processed_image(
+            Image.fromarray(result, mode))
+    )
 
 
-def generate_lut(pixel_list: List[int]):
+def negate_image(window_to_close: tk.Toplevel) -> None:
     '''
-    Generates LUT table in form of a dictionary.
+    Invert color values on given image. Works on RGB(a) and greyscale objects.
     '''
-    lut = {}
-    for pixel in pixel_list:
-        if pixel in lut:
-            lut[pixel] += 1
-        else:
-            lut[pixel] = 0
-    for i in range(256):
-        if i not in lut:
-            lut[i] = 0
-    return lut
+    window_to_close.destroy()
+    new_image = get_focused_image()
+    if new_image is None or new_image.mode not in ('L', 'RGB', 'RGBA'):
+        return
+    run_point_operation("negation", new_image, engine.negate)
 
 
-def stretch_histogram(window_to_close: tk.Toplevel, p1, p2, q3, q4) -> None:
+def threshold_image(window_to_close: tk.Toplevel, value: str, isSimple: bool) -> None:
     '''
-    Performs a histogram value stretch.
-    Could be given 4 parameters, if not program will default to maximum stretch.
+    Perform a threshold operation on an image object.
+    value variable depending on the isSimple boolean flag is interpeted as number of bins or an actual threshold.
     '''
     window_to_close.destroy()
-    if focused_file["image"]:
-        new_image = focused_file["image"]
-    elif focused_file["path"]:
+    if not value:
+        value = 2
+    try:
+        value = int(value)
+    except:
+        return
 
-        new_image = Image.open(focused_file["path"])
-    elif focused_file == "":
+    new_image = get_focused_image()
+    if new_image is None or new_image.mode != 'L':
         return
-    processed_image = ''
 
-    if new_image.mode != 'L':
+    run_point_operation("threshold", new_image,
+                        engine.threshold, value, isSimple)
+
+
+def posterize_image(window_to_close: tk.Toplevel, value: str) -> None:
+    '''
+    Perform posterization on an image.
+    Works only on RGB(a) images.
+    '''
+    window_to_close.destroy()
+    try:
+        value = int(value)
+    except:
         return
 
-    pixel_list = list(new_image.getdata())
-    processed_pixel_list: List[int] = []
+    new_image = get_focused_image()
+    if new_image is None or new_image.mode not in ('RGB', 'RGBA'):
+        return
 
-    lut_table = generate_lut(pixel_list)
-    end: int = 0
-    start: int = 0
+    run_point_operation("posterize", new_image, engine.posterize, value)
+
+
+def stretch_histogram(window_to_close: tk.Toplevel, p1, p2, q3, q4) -> None:
+    '''
+    Performs a histogram value stretch.
+    Could be given 4 parameters, if not program will default to maximum stretch.
+    '''
+    window_to_close.destroy()
+    new_image = get_focused_image()
+    if new_image is None or new_image.mode != 'L':
+        return
 
     if p1 and p2 and q3 and q4:
-        start = int(p1)
-        end = int(p2)
-        q3 = int(q3)
-        q4 = int(q4)
+        run_point_operation("stretch", new_image, engine.stretch,
+                            int(p1), int(p2), int(q3), int(q4))
     else:
-        q3 = 0
-        q4 = 255
-        for i in range(255):
-            if lut_table[i] != 0:
-                end = i
-
-        for i in range(255, 0, -1):
-            try:
-                if lut_table[i] != 0:
-                    start = i
-            except:
-                print('elo')
-    for pixel in pixel_list:
-
-        if pixel < q3:
-            processed_pixel_list.append(q3)
-        elif pixel > q4:
-            processed_pixel_list.append(q4)
-        else:
-            processed_pixel_list.append(
-                int(((pixel - start) * q4) / (end - start))
-            )
-        # print(pixel, ':', int(((pixel - start) * 255) / (end - start)))
-    print(len(processed_pixel_list))
-    print(max(processed_pixel_list), min(processed_pixel_list))
-    processed_image = Image.new(new_image.mode, new_image.size)
-    processed_image.putdata(processed_pixel_list)
-    new_image = processed_image
-    processed_image = ImageTk.PhotoImage(processed_image)
-
-    new_window = tk.Toplevel(
-        root, width=new_image.width, height=new_image.height)
-    new_window.title(f"RasterLab: {focused_file['path']}")
-    new_window.resizable(False, False)
-    image = tk.Label(new_window, image=processed_image)
-    image.image = processed_image  # type: ignore
-    add_event_listeners(new_window, new_image)
-    image.pack()
+        run_point_operation("stretch", new_image, lambda image: engine.stretch(
+            image, hist=histogram.histogram(new_image)[0]), recipe=engine.stretch)
 
 
-def save_image(window_to_close: tk.Toplevel, new_file_name: str) -> None:
+def save_images(sources: List[Dict[str, Any]], paths: List[str], options: Dict[str, Any], status: tk.Label) -> None:
     '''
-    Save image to disk.
+    Saves images in the background, each one is encoded by its own task so that they are encoded at once.
+    The status label shows the progress and the encode throughput.
     '''
-    window_to_close.destroy()
-    focused_file["image"].save(f"output\{new_file_name}")
+    pending = [len(paths)]
+
+    def on_done(result: Dict[str, Any]) -> None:
+        pending[0] -= 1
+        totals = export.totals.summary()
+        text = (f"saved {result['path']} ({result['bytes'] / 2 ** 20:.2f} MB, "
+                f"{result['megapixels_per_second']:.1f} MP/s), "
+                f"total {totals['count']} files, {totals['megapixels_per_second']:.1f} MP/s")
+        if pending[0]:
+            text += f", {pending[0]} left"
+        if status.winfo_exists():
+            status["text"] = text
+
+    for source, path in zip(sources, paths):
+        runner.submit(
+            f"save {os.path.basename(path)}",
+            lambda source=source, path=path: export.save(
+                read_source(source, cv.IMREAD_UNCHANGED), path, options),
+            on_done=on_done
+        )
+
 
+def save_image(new_file_name: str, options: Dict[str, Any], status: tk.Label) -> None:
+    '''
+    Save the focused image to disk, in the format given by the extension of its name (PNG by default).
+    '''
+    if not new_file_name or not has_source(focused_file):
+        return
+    save_images([dict(focused_file)], [export.output_path(new_file_name)], options, status)
+
+
+def save_all_images(new_file_name: str, options: Dict[str, Any], status: tk.Label) -> None:
+    '''
+    Save every open image, numbering the names.
+    '''
+    if not new_file_name:
+        return
+    base, extension = os.path.splitext(export.output_path(new_file_name))
+    images = opened_images.images()
+    sources = [{"path": image.path, "image": None, "array": None if image.path else image.array}
+               for image in images]
+    save_images(sources, [f"{base}_{index}{extension}" for index in range(1, len(images) + 1)], options, status)
 
-# define main menu
-root = tk.Tk()
-root.title("RasterLab")
-root.resizable(False, False)
-root.protocol("WM_DELETE_WINDOW", terminate_all)
 
+# main window and background workers, created in main()
+root: tk.Tk
+runner: workers.TaskRunner
+in_place: tk.BooleanVar
 save_button = ''
 
 
@@ -640,80 +756,99 @@ def save_image_menu(window_to_destroy: tk.Toplevel) -> None:
     e1.grid(
         column=2, row=1, padx=10, pady=10)
 
-    create_button(
-        new_window, "save", lambda: save_image(new_window, e1.get())).grid(column=2, row=2, padx=5, pady=5)
+    # encoder settings, the format is given by the extension of the name
+    tk.Label(new_window, text="PNG compression (0-9): ", font=("Arial", 12)).grid(
+        column=1, row=2, padx=10, pady=5, sticky="e")
+    png_compression = tk.Entry(new_window, font=("Arial", 12))
+    png_compression.insert(0, str(export.DEFAULT_OPTIONS["png_compression"]))
+    png_compression.grid(column=2, row=2, padx=10, pady=5)
+    tk.Label(new_window, text="JPEG/WebP quality (0-100): ", font=("Arial", 12)).grid(
+        column=1, row=3, padx=10, pady=5, sticky="e")
+    quality = tk.Entry(new_window, font=("Arial", 12))
+    quality.insert(0, str(export.DEFAULT_OPTIONS["jpeg_quality"]))
+    quality.grid(column=2, row=3, padx=10, pady=5)
+    progressive = tk.BooleanVar(new_window, value=export.DEFAULT_OPTIONS["jpeg_progressive"])
+    tk.Checkbutton(new_window, text="progressive JPEG", variable=progressive, font=("Arial", 12)).grid(
+        column=1, row=4, padx=10, pady=5, sticky="w")
+    lossless = tk.BooleanVar(new_window, value=True)
+    tk.Checkbutton(new_window, text="lossless WebP", variable=lossless, font=("Arial", 12)).grid(
+        column=2, row=4, padx=10, pady=5, sticky="w")
+    tk.Label(new_window, text="TIFF compression: ", font=("Arial", 12)).grid(
+        column=1, row=5, padx=10, pady=5, sticky="e")
+    tiff_compression = ttk.Combobox(new_window, values=list(export.TIFF_COMPRESSION), state="readonly")
+    tiff_compression.set(export.DEFAULT_OPTIONS["tiff_compression"])
+    tiff_compression.grid(column=2, row=5, padx=10, pady=5)
+    status = tk.Label(new_window, text="", font=("Arial", 10))
+    status.grid(column=1, row=7, columnspan=3, padx=10, pady=5, sticky="w")
+
+    def options() -> Dict[str, Any]:
+        level = min(max(int(png_compression.get()), 0), 9)
+        chosen = min(max(int(quality.get()), 0), 100)
+        return {
+            "png_compression": level,
+            "jpeg_quality": chosen,
+            "jpeg_progressive": progressive.get(),
+            "webp_quality": 101 if lossless.get() else chosen,
+            "tiff_compression": tiff_compression.get(),
+        }
+
+    def save(every: bool) -> None:
+        try:
+            chosen = options()
+        except ValueError:
+            status["text"] = "compression and quality have to be numbers"
+            return
+        if every:
+            save_all_images(e1.get(), chosen, status)
+        else:
+            save_image(e1.get(), chosen, status)
 
+    create_button(new_window, "save", lambda: save(False)).grid(column=1, row=6, padx=5, pady=5)
+    create_button(new_window, "save all open", lambda: save(True)).grid(column=2, row=6, padx=5, pady=5)
 
-def find_and_show_contours(fname) -> None:
+
+def find_objects(window_to_destroy: tk.Toplevel):
     '''
-    Algorithm that finds and displays marked contours on a given image object.
+    Performs series of operations to locate and analyse a list of found objects.
     '''
-    img = cv.imread(fname, cv.IMREAD_GRAYSCALE)
-    ret, thresh = cv.threshold(img, 127, 255, 0)
-    contours, hierarchy = cv.findContours(
-        thresh, cv.RETR_CCOMP, cv.CHAIN_APPROX_NONE)
-    img3 = cv.cvtColor(thresh, cv.COLOR_GRAY2RGB)
-    for cnt in contours:
-        cv.drawContours(img3, [cnt], 0, (random.randrange(
-            50, 200, 25), random.randrange(50, 200, 25), random.randrange(50, 200, 25)), 3)
-    img = cv.cvtColor(img, cv.COLOR_BGR2RGB)
-    im_pil = Image.fromarray(img3)
+    window_to_destroy.destroy()
+    if not has_source(focused_file):
+        return
+    source = dict(focused_file)
 
-    new_img = ImageTk.PhotoImage(im_pil)
+    def work():
+        img = read_source(source, cv.IMREAD_GRAYSCALE)
+        contours = engine.draw_contours(img)
+        return contours, convert_result(contours), engine.find_objects(img)
 
-    new_window = tk.Toplevel(
-        root, width=im_pil.width, height=im_pil.height)
-    new_window.resizable(False, False)
-    image = tk.Label(new_window, image=new_img)
-    # it has to be a reference, otherwise the image doesn't load
-    image.image = new_img  # type: ignore
-    image.pack()
+    def on_done(result):
+        contours, converted, data = result
+        show_result(contours, "contours", converted)
+        show_objects_data(data)
 
+    runner.submit("find objects", work, on_done=on_done)
 
-def find_objects(window_to_destroy: tk.Toplevel):
+
+def show_objects_data(data: Dict[str, Any]) -> None:
     '''
-    Performs series of operations to locate and analyse a list of found objects.
+    Renders text window with data about found objects.
     '''
-    window_to_destroy.destroy()
-    if not focused_file['path']:
-        return
-    img = cv.imread(focused_file['path'], cv.IMREAD_GRAYSCALE)
-    find_and_show_contours(focused_file['path'])
-    title: str = ""
-    ret, thresh = cv.threshold(img, 127, 255, 0)
-    # Save contour data.
-    contours, hierarchy = cv.findContours(
-        thresh, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
-
-    sorted_data = cv.moments(img)
     new_window = tk.Toplevel(root)
     # Render text file with data about found objects.
     new_window.resizable(False, False)
     t = tk.Text(new_window, height=30, width=40)
-    cnt = contours[0]
-    t.insert(tk.END, f"Found {len(contours)} elements.\n")
-    t.insert(tk.END, f"Area: {cv.contourArea(cnt)}.\n")
-    t.insert(tk.END, f"Perimiter: {cv.arcLength(cnt,True)}.\n")
-    x, y, w, h = cv.boundingRect(cnt)
-    aspect_ratio = float(w)/h
-
-    t.insert(tk.END, f"aspect ratio: {aspect_ratio}.\n")
-    area = cv.contourArea(cnt)
-    x, y, w, h = cv.boundingRect(cnt)
-    rect_area = w*h
-    extent = float(area)/rect_area
-    t.insert(tk.END, f"extent: {extent}.\n")
-    area = cv.contourArea(cnt)
-    hull = cv.convexHull(cnt)
-    hull_area = cv.contourArea(hull)
-    solidity = float(area)/hull_area
-    t.insert(tk.END, f"solidity: {solidity}.\n")
-    area = cv.contourArea(cnt)
-    equi_diameter = np.sqrt(4*area/np.pi)
-    t.insert(tk.END, f"equivalentDiameter: {equi_diameter}.\n")
-
-    for i in sorted_data.keys():
-        t.insert(tk.END, f"{i}: {sorted_data[i]}\n")
+    t.insert(tk.END, f"Found {data['count']} elements.\n")
+    if data['count']:
+        t.insert(tk.END, f"Area: {data['area']}.\n")
+        t.insert(tk.END, f"Perimiter: {data['perimeter']}.\n")
+        t.insert(tk.END, f"aspect ratio: {data['aspect_ratio']}.\n")
+        t.insert(tk.END, f"extent: {data['extent']}.\n")
+        t.insert(tk.END, f"solidity: {data['solidity']}.\n")
+        t.insert(
+            tk.END, f"equivalentDiameter: {data['equivalent_diameter']}.\n")
+
+    for key, value in data['moments'].items():
+        t.insert(tk.END, f"{key}: {value}\n")
     t.pack()
 
 
@@ -744,6 +879,17 @@ def show_analyze_menu():
     )
     find_objects_button.grid(column=5, row=1, padx=5, pady=5)
 
+    # joint color histograms, bins per channel
+    bins_entry = tk.Entry(new_window, width=6, font=("Arial", 12))
+    bins_entry.insert(0, str(DEFAULT_JOINT_BINS))
+    tk.Label(new_window, text="bins", font=("Arial", 12)).grid(column=1, row=2, padx=5, pady=5)
+    bins_entry.grid(column=2, row=2, padx=5, pady=5)
+    for column, (text, space) in enumerate((("hist H-S", "hs"), ("hist a*b*", "ab"), ("hist RGB cube", "rgb")),
+                                          start=3):
+        create_button(
+            new_window, text, lambda space=space: compose_color_histogram(space, bins_entry.get())
+        ).grid(column=column, row=2, padx=5, pady=5)
+
     # disable buttons at the start since there's no data to operate on
     histogram_array_button["state"] = "disabled"
     histogram_button["state"] = "disabled"
@@ -851,141 +997,17 @@ def filter_image(filter_option: int, edge_option: int, a=0, b=0, c=0) -> None:
     '''
     Performs filter operations on selected image object depending on parameters given.
     '''
-    if not focused_file['path']:
-        return
-    img = cv.imread(focused_file['path'])
-    title: str = ""
-    match edge_option:
-        case 0:  # isolated
-            img = cv.copyMakeBorder(
-                img, 10, 10, 10, 10,
-                cv.BORDER_ISOLATED, None, value=0
-            )
-        case 1:  # reflect
-            img = cv.copyMakeBorder(
-                img, 10, 10, 10, 10,
-                cv.BORDER_REFLECT, None, value=0
-            )
-        case 2:  # replicate
-            img = cv.copyMakeBorder(
-                img, 10, 10, 10, 10,
-                cv.BORDER_REPLICATE, None, value=0
-            )
-
-    match filter_option:
-        case 0:
-            blur = cv.GaussianBlur(img, (5, 5), 0)
-            title = 'Gaussian'
-        case 1:
-            blur = cv.blur(img, (5, 5))
-            title = 'Blur'
-        case 2:
-            blur = cv.Sobel(img, cv.CV_64F, a, b, c)
-            title = 'edge_sobel'
-        case 3:
-            blur = cv.Laplacian(img, a)
-            title = 'edge_laplacian'
-        case 4:
-            blur = cv.Canny(img, a, b)
-            title = 'edge_canny'
-        case 5:
-            kernel = np.array([
-                [0, -1, 0],
-                [-1, 5, -1],
-                [0, -1, 0]
-            ])
-            blur = cv.filter2D(img, -1, kernel)
-            title = 'sharpen_a'
-        case 6:
-            kernel = np.array([
-                [-1, -1, -1],
-                [-1, 9, -1],
-                [-1, -1, -1]
-            ])
-            blur = cv.filter2D(img, -1, kernel)
-            title = 'sharpen_b'
-        case 7:
-            kernel = np.array([
-                [1, -2, 1],
-                [-2, 5, -2],
-                [1, -2, 1]
-            ])
-            blur = cv.filter2D(img, -1, kernel)
-            title = 'sharpen_c'
-        case 8:
-            match a:
-                case 0:
-                    kernel = np.array([
-                        [1, 1, 1],
-                        [1, -2, 1],
-                        [-1, -1, -1]
-                    ])
-                case 1:
-                    kernel = np.array([
-                        [1, 1, -1],
-                        [1, -2, -1],
-                        [1, 1, -1]
-                    ])
-                case 2:
-                    kernel = np.array([
-                        [-1, 1, 1],
-                        [-1, -2, 1],
-                        [-1, 1, 1]
-                    ])
-                case 3:
-                    kernel = np.array([
-                        [-1, -1, -1],
-                        [1, -2, 1],
-                        [1, 1, 1]
-                    ])
-                case 4:
-                    kernel = np.array([
-                        [1, 1, 1],
-                        [-1, -2, 1],
-                        [-1, -1, 1]
-                    ])
-                case 5:
-                    kernel = np.array([
-                        [1, 1, 1],
-                        [1, -2, -1],
-                        [1, -1, -1]
-                    ])
-                case 6:
-                    kernel = np.array([
-                        [1, -1, -1],
-                        [1, -2, -1],
-                        [1, 1, 1]
-                    ])
-                case 7:
-                    kernel = np.array([
-                        [-1, -1, 1],
-                        [-1, -2, 1],
-                        [1, 1, 1]
-                    ])
-            title = 'Prewitt'
-            blur = cv.filter2D(img,  -1, kernel)
-        case 9:
-            kernel = a
-            title = 'Custom'
-            blur = cv.filter2D(img,  -1, kernel)
-        case 10:
-            title = f'Median {a}x{a}'
-            blur = cv.medianBlur(img, a)
-
-    plt.imshow(blur), plt.title(title)
-    plt.xticks([]), plt.yticks([])
-    plt.show()
-    im_pil = Image.fromarray(blur)
-
-    new_img = ImageTk.PhotoImage(im_pil)
-    new_window = tk.Toplevel(
-        root, width=im_pil.width, height=im_pil.height)
-    # new_window.iconphoto(False, icon)
-    new_window.resizable(False, False)
-    image = tk.Label(new_window, image=new_img)
-    # it has to be a reference, otherwise the image doesn't load!
-    image.image = new_img  # type: ignore
-    image.pack()
+    title = engine.FILTER_TITLES[filter_option]
+    if filter_option == 10:
+        title = f'{title} {a}x{a}'
+
+    def operation(img):
+        # large images are filtered tile by tile
+        return engine.apply_filter(img, filter_option, edge_option, a, b, c,
+                                   **tiling.options_for(img))
+
+    padding = engine.FILTER_PADDING if edge_option in engine.PADDING_MODES else 0
+    run_image_operation(title, operation, padding=padding)
 
 
 def show_filter_menu():
@@ -1127,11 +1149,31 @@ def show_filter_menu():
             "Prewitt (a - kierunek)",
             lambda: show_edge_mode_submenu(new_window, 8, a.get())
         )
+        button5 = create_button(
+            new_window,
+            "Canny preview",
+            lambda: show_canny_preview(new_window)
+        )
 
         button1.grid(column=1, row=2, padx=5, pady=5)
         button2.grid(column=1, row=3, padx=5, pady=5)
         button3.grid(column=1, row=4, padx=5, pady=5)
         button4.grid(column=1, row=5, padx=5, pady=5)
+        button5.grid(column=1, row=6, padx=5, pady=5)
+
+    def show_canny_preview(to_destroy):
+        '''
+        Previews Canny edges while its thresholds are tuned.
+        '''
+        to_destroy.destroy()
+        show_preview(
+            "Canny",
+            lambda image, a, b, edge_option: engine.apply_filter(image, 4, edge_option, a, b),
+            [preview.Slider("a", "threshold 1", 0, 500, 100),
+             preview.Slider("b", "threshold 2", 0, 500, 200),
+             preview.Slider("edge_option", "edge (0 isolated, 1 reflect, 2 replicate)", 0, 2, 1)],
+            lambda params: filter_image(4, params["edge_option"], params["a"], params["b"])
+        )
 
     def show_sharpen_submenu(to_destroy):
         '''
@@ -1244,10 +1286,29 @@ def show_filter_menu():
             "7x7",
             lambda: show_edge_mode_submenu(new_window, 10, 7)
         )
+        button4 = create_button(
+            new_window,
+            "preview",
+            lambda: show_median_preview(new_window)
+        )
 
         button1.grid(column=1, row=2, padx=5, pady=5)
         button2.grid(column=1, row=3, padx=5, pady=5)
         button3.grid(column=1, row=4, padx=5, pady=5)
+        button4.grid(column=1, row=5, padx=5, pady=5)
+
+    def show_median_preview(to_destroy):
+        '''
+        Previews the median filter while its size is tuned, the size is scaled with the proxy.
+        '''
+        to_destroy.destroy()
+        show_preview(
+            "median",
+            lambda image, a, edge_option: engine.apply_filter(image, 10, edge_option, a),
+            [preview.Slider("a", "size", 3, 31, 5, neighborhood=True, odd=True, minimum=3),
+             preview.Slider("edge_option", "edge (0 isolated, 1 reflect, 2 replicate)", 0, 2, 1)],
+            lambda params: filter_image(10, params["edge_option"], params["a"])
+        )
 
 
 def two_point_operation(window_to_close, option: int, blend_a: float = 1, blend_b: float = 1):
@@ -1255,40 +1316,18 @@ def two_point_operation(window_to_close, option: int, blend_a: float = 1, blend_
     Performs a selected series of two point operations on compatible images depending on given parameters.
     '''
     window_to_close.destroy()
-    if not focused_file['path'] and not previous_file['path']:
+    if not has_source(focused_file) or not has_source(previous_file):
         return
     if blend_b:
         blend_a = float(blend_a)
         blend_b = float(blend_b)
-    img1 = cv.imread(focused_file['path'])
-    img2 = cv.imread(previous_file['path'])
-
-    match option:
-        case 0:  # add
-            result_image = cv.add(img1, img2)
-            title = 'addition'
-        case 1:  # subtract
-            result_image = cv.subtract(img1, img2)
-            title = 'subtraction'
-        case 2:  # blend
-            title = 'blend'
-            result_image = cv.addWeighted(img1, blend_a, img2, blend_b, 0)
-        case 3:  # and
-            title = 'and'
-            result_image = cv.bitwise_and(img1, img2)
-        case 4:  # or
-            title = 'or'
-            result_image = cv.bitwise_or(img1, img2)
-        case 5:  # not
-            title = 'not'
-            result_image = cv.bitwise_not(img1, img2)
-        case 6:  # xor
-            title = 'xor'
-            result_image = cv.bitwise_xor(img1, img2)
-
-    plt.imshow(result_image), plt.title(title)
-    plt.xticks([]), plt.yticks([])
-    plt.show()
+    source1, source2 = dict(focused_file), dict(previous_file)
+    title = engine.TWO_POINT_TITLES[option]
+    run_operation(
+        title,
+        lambda: engine.two_point(read_source(source1), read_source(source2),
+                                 option, blend_a, blend_b)
+    )
 
 
 def show_two_point_menu():
@@ -1340,6 +1379,18 @@ def show_two_point_menu():
         "XOR",
         lambda: two_point_operation(new_window, 6)
     )
+    button8 = create_button(
+        new_window,
+        "BLEND preview",
+        lambda: show_preview(
+            "blend",
+            lambda image1, image2, blend_a, blend_b: engine.two_point(image1, image2, 2, blend_a, blend_b),
+            [preview.Slider("blend_a", "a", 0, 1, 0.5, resolution=0.05),
+             preview.Slider("blend_b", "b", 0, 1, 0.5, resolution=0.05)],
+            lambda params: two_point_operation(new_window, 2, params["blend_a"], params["blend_b"]),
+            [focused_file, previous_file]
+        )
+    )
 
     button1.grid(column=1, row=1, padx=5, pady=5)
     button2.grid(column=2, row=1, padx=5, pady=5)
@@ -1348,6 +1399,7 @@ def show_two_point_menu():
     button5.grid(column=4, row=1, padx=5, pady=5)
     button6.grid(column=5, row=1, padx=5, pady=5)
     button7.grid(column=6, row=1, padx=5, pady=5)
+    button8.grid(column=4, row=2, padx=5, pady=5)
 
 
 def morph_image(window_to_close, o1, o2, o3, o4):
@@ -1356,70 +1408,10 @@ def morph_image(window_to_close, o1, o2, o3, o4):
     '''
     window_to_close.destroy()
     o1, o2, o3, o4 = int(o1), int(o2), int(o3), int(o4)
-    if not focused_file['path']:
-        return
-    img = cv.imread(focused_file['path'])
-    title: str = ""
-    # edge mode
-    match o3:
-        case 1:  # constant
-            edge_mode = cv.BORDER_CONSTANT
-        case 2:  # replicate
-            edge_mode = cv.BORDER_REPLICATE
-        case 3:  # reflect
-            edge_mode = cv.BORDER_REFLECT
-        case 4:  # reflect101
-            edge_mode = cv.BORDER_REFLECT101
-        case 5:  # wrap
-            edge_mode = cv.BORDER_WRAP
-    # generate kernel
-    match o2:
-        case 1:  # rombus
-            # kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (3, 3))
-            r = o4
-            kernel = np.uint8(np.add.outer(*[np.r_[:r, r: -1: -1]]*2) >= r)
-        case 2:  # square
-            kernel = cv.getStructuringElement(cv.MORPH_RECT, (o4, o4))
-    # morph option
-    match o1:
-        case 1:  # Erode
-            result = cv.erode(
-                img,
-                kernel,
-                iterations=2,
-                borderType=edge_mode
-            )
-            title = 'erosion'
-        case 2:  # Dilate
-            result = cv.dilate(
-                img,
-                kernel,
-                iterations=2,
-                borderType=edge_mode
-            )
-            title = 'dilution'
-        case 3:  # Open
-            result = cv.morphologyEx(
-                img,
-                cv.MORPH_OPEN,
-                kernel,
-                iterations=2,
-                borderType=edge_mode
-            )
-            title = 'open'
-        case 4:  # Close
-            result = cv.morphologyEx(
-                img,
-                cv.MORPH_CLOSE,
-                kernel,
-                iterations=2,
-                borderType=edge_mode
-            )
-            title = 'close'
-
-    plt.imshow(result), plt.title(title)
-    plt.xticks([]), plt.yticks([])
-    plt.show()
+    run_image_operation(
+        engine.MORPH_TITLES[o1],
+        lambda img: engine.morph(img, o1, o2, o3, o4, **tiling.options_for(img))
+    )
 
 
 def show_morph_menu():
@@ -1580,6 +1572,24 @@ def show_morph_menu():
     )
     submit_button.grid(column=5, row=1, padx=5, pady=5)
 
+    def show_morph_preview():
+        '''
+        Previews the chosen morph operation while the kernel size is tuned, the size is scaled with the proxy.
+        '''
+        # unchosen options default like in batch mode
+        operation, shape, edge = option1.get() or 1, option2.get() or 2, option3.get() or 2
+        show_preview(
+            engine.MORPH_TITLES[operation],
+            lambda image, size: engine.morph(image, operation, shape, edge, size),
+            # a rombus of size 1 is 3x3 already, a square needs at least 2
+            [preview.Slider("size", "kernel size", 1, 31, option4.get() or 3, neighborhood=True,
+                            minimum=1 if shape == 1 else 2)],
+            lambda params: morph_image(new_window, operation, shape, edge, params["size"])
+        )
+
+    preview_button = create_button(new_window, "preview", show_morph_preview)
+    preview_button.grid(column=5, row=2, padx=5, pady=5)
+
 
 def mask_filter_image(window_to_close, o1, o2, o3):
     '''
@@ -1587,59 +1597,10 @@ def mask_filter_image(window_to_close, o1, o2, o3):
     '''
     window_to_close.destroy()
     o1, o2, o3 = int(o1), int(o2), int(o3)
-    if not focused_file['path']:
-        return
-    img = cv.imread(focused_file['path'])
-    title: str = "mask_filter"
-    match o3:
-        case 1:  # constant
-            edge_mode = cv.BORDER_CONSTANT
-        case 2:  # replicate
-            edge_mode = cv.BORDER_REPLICATE
-        case 3:  # reflect
-            edge_mode = cv.BORDER_REFLECT
-        case 4:  # reflect101
-            edge_mode = cv.BORDER_REFLECT101
-        case 5:  # wrap
-            edge_mode = cv.BORDER_WRAP
-
-    smoothen_mask = np.ones((3, 3))
-    sharpen_mask = np.array([
-        [1, -2, 1],
-        [-2, 4, -2],
-        [1, -2, 1]
-    ])
-    conv_mask = conv2(smoothen_mask, sharpen_mask, mode='full')
-    match o2:
-        case 1:
-            chosen_mask = sharpen_mask
-        case 2:
-            chosen_mask = smoothen_mask
-
-    match o1:  # stages
-        case 1:  # one stage
-            result = cv.filter2D(
-                img,
-                cv.CV_64F,
-                chosen_mask,
-                borderType=edge_mode
-            )
-        case 2:  # two stage
-            result = cv.filter2D(
-                img,
-                cv.CV_64F,
-                smoothen_mask,
-                borderType=edge_mode
-            )
-            result = cv.filter2D(
-                result,
-                cv.CV_64F,
-                sharpen_mask,
-                borderType=edge_mode
-            )
-    plt.imshow(result), plt.title(title)
-    plt.xticks([]), plt.yticks([])
-    plt.show()
+    run_image_operation(
+        "mask_filter",
+        lambda img: engine.mask_filter(img, o1, o2, o3, **tiling.options_for(img))
+    )
 
 
 def show_mask_filter_menu():
@@ -1744,36 +1705,7 @@ def skeletonize_image(to_destroy, o1):
     '''
     to_destroy.destroy()
     o1 = int(o1)
-    if not focused_file['path']:
-        return
-    img = cv.imread(focused_file['path'], 0)
-
-    title = "skeletonize"
-
-    def skeletonize(img):
-        """ OpenCV function to return a skeletonized version of img, a Mat object"""
-
-        img = img.copy()  # don't clobber original
-        skel = img.copy()
-
-        skel[:, :] = 0
-        kernel = cv.getStructuringElement(cv.MORPH_CROSS, (3, 3))
-
-        while True:
-            eroded = cv.morphologyEx(img, cv.MORPH_ERODE, kernel)
-            temp = cv.morphologyEx(eroded, cv.MORPH_DILATE, kernel)
-            temp = cv.subtract(img, temp)
-            skel = cv.bitwise_or(skel, temp)
-            img[:, :] = eroded[:, :]
-            if cv.countNonZero(img) == 0:
-                break
-
-        return skel
-
-    result = skeletonize(img)
-    plt.imshow(result), plt.title(title)
-    plt.xticks([]), plt.yticks([])
-    plt.show()
+    run_image_operation("skeletonize", engine.skeletonize, cv.IMREAD_GRAYSCALE)
 
 
 def show_skeletonize_menu():
@@ -1836,59 +1768,9 @@ def thershold_image(to_destroy, o1=0, o2=0):
     try:
         o1, o2 = int(o1), int(o2)
     except:
-        o1 = int(o1)
-    if not focused_file['path']:
-        return
-    img = cv.imread(focused_file['path'], cv.IMREAD_GRAYSCALE)
-    match o1:
-        case 1:
-            title = "normal thersholding"
-            ret, result = cv.threshold(img, o2, 255, cv.THRESH_BINARY)
-        case 2:
-            title = "adaptive thersholding"
-
-            result = cv.adaptiveThreshold(img, 255, cv.ADAPTIVE_THRESH_MEAN_C,
-                                          cv.THRESH_BINARY, 11, 2)
-        case 3:
-            title = "otsu thersholding"
-            blur = cv.GaussianBlur(img, (5, 5), 0)
-
-            ret3, result = cv.threshold(
-                blur, 0, 255, cv.THRESH_BINARY+cv.THRESH_OTSU)
-        case 4:
-
-            img = cv.imread(focused_file['path'], cv.IMREAD_COLOR)
-            title = "watershedding"
-            # Convert to greyscale.
-            img_gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-            ret2, thresh = cv.threshold(
-                img_gray, 0, 255, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
-            kernel = np.ones((3, 3), np.uint8)
-            # Reduce the noise pollution.
-            opening = cv.morphologyEx(
-                thresh, cv.MORPH_OPEN, kernel, iterations=1)
-            sure_bg = cv.dilate(opening, kernel, iterations=1)
-            dist_transform = cv.distanceTransform(opening, cv.DIST_L2, 5)
-            # Find clean objects by distance transforming.
-            ret, sure_fg = cv.threshold(
-                dist_transform, 0.5*dist_transform.max(), 255, 0)
-            sure_fg = np.uint8(sure_fg)
-            # Find uncertain objects.
-            unknown = cv.subtract(sure_bg, sure_fg)
-            # Mark found objects.
-            ret, markers = cv.connectedComponents(sure_fg)
-            markers = markers+1
-            markers[unknown == 255] = 0
-
-            markers2 = cv.watershed(img, markers)
-            # Display image with color markers.
-            img_gray[markers2 == -1] = 255
-            img[markers2 == -1] = [255, 0, 0]
-            result = cv.applyColorMap(np.uint8(markers2*10), cv.COLORMAP_JET)
-
-    plt.imshow(result), plt.title(title)
-    plt.xticks([]), plt.yticks([])
-    plt.show()
+        o1, o2 = int(o1), 0
+    flags = cv.IMREAD_COLOR if o1 == 4 else cv.IMREAD_GRAYSCALE
+    run_image_operation(engine.SEGMENTATION_TITLES[o1], lambda img: engine.segment(img, o1, o2), flags)
 
 
 def show_segmentation_menu():
@@ -1945,84 +1827,18 @@ def show_segmentation_menu():
     btn4.grid(column=1, row=4, padx=5, pady=5)
 
 
-def render_pil_image(image, title: str) -> Image.Image:
-    '''Convert openCV image into PIL image, return and display it.'''
-    image_array = cv.cvtColor(image, cv.COLOR_BGR2RGB)
-    new_image = Image.fromarray(image_array)
-    tk_image = ImageTk.PhotoImage(new_image)
-
-    new_window = tk.Toplevel(
-        root,
-        width=new_image.width,
-        height=new_image.height
-    )
-    new_window.title(title)
-    new_window.resizable(False, False)
-
-    image = tk.Label(new_window, image=tk_image)
-    image.image = tk_image  # type: ignore
-    add_event_listeners(new_window, new_image)
-    image.pack()
-    return new_image
-
-
 def stitch(to_destroy: tk.Toplevel, raw: bool):
     '''Stitch all opened images.'''
 
     to_destroy.destroy()
-    images = []
-
-    for image_object in opened_images_list:
-        img = cv.imread(image_object.path)
-        images.append(img)
-
-    stitcher = cv.Stitcher_create()
-
-    error, stitched_img = stitcher.stitch(images)
-
-    if not error:
-        if not raw:
-            # add black padding to the image
-            stitched_img = cv.copyMakeBorder(
-                stitched_img, 10, 10, 10, 10,
-                cv.BORDER_CONSTANT, (0, 0, 0)
-            )
-            gray = cv.cvtColor(stitched_img, cv.COLOR_BGR2GRAY)
-            # isolate contours as black pixels
-            thresh_img = cv.threshold(gray, 0, 255, cv.THRESH_BINARY)[1]
-
-            contours = cv.findContours(
-                thresh_img.copy(), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    paths = [image_object.path for image_object in opened_images.images() if image_object.path]
 
-            contours = imutils.grab_contours(contours)
-            # from found contours locate area of interest
-            areaOI = max(contours, key=cv.contourArea)
+    def work():
+        return engine.stitch([image_cache.imread(path) for path in paths], raw)
 
-            mask = np.zeros(thresh_img.shape, dtype="uint8")
-            # create area to be cut from the original image
-            x, y, w, h = cv.boundingRect(areaOI)
-            cv.rectangle(mask, (x, y), (x + w, y + h), 255, -1)
-
-            minRectangle = mask.copy()
-            sub = mask.copy()
-            # find the minimum area with the image
-            while cv.countNonZero(sub) > 0:
-                minRectangle = cv.erode(minRectangle, None)
-                sub = cv.subtract(minRectangle, thresh_img)
-
-            contours = cv.findContours(
-                minRectangle.copy(), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-
-            contours = imutils.grab_contours(contours)
-            areaOI = max(contours, key=cv.contourArea)
-
-            x, y, w, h = cv.boundingRect(areaOI)
-            # from the original stitched image "cut" only the rectangle
-            stitched_img = stitched_img[y:y + h, x:x + w]
-
-        render_pil_image(stitched_img, "Stitch result")
-
-    else:
+    def on_error(error: BaseException):
+        if not isinstance(error, RuntimeError):
+            workers.print_error(error)
         new_window = tk.Toplevel(root)
         new_window.title("Error")
         new_window.resizable(False, False)
@@ -2035,6 +1851,8 @@ def stitch(to_destroy: tk.Toplevel, raw: bool):
         )
         btn1.grid(column=1, row=2, padx=5, pady=5)
 
+    run_operation("Stitch result", work, on_error=on_error)
+
 
 def show_stitch_menu():
     '''
@@ -2044,7 +1862,7 @@ def show_stitch_menu():
     new_window = tk.Toplevel(root)
     new_window.title(f"stich")
     new_window.resizable(False, False)
-    tk.Label(new_window, text=f"Images in memory: {len(opened_images_list)}", font=("Arial", 12)).grid(
+    tk.Label(new_window, text=f"Images in memory: {describe_images()}", font=("Arial", 12)).grid(
         column=1, row=1, padx=10, pady=10)
 
     btn1 = create_button(
@@ -2067,30 +1885,153 @@ def show_stitch_menu():
     btn2.grid(column=2, row=2, padx=5, pady=5)
 
 
-# Generates and renders the main menu.
-file_button = create_button(root, "FILE", show_file_menu)
-analysis_button = create_button(root, "ANALYZE", show_analyze_menu)
-process_button = create_button(root, "PROCESS", show_process_menu)
-filter_button = create_button(root, "FILTER", show_filter_menu)
-two_point_button = create_button(root, "TWO POINT", show_two_point_menu)
-morph_button = create_button(root, "MORPH", show_morph_menu)
-mask_filter_button = create_button(root, "MASK FILTER", show_mask_filter_menu)
-skeletonize_button = create_button(
-    root, "SKELETONIZE", show_skeletonize_menu)
-threshold_button = create_button(
-    root, "SEGMENTATION", show_segmentation_menu)
-stitch_button = create_button(
-    root, "STITCH", show_stitch_menu)
-file_button.grid(column=1, row=1, padx=5, pady=5)
-analysis_button.grid(column=2, row=1, padx=5, pady=5)
-process_button.grid(column=3, row=1, padx=5, pady=5)
-filter_button.grid(column=4, row=1, padx=5, pady=5)
-two_point_button.grid(column=5, row=1, padx=5, pady=5)
-morph_button.grid(column=6, row=1, padx=5, pady=5)
-mask_filter_button.grid(column=7, row=1, padx=5, pady=5)
-skeletonize_button.grid(column=8, row=1, padx=5, pady=5)
-threshold_button.grid(column=9, row=1, padx=5, pady=5)
-stitch_button.grid(column=10, row=1, padx=5, pady=5)
-
-# Initialize program.
-root.mainloop()
+# refresh period of the trace window and how many of the latest spans it lists
+TRACE_REFRESH_MS = 500
+TRACE_ROWS = 500
+
+
+def describe_arrays(infos: List[Dict[str, Any]]) -> str:
+    '''
+    Formats array sizes recorded by the tracer, e.g. "512x512x3 uint8".
+    '''
+    parts = []
+    for info in infos:
+        if "shape" in info:
+            parts.append(f"{'x'.join(map(str, info['shape']))} {info['dtype']}")
+        else:
+            parts.append(f"{info['count']} arrays, {info['bytes'] // 1024} KB")
+    return ", ".join(parts)
+
+
+def show_trace_menu() -> None:
+    '''
+    Renders the trace window listing recorded operations, decodes, renders and saves.
+    '''
+    new_window = tk.Toplevel(root)
+    new_window.title("TRACE")
+    columns = ("category", "wall", "cpu", "memory", "inputs", "outputs")
+    tree = ttk.Treeview(new_window, columns=columns, height=20)
+    tree.heading("#0", text="name")
+    tree.column("#0", width=260)
+    for column, text, width in zip(columns, ("category", "wall [ms]", "cpu [ms]", "peak [KB]", "input", "output"),
+                                   (80, 80, 80, 80, 180, 180)):
+        tree.heading(column, text=text)
+        tree.column(column, width=width, anchor="e" if column in ("wall", "cpu", "memory") else "w")
+    scrollbar = tk.Scrollbar(new_window, orient=tk.VERTICAL, command=tree.yview)
+    tree.configure(yscrollcommand=scrollbar.set)
+    tree.grid(column=1, row=1, columnspan=6, sticky="nsew")
+    scrollbar.grid(column=7, row=1, sticky="ns")
+    new_window.grid_rowconfigure(1, weight=1)
+    new_window.grid_columnconfigure(6, weight=1)
+    shown = [-1]
+
+    def refresh() -> None:
+        if not new_window.winfo_exists():
+            return
+        if tracing.tracer.recorded != shown[0]:
+            shown[0] = tracing.tracer.recorded
+            tree.delete(*tree.get_children())
+            # newest first
+            for current in reversed(tracing.tracer.snapshot()[-TRACE_ROWS:]):
+                memory = "" if current.peak_memory is None else current.peak_memory // 1024
+                tree.insert("", "end", text="  " * current.depth + current.name, values=(
+                    current.category, f"{current.wall * 1000:.2f}", f"{current.cpu * 1000:.2f}", memory,
+                    describe_arrays(current.inputs), describe_arrays(current.outputs)))
+        new_window.after(TRACE_REFRESH_MS, refresh)
+
+    def clear() -> None:
+        tracing.tracer.clear()
+        tree.delete(*tree.get_children())
+
+    def export(chrome: bool) -> None:
+        path = filedialog.asksaveasfilename(
+            parent=new_window, defaultextension=".json", filetypes=[("JSON", ".json")])
+        if path:
+            if chrome:
+                tracing.tracer.export_chrome(path)
+            else:
+                tracing.tracer.export_json(path)
+
+    memory = tk.BooleanVar(new_window, value=tracing.tracer.memory)
+    tk.Checkbutton(new_window, text="trace memory", variable=memory, font=("consolas", 12),
+                   command=lambda: tracing.tracer.set_memory(memory.get())).grid(column=1, row=2, padx=5, pady=5)
+    create_button(new_window, "clear", clear).grid(column=2, row=2, padx=5, pady=5)
+    create_button(new_window, "export JSON", lambda: export(False)).grid(column=3, row=2, padx=5, pady=5)
+    create_button(new_window, "export Chrome trace", lambda: export(True)).grid(
+        column=4, row=2, padx=5, pady=5)
+    refresh()
+
+
+def main() -> None:
+    '''
+    Generates and renders the main menu, then starts the program.
+    '''
+    global root, runner, memory_label, in_place
+    root = tk.Tk()
+    root.title("RasterLab")
+    root.resizable(False, False)
+    root.protocol("WM_DELETE_WINDOW", terminate_all)
+    runner = workers.TaskRunner(root)
+
+    file_button = create_button(root, "FILE", show_file_menu)
+    analysis_button = create_button(root, "ANALYZE", show_analyze_menu)
+    process_button = create_button(root, "PROCESS", show_process_menu)
+    filter_button = create_button(root, "FILTER", show_filter_menu)
+    two_point_button = create_button(root, "TWO POINT", show_two_point_menu)
+    morph_button = create_button(root, "MORPH", show_morph_menu)
+    mask_filter_button = create_button(root, "MASK FILTER", show_mask_filter_menu)
+    skeletonize_button = create_button(
+        root, "SKELETONIZE", show_skeletonize_menu)
+    threshold_button = create_button(
+        root, "SEGMENTATION", show_segmentation_menu)
+    stitch_button = create_button(
+        root, "STITCH", show_stitch_menu)
+    trace_button = create_button(root, "TRACE", show_trace_menu)
+    undo_button = create_button(root, "UNDO", lambda: step_history(focused_file["raster"]))
+    redo_button = create_button(root, "REDO", lambda: step_history(focused_file["raster"], redo=True))
+    file_button.grid(column=1, row=1, padx=5, pady=5)
+    analysis_button.grid(column=2, row=1, padx=5, pady=5)
+    process_button.grid(column=3, row=1, padx=5, pady=5)
+    filter_button.grid(column=4, row=1, padx=5, pady=5)
+    two_point_button.grid(column=5, row=1, padx=5, pady=5)
+    morph_button.grid(column=6, row=1, padx=5, pady=5)
+    mask_filter_button.grid(column=7, row=1, padx=5, pady=5)
+    skeletonize_button.grid(column=8, row=1, padx=5, pady=5)
+    threshold_button.grid(column=9, row=1, padx=5, pady=5)
+    stitch_button.grid(column=10, row=1, padx=5, pady=5)
+    trace_button.grid(column=11, row=1, padx=5, pady=5)
+    undo_button.grid(column=12, row=1, padx=5, pady=5)
+    redo_button.grid(column=13, row=1, padx=5, pady=5)
+    workers.TaskPanel(root, runner).frame.grid(
+        column=1, row=2, columnspan=9, padx=5, pady=5, sticky="w")
+    # operations replace the focused image instead of opening a new window
+    in_place = tk.BooleanVar(root, value=False)
+    tk.Checkbutton(root, text="in place", variable=in_place, font=("consolas", 12)).grid(
+        column=12, row=2, columnspan=2, padx=5, pady=5, sticky="w")
+    memory_label = tk.Label(root, text="images: 0", font=("consolas", 10))
+    memory_label.grid(column=10, row=2, columnspan=2, padx=5, pady=5, sticky="e")
+
+    report = "--import-report" in sys.argv
+    if "--memory-budget" in sys.argv:
+        # megabytes held by the images of open windows before the least recently used ones are spilled
+        opened_images.set_budget(int(float(sys.argv[sys.argv.index("--memory-budget") + 1]) * 2 ** 20))
+    update_memory_label()
+
+    def on_started() -> None:
+        elapsed = time.perf_counter() - STARTED
+        tracing.instant("startup", seconds=elapsed)
+        if report:
+            print(f"Menu ready in {elapsed * 1000:.0f} ms")
+        root.after(WARM_UP_DELAY_MS, lambda: lazy.warm_up(WARM_UP_MODULES, on_warmed_up))
+
+    def on_warmed_up() -> None:
+        if report:
+            print(f"Imports:\n{lazy.report()}")
+
+    root.after_idle(on_started)
+    # Initialize program.
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+'''
+Memory-mapped raster files of RasterLab.
+
+Uncompressed rasters don't need decoding: their pixels are already laid out
+on disk as an array. Such files are opened with `np.memmap`, so opening takes
+the same time regardless of the size of the file and pages are only read when
+an operation touches them. Operations receive read-only views of the mapping.
+
+Supported files:
+
+- `.npy` - NumPy arrays of shape (height, width) or (height, width, channels),
+- `.raw` - headerless pixels described by a `.raw.json` file next to them,
+  e.g. `{"shape": [20000, 30000, 3], "dtype": "uint8"}` (optionally `"offset"`),
+- `.bmp` - uncompressed 24 and 32 bit (mapped as BGR), and 8 bit grayscale bitmaps.
+
+Channels are in BGR(A) order, like in arrays decoded by OpenCV.
+'''
+from typing import Any, Dict, Optional, Tuple
+import json
+import os
+import struct
+import numpy as np
+import cv2 as cv
+
+
+MAPPED_EXTENSIONS = ('.npy', '.raw', '.bmp')
+
+# BITMAPFILEHEADER and the part of BITMAPINFOHEADER shared by all its versions
+BMP_FILE_HEADER = struct.Struct('<2sIHHI')
+BMP_INFO_HEADER = struct.Struct('<IiiHHI')
+BI_RGB = 0
+
+
+def raw_description(path: str) -> str:
+    '''
+    Returns the path of the JSON file describing a raw raster.
+    '''
+    return path + '.json'
+
+
+def is_mapped(path: str) -> bool:
+    return path.lower().endswith(MAPPED_EXTENSIONS)
+
+
+def open_npy(path: str) -> np.ndarray:
+    return np.load(path, mmap_mode='r')
+
+
+def open_raw(path: str) -> np.ndarray:
+    with open(raw_description(path)) as file:
+        description = json.load(file)
+    return np.memmap(path, dtype=np.dtype(description["dtype"]), mode='r',
+                     offset=description.get("offset", 0), shape=tuple(description["shape"]))
+
+
+def open_bmp(path: str) -> Optional[np.ndarray]:
+    '''
+    Maps the pixels of an uncompressed bitmap, None if the bitmap has to be decoded (compressed, paletted).
+    '''
+    with open(path, 'rb') as file:
+        header = file.read(BMP_FILE_HEADER.size + BMP_INFO_HEADER.size)
+        if len(header) < BMP_FILE_HEADER.size + BMP_INFO_HEADER.size:
+            return None
+        magic, _, _, _, pixels_offset = BMP_FILE_HEADER.unpack_from(header)
+        info_size, width, height, _, bits, compression = BMP_INFO_HEADER.unpack_from(header, BMP_FILE_HEADER.size)
+        # BITMAPCOREHEADER (12 bytes) lays its fields out differently, OpenCV decodes it
+        if magic != b'BM' or info_size < 40 or width <= 0 or compression != BI_RGB or bits not in (8, 24, 32):
+            return None
+        if bits == 8:
+            # only a grayscale ramp palette makes the indices the pixel values
+            file.seek(BMP_FILE_HEADER.size + info_size)
+            palette = np.frombuffer(file.read(256 * 4), dtype=np.uint8)
+            if palette.size != 256 * 4 or not np.array_equal(
+                    palette.reshape(256, 4)[:, :3], np.repeat(np.arange(256, dtype=np.uint8), 3).reshape(256, 3)):
+                return None
+    channels = bits // 8
+    rows = abs(height)
+    # rows are padded to a multiple of 4 bytes
+    stride = (width * channels + 3) // 4 * 4
+    data = np.memmap(path, dtype=np.uint8, mode='r', offset=pixels_offset, shape=(rows, stride))
+    image = data[:, :width * channels]
+    image = image.reshape(rows, width) if channels == 1 else image.reshape(rows, width, channels)
+    if channels == 4:
+        # the fourth byte of BI_RGB pixels is reserved, not alpha; OpenCV reads them as BGR too
+        image = image[:, :, :3]
+    # positive height means the rows are stored bottom-up
+    return image[::-1] if height > 0 else image
+
+
+def open_mapped(path: str) -> Optional[np.ndarray]:
+    '''
+    Returns a read-only memory-mapped view of the pixels, None if the file has to be decoded instead.
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return open_npy(path)
+    if extension == '.raw':
+        return open_raw(path)
+    if extension == '.bmp':
+        return open_bmp(path)
+    return None
+
+
+def convert(image: np.ndarray, flags: int = cv.IMREAD_UNCHANGED) -> np.ndarray:
+    '''
+    Returns the image with the channels cv.imread would give for the flags.
+    The image itself is returned when it already has them, so views stay views.
+    '''
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    if flags == cv.IMREAD_GRAYSCALE and channels != 1:
+        return cv.cvtColor(image, cv.COLOR_BGRA2GRAY if channels == 4 else cv.COLOR_BGR2GRAY)
+    if flags == cv.IMREAD_COLOR and channels != 3:
+        return cv.cvtColor(image, cv.COLOR_BGRA2BGR if channels == 4 else cv.COLOR_GRAY2BGR)
+    return image
+
+
+def create(path: str, shape: Tuple[int, ...], dtype: Any) -> np.ndarray:
+    '''
+    Creates a writable memory-mapped .npy or .raw file, results can be written into it directly.
+    '''
+    if path.lower().endswith('.raw'):
+        description: Dict[str, Any] = {"shape": list(shape), "dtype": np.dtype(dtype).str}
+        with open(raw_description(path), 'w') as file:
+            json.dump(description, file)
+        return np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+def save(path: str, image: np.ndarray) -> None:
+    '''
+    Writes an array as a .npy or .raw file.
+    '''
+    out = create(path, image.shape, image.dtype)
+    out[...] = image
+    out.flush()
@@ -0,0 +1,208 @@
+'''
+Lazy operation pipelines of RasterLab.
+
+A pipeline records engine operations as a graph of nodes instead of running
+them right away, e.g. median -> Otsu -> open -> skeletonize:
+
+    pipe = Pipeline()
+    source = pipe.load("examples/lena_gray.bmp", cv.IMREAD_GRAYSCALE)
+    median = source.then("filter", filter_option=10, edge_option=1, a=5)
+    skeleton = median.then("segment", mode=3).then(
+        "morph", operation=3, shape=2, edge=2, size=3).then("skeletonize")
+    result = skeleton.compute()
+
+Nothing is computed until a node is asked for its result. Results are kept in
+memory and passed straight to the next operation, so no intermediate result
+is displayed or read from disk again. Chains of point operations (negate,
+threshold, posterize, stretch with a given range) are fused into a single
+lookup table and applied in one pass. Changing the parameters of a node only
+drops the results of that node and the nodes downstream of it.
+'''
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import threading
+import numpy as np
+import cv2 as cv
+import engine
+import image_cache
+import point_ops
+
+
+def threshold_lut(value: int = 2, simple: bool = True) -> np.ndarray:
+    if simple:
+        return point_ops.threshold_lut(value)
+    return point_ops.multilevel_lut(value, 255)
+
+
+def posterize_lut(bins: int) -> np.ndarray:
+    return point_ops.multilevel_lut(bins, 256)
+
+
+def stretch_lut(p1: Optional[int] = None, p2: Optional[int] = None,
+                q3: Optional[int] = None, q4: Optional[int] = None, **kwargs) -> Optional[np.ndarray]:
+    # the automatic range depends on the image, so only a given range is a fixed table
+    if p1 is None or p2 is None or q3 is None or q4 is None:
+        return None
+    return point_ops.stretch_lut(int(p1), int(p2), int(q3), int(q4))
+
+
+# operation name -> (engine function, lookup table factory of point operations)
+# a factory may return None when the table depends on the image, the function is run then
+OPERATIONS: Dict[str, Tuple[Callable[..., np.ndarray], Optional[Callable[..., Optional[np.ndarray]]]]] = {
+    "negate": (engine.negate, point_ops.negate_lut),
+    "threshold": (engine.threshold, threshold_lut),
+    "posterize": (engine.posterize, posterize_lut),
+    "stretch": (engine.stretch, stretch_lut),
+    "filter": (engine.apply_filter, None),
+    "two_point": (engine.two_point, None),
+    "morph": (engine.morph, None),
+    "mask_filter": (engine.mask_filter, None),
+    "skeletonize": (engine.skeletonize, None),
+    "segment": (engine.segment, None),
+}
+
+
+class Node:
+    '''
+    Operation in a pipeline together with its inputs, parameters and (once computed) its result.
+    '''
+
+    def __init__(self, pipeline: "Pipeline", name: str, operation: Callable[..., np.ndarray],
+                 inputs: List["Node"], params: Dict[str, Any],
+                 lut_factory: Optional[Callable[..., Optional[np.ndarray]]] = None) -> None:
+        self.pipeline = pipeline
+        self.name = name
+        self.operation = operation
+        self.inputs = inputs
+        self.params = params
+        self.lut_factory = lut_factory
+        self.consumers: List[Node] = []
+        self.buffer: Optional[np.ndarray] = None
+        self.lut: Optional[np.ndarray] = None
+        self._update_lut()
+
+    def __repr__(self) -> str:
+        return f"Node({self.name}, {self.params})"
+
+    def _update_lut(self) -> None:
+        self.lut = self.lut_factory(**self.params) if self.lut_factory is not None else None
+
+    def then(self, name: str, *others: "Node", **params) -> "Node":
+        '''
+        Adds an operation taking this node (and others) as its input.
+        '''
+        return self.pipeline.add(name, self, *others, **params)
+
+    def set(self, **params) -> None:
+        self.pipeline.update(self, **params)
+
+    def compute(self) -> np.ndarray:
+        return self.pipeline.compute(self)
+
+
+class Pipeline:
+    '''
+    Graph of lazily computed operations.
+    Results are read-only since they are shared with the nodes downstream.
+    '''
+
+    def __init__(self) -> None:
+        self.nodes: List[Node] = []
+        # number of operations actually run, fused point operations count as one
+        self.runs = 0
+        self._lock = threading.RLock()
+
+    def _node(self, name: str, operation: Callable[..., np.ndarray], inputs: List[Node],
+              params: Dict[str, Any], lut_factory=None) -> Node:
+        node = Node(self, name, operation, inputs, params, lut_factory)
+        for source in inputs:
+            source.consumers.append(node)
+        self.nodes.append(node)
+        return node
+
+    def source(self, image: np.ndarray, name: str = "source") -> Node:
+        '''
+        Adds an already decoded array as an input of the pipeline.
+        '''
+        # a view, so that making results read-only doesn't affect the caller's array
+        return self._node(name, image.view, [], {})
+
+    def feed(self, node: Node, image: np.ndarray) -> None:
+        '''
+        Replaces the array of a source node (e.g. with the next frame of a video), dropping the results downstream.
+        '''
+        with self._lock:
+            node.operation = image.view
+            for dependent in self.downstream(node):
+                dependent.buffer = None
+
+    def load(self, path: str, flags: int = cv.IMREAD_COLOR) -> Node:
+        '''
+        Adds an image file as an input of the pipeline, it's decoded (through the image cache) when needed.
+        '''
+        return self._node(path, image_cache.imread, [], {"path": path, "flags": flags})
+
+    def add(self, name: str, *inputs: Node, **params) -> Node:
+        '''
+        Adds an operation from OPERATIONS, params are passed to the engine function by name.
+        '''
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {name}")
+        operation, lut_factory = OPERATIONS[name]
+        return self._node(name, operation, list(inputs), params, lut_factory)
+
+    def downstream(self, node: Node) -> List[Node]:
+        '''
+        Returns the node and every node depending on it.
+        '''
+        found: List[Node] = []
+        pending = [node]
+        while pending:
+            current = pending.pop()
+            if current not in found:
+                found.append(current)
+                pending.extend(current.consumers)
+        return found
+
+    def update(self, node: Node, **params) -> None:
+        '''
+        Changes parameters of a node, results downstream of it are computed again when asked for.
+        '''
+        with self._lock:
+            node.params.update(params)
+            node._update_lut()
+            for dependent in self.downstream(node):
+                dependent.buffer = None
+
+    def compute(self, node: Node) -> np.ndarray:
+        '''
+        Returns the result of a node, computing only what isn't known yet.
+        '''
+        with self._lock:
+            return self._compute(node)
+
+    def _compute(self, node: Node) -> np.ndarray:
+        if node.buffer is not None:
+            return node.buffer
+        if node.lut is not None:
+            # walk up the chain of point operations which aren't computed yet and fuse their tables
+            luts = [node.lut]
+            base = node.inputs[0]
+            while base.buffer is None and base.lut is not None:
+                luts.append(base.lut)
+                base = base.inputs[0]
+            # tables map 8-bit values, other results are saturated like when they are displayed
+            result = point_ops.apply_lut(engine.to_uint8(self._compute(base)), point_ops.compose(*reversed(luts)))
+        else:
+            result = node.operation(*[self._compute(source) for source in node.inputs], **node.params)
+        result.flags.writeable = False
+        self.runs += 1
+        node.buffer = result
+        return result
+
+    def clear(self) -> None:
+        '''
+        Drops every computed result.
+        '''
+        with self._lock:
+            for node in self.nodes:
+                node.buffer = None
@@ -0,0 +1,109 @@
+'''
+Point operation engine of RasterLab.
+
+Every point operation is compiled into a 256 entry lookup table and applied in
+one vectorized pass with `cv.LUT`, instead of looping over the pixels. Tables
+are 1-D (the same for every channel) or (256, channels) for per channel
+operations. Alpha is never touched.
+'''
+from typing import List
+import numpy as np
+import cv2 as cv
+
+
+LEVELS = np.arange(256, dtype=np.int64)
+
+
+def identity_lut() -> np.ndarray:
+    '''
+    Returns a table which leaves the values as they are.
+    '''
+    return LEVELS.astype(np.uint8)
+
+
+def negate_lut() -> np.ndarray:
+    '''
+    Returns a table inverting the values.
+    '''
+    return (255 - LEVELS).astype(np.uint8)
+
+
+def threshold_lut(value: int) -> np.ndarray:
+    '''
+    Returns a table setting values below the threshold to 0 and the rest to 255.
+    '''
+    return np.where(LEVELS < value, 0, 255).astype(np.uint8)
+
+
+def multilevel_lut(bins: int, span: int) -> np.ndarray:
+    '''
+    Returns a table mapping each level to the bottom of its bin.
+    Levels not covered by the bins stay in the last one.
+    '''
+    if bins < 1:
+        raise ValueError("Number of bins has to be positive.")
+    goal_table: List[int] = []
+    for i in range(bins):
+        for j in range(int(span / bins)):
+            goal_table.append(int(span / bins * i))
+    last = goal_table[-1] if goal_table else 0
+    goal_table.extend([last] * (256 - len(goal_table)))
+    return np.array(goal_table[:256], dtype=np.uint8)
+
+
+def stretch_lut(start: int, end: int, q3: int, q4: int) -> np.ndarray:
+    '''
+    Returns a table stretching the start-end range of values, values outside q3-q4 are clipped to it.
+    '''
+    if end == start:
+        return identity_lut()
+    stretched = ((LEVELS - start) * q4) // (end - start)
+    stretched = np.where(LEVELS < q3, q3, stretched)
+    stretched = np.where(LEVELS > q4, q4, stretched)
+    return np.clip(stretched, 0, 255).astype(np.uint8)
+
+
+def compose(*luts: np.ndarray) -> np.ndarray:
+    '''
+    Fuses tables into one, applying them in the given order.
+    '''
+    result = identity_lut()
+    for lut in luts:
+        if lut.ndim == 2 and result.ndim == 1:
+            result = np.repeat(result[:, None], lut.shape[1], axis=1)
+        if lut.ndim == 1:
+            result = lut[result]
+        else:
+            result = np.take_along_axis(lut, result.astype(np.int64), axis=0)
+    return result.astype(np.uint8)
+
+
+def channel_lut(lut: np.ndarray, channels: int, color_channels: int) -> np.ndarray:
+    '''
+    Expands a table to one column per image channel, alpha columns get the identity.
+    '''
+    if lut.ndim == 1:
+        lut = np.repeat(lut[:, None], color_channels, axis=1)
+    columns = [lut[:, min(i, lut.shape[1] - 1)] for i in range(color_channels)]
+    columns += [identity_lut()] * (channels - color_channels)
+    return np.stack(columns, axis=1)
+
+
+def apply_lut(image: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    '''
+    Applies a table to an 8-bit array in one pass, alpha is kept.
+    '''
+    if image.dtype != np.uint8:
+        raise ValueError("Lookup tables can only be applied to 8-bit images.")
+    if image.ndim == 2:
+        if lut.ndim != 1:
+            lut = lut[:, 0]
+        return cv.LUT(image, lut)
+    channels = image.shape[2]
+    color_channels = 3 if channels >= 3 else channels
+    if lut.ndim == 1 and channels == color_channels:
+        return cv.LUT(image, lut)
+    table = channel_lut(lut, channels, color_channels)
+    if channels > 4:
+        return np.take_along_axis(table, image.reshape(-1, channels).astype(np.intp), axis=0).reshape(image.shape)
+    return cv.LUT(image, np.ascontiguousarray(table.reshape(1, 256, channels)))
@@ -0,0 +1,273 @@
+'''
+Live parameter previews of RasterLab.
+
+Parameters of an operation are tuned with sliders while the operation runs on
+a downscaled proxy of the image (about a megapixel), so the preview follows
+the sliders at interactive rates. The full resolution result is computed only
+when the parameters are applied.
+
+Neighborhood sizes are scaled with the proxy: a 9x9 median of the image looks
+like a 3x3 median of a proxy a third of its size. When a neighborhood would
+shrink below its smallest meaningful size (e.g. a 3x3 median on a proxy half
+the size), the proxy can't show it; the operation then runs at full resolution
+on a crop of the image of the same number of pixels, centered on the part of
+the image visible in its window.
+
+Slider changes made while a preview is computed are coalesced into one more
+computation with the latest values.
+'''
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import math
+import threading
+import time
+import tkinter as tk
+import weakref
+import numpy as np
+import cv2 as cv
+import display
+import tracing
+import viewer
+
+
+# pixels of the proxy (or crop) a preview runs on
+PROXY_PIXELS = 1 << 20
+# bytes of proxies kept for the next previews of their images
+PROXY_CACHE_BYTES = 64 * 1024 * 1024
+
+Box = Tuple[int, int, int, int]
+
+
+def proxy_scale(shape: Tuple[int, ...], max_pixels: int = PROXY_PIXELS) -> float:
+    '''
+    Returns the factor an image is downscaled by to have at most max_pixels, 1 for smaller images.
+    '''
+    return min(1.0, math.sqrt(max_pixels / (shape[0] * shape[1])))
+
+
+# (id of the image, size) -> its proxy, least recently used first
+_proxies: OrderedDict[Tuple[int, Tuple[int, int]], np.ndarray] = OrderedDict()
+_proxies_lock = threading.Lock()
+
+
+def _forget(image_id: int) -> None:
+    with _proxies_lock:
+        for key in [key for key in _proxies if key[0] == image_id]:
+            del _proxies[key]
+
+
+def proxy(image: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    '''
+    Returns the image downscaled to size (width, height), memoized per image object.
+    '''
+    if (image.shape[1], image.shape[0]) == size:
+        return image
+    key = (id(image), size)
+    with _proxies_lock:
+        result = _proxies.get(key)
+        if result is not None:
+            _proxies.move_to_end(key)
+            return result
+    with tracing.span("proxy", "preview", size=list(size)) as current:
+        current.input(image)
+        result = cv.resize(image, size, interpolation=cv.INTER_AREA)
+    result.flags.writeable = False
+    with _proxies_lock:
+        _proxies[key] = result
+        while sum(cached.nbytes for cached in _proxies.values()) > PROXY_CACHE_BYTES and len(_proxies) > 1:
+            _proxies.popitem(last=False)
+    # ids are reused once the image is gone
+    weakref.finalize(image, _forget, id(image))
+    return result
+
+
+def crop_box(shape: Tuple[int, ...], center: Optional[Tuple[int, int]] = None,
+             max_pixels: int = PROXY_PIXELS) -> Box:
+    '''
+    Returns the (left, top, right, bottom) box of a crop of about max_pixels around center (x, y),
+    by default the middle of the image, moved inside the image.
+    '''
+    height, width = shape[:2]
+    side = int(math.sqrt(max_pixels))
+    crop_width, crop_height = min(side, width), min(side, height)
+    x, y = center if center is not None else (width // 2, height // 2)
+    left = min(max(x - crop_width // 2, 0), width - crop_width)
+    top = min(max(y - crop_height // 2, 0), height - crop_height)
+    return left, top, left + crop_width, top + crop_height
+
+
+class Slider:
+    '''
+    Parameter of an operation tuned with a slider.
+    Neighborhood sizes (in pixels) are scaled with the proxy, down to minimum.
+    '''
+
+    def __init__(self, name: str, label: str, start: float, end: float, value: Optional[float] = None,
+                 resolution: float = 1, neighborhood: bool = False, odd: bool = False, minimum: int = 1) -> None:
+        self.name = name
+        self.label = label
+        self.start = start
+        self.end = end
+        self.value = start if value is None else value
+        self.resolution = resolution
+        self.neighborhood = neighborhood
+        self.odd = odd
+        self.minimum = minimum
+
+    def convert(self, value: float) -> Any:
+        '''
+        Returns a value of the slider as the operation takes it.
+        '''
+        if self.resolution != 1:
+            return float(value)
+        value = int(round(float(value)))
+        # even sizes snap up to the next odd one
+        return value | 1 if self.odd else value
+
+    def scale(self, value: int, factor: float) -> Optional[int]:
+        '''
+        Returns a neighborhood size for an image scaled by factor, None if it would be smaller than its minimum.
+        '''
+        size = value * factor
+        size = 2 * int(round((size - 1) / 2)) + 1 if self.odd else int(round(size))
+        return size if size >= self.minimum else None
+
+
+def scale_params(sliders: List[Slider], params: Dict[str, Any], factor: float) -> Optional[Dict[str, Any]]:
+    '''
+    Returns the parameters for an image scaled by factor, None if a neighborhood can't be scaled that far.
+    '''
+    if factor >= 1:
+        return params
+    scaled = dict(params)
+    for slider in sliders:
+        if slider.neighborhood:
+            size = slider.scale(params[slider.name], factor)
+            if size is None:
+                return None
+            scaled[slider.name] = size
+    return scaled
+
+
+class LivePreview:
+    '''
+    Window previewing an operation while its parameters are tuned.
+    operation gets the sources (proxies or crops) and the parameters by name, on_apply gets the
+    full resolution parameters once they are applied. submit runs a function in the background
+    and calls on_done / on_error with its outcome on the Tk thread (like workers.TaskRunner.submit).
+    '''
+
+    def __init__(self, parent: tk.Misc, title: str, sources: List[np.ndarray],
+                 operation: Callable[..., np.ndarray], sliders: List[Slider],
+                 on_apply: Callable[[Dict[str, Any]], None], submit: Callable,
+                 center: Optional[Tuple[int, int]] = None, max_pixels: int = PROXY_PIXELS) -> None:
+        self.title = title
+        self.sources = sources
+        self.operation = operation
+        self.sliders = sliders
+        self.on_apply = on_apply
+        self.submit = submit
+        self.center = center
+        self.max_pixels = max_pixels
+        self.factor = proxy_scale(sources[0].shape, max_pixels)
+        height, width = sources[0].shape[:2]
+        # every source is scaled to the size of the first one, two point operations need equal sizes
+        self.proxy_size = (max(int(width * self.factor), 1), max(int(height * self.factor), 1))
+        self.buffer = display.DisplayBuffer()
+        self.view: Optional[viewer.ImageViewer] = None
+        self._busy = False
+        self._dirty = False
+
+        self.window = tk.Toplevel(parent)
+        self.window.title(f"Preview: {title}")
+        self.frame = tk.Frame(self.window)
+        self.frame.grid(column=0, row=0, sticky="nsew")
+        self.window.grid_rowconfigure(0, weight=1)
+        self.window.grid_columnconfigure(0, weight=1)
+        controls = tk.Frame(self.window)
+        controls.grid(column=0, row=1, sticky="ew")
+        self.variables: Dict[str, tk.DoubleVar] = {}
+        for row, slider in enumerate(sliders):
+            variable = tk.DoubleVar(value=slider.value)
+            self.variables[slider.name] = variable
+            tk.Scale(controls, label=slider.label, variable=variable, from_=slider.start, to=slider.end,
+                     resolution=slider.resolution, orient=tk.HORIZONTAL, length=300,
+                     command=lambda value: self.schedule()).grid(column=1, row=row, padx=5, sticky="w")
+        self.info = tk.Label(controls, text="", font=("Arial", 10), justify=tk.LEFT)
+        self.info.grid(column=2, row=0, rowspan=max(len(sliders), 1), padx=10, sticky="w")
+        tk.Button(controls, text="apply", font=("consolas", 12), command=self.apply).grid(
+            column=3, row=0, padx=10, pady=5)
+        self.schedule()
+
+    def params(self) -> Dict[str, Any]:
+        return {slider.name: slider.convert(self.variables[slider.name].get()) for slider in self.sliders}
+
+    def crops(self) -> Tuple[List[np.ndarray], Box]:
+        box = crop_box(self.sources[0].shape, self.center, self.max_pixels)
+        left, top, right, bottom = box
+        return [source[top:bottom, left:right] for source in self.sources], box
+
+    def schedule(self) -> None:
+        '''
+        Computes the preview with the current parameters, after the one being computed if there is one.
+        '''
+        if self._busy:
+            self._dirty = True
+            return
+        self._start()
+
+    def _start(self) -> None:
+        params = self.params()
+        scaled = scale_params(self.sliders, params, self.factor)
+        if scaled is None:
+            inputs, box = self.crops()
+            scaled = params
+            where = f"crop {box[2] - box[0]}x{box[3] - box[1]} at full resolution"
+        else:
+            inputs = [proxy(source, self.proxy_size) for source in self.sources]
+            where = f"proxy {self.proxy_size[0]}x{self.proxy_size[1]} (1:{1 / self.factor:.1f})"
+        operation = self.operation
+        self._busy = True
+        started = time.perf_counter()
+        self.submit(
+            f"preview {self.title}",
+            lambda: operation(*inputs, **scaled),
+            on_done=lambda result: self._show(result, where, scaled, time.perf_counter() - started),
+            on_error=self._failed
+        )
+
+    def _finish(self) -> bool:
+        self._busy = False
+        if not self.window.winfo_exists():
+            return False
+        if self._dirty:
+            self._dirty = False
+            self._start()
+        return True
+
+    def _show(self, result: np.ndarray, where: str, params: Dict[str, Any], seconds: float) -> None:
+        if not self.window.winfo_exists():
+            self._busy = False
+            return
+        image = self.buffer.update(result)
+        if self.view is None:
+            self.view = viewer.ImageViewer(self.frame, image)
+            self.view.bind()
+        else:
+            self.view.set_image(image)
+        shown = ", ".join(f"{name}={value:g}" for name, value in params.items())
+        self.info["text"] = f"{where}\n{shown}\n{seconds * 1000:.0f} ms"
+        self._finish()
+
+    def _failed(self, error: BaseException) -> None:
+        if self.window.winfo_exists():
+            self.info["text"] = f"{type(error).__name__}: {error}"
+        self._finish()
+
+    def apply(self) -> None:
+        '''
+        Closes the preview and runs the operation at full resolution.
+        '''
+        params = self.params()
+        self.window.destroy()
+        self.on_apply(params)
@@ -0,0 +1,225 @@
+'''
+Image model of RasterLab.
+
+A RasterImage holds one canonical array of an image, in OpenCV conventions
+and with the channels and depth stored in the file (cv.IMREAD_UNCHANGED).
+The file is decoded on first use, through the shared image cache. Everything
+else is derived from that array on demand and kept until dropped:
+
+    image = RasterImage("examples/lena.bmp")  # nothing is decoded yet
+    image.mode                                # decodes the file
+    image.gray                                # converted and kept
+    image.memory()                            # bytes held by the array and views
+
+Images built from results (`RasterImage.from_array`) have no path and keep
+their array. Memory-mapped arrays (see mapped.py) aren't counted, since their
+pages belong to the OS file cache.
+
+To free memory an image can be spilled: images with a file drop their array
+and its entry in the image cache, results are written to a .npy file first and
+memory-mapped from it when they're needed again.
+'''
+from typing import Optional
+import os
+import tempfile
+import numpy as np
+import cv2 as cv
+from PIL import Image, ImageTk
+import display
+import image_cache
+import mapped
+import tracing
+
+
+def array_memory(array: Optional[np.ndarray]) -> int:
+    '''
+    Returns the bytes an array holds in memory, 0 for memory-mapped ones.
+    '''
+    if array is None or isinstance(array, np.memmap):
+        return 0
+    return array.nbytes
+
+
+def image_memory(image: Optional[Image.Image]) -> int:
+    '''
+    Returns the bytes PIL holds for the pixels of an image.
+    '''
+    if image is None:
+        return 0
+    # PIL stores pixels of color images in 4 bytes
+    return image.width * image.height * (4 if len(image.getbands()) > 1 else 1)
+
+
+class RasterImage:
+    '''
+    Holds information about imported image.
+    '''
+    __slots__ = ("path", "_array", "_image", "_gray", "_float32", "_photo", "_spill_path")
+
+    def __init__(self, path: str = "", array: Optional[np.ndarray] = None,
+                 image: Optional[Image.Image] = None) -> None:
+        self.path = path
+        self._array = array
+        self._image = image
+        self._gray: Optional[np.ndarray] = None
+        self._float32: Optional[np.ndarray] = None
+        self._photo: Optional[ImageTk.PhotoImage] = None
+        # .npy file holding the array of a spilled result
+        self._spill_path: Optional[str] = None
+
+    @classmethod
+    def from_array(cls, array: np.ndarray, image: Optional[Image.Image] = None) -> "RasterImage":
+        '''
+        Wraps a result, image is its display image if it's already known.
+        '''
+        return cls("", array, image)
+
+    def __repr__(self) -> str:
+        state = "decoded" if self._array is not None else "spilled" if self._spill_path else "not decoded"
+        return f"RasterImage({self.path!r}, {state})"
+
+    @property
+    def loaded(self) -> bool:
+        return self._array is not None
+
+    @property
+    def array(self) -> np.ndarray:
+        '''
+        The canonical pixels, decoded (or mapped from the spill file) on first access.
+        '''
+        if self._array is None:
+            if self._spill_path is not None:
+                with tracing.span("reload", "memory", path=self._spill_path):
+                    self._array = mapped.open_npy(self._spill_path)
+            else:
+                self._array = image_cache.imread(self.path, cv.IMREAD_UNCHANGED)
+        return self._array
+
+    def set_array(self, array: np.ndarray, image: Optional[Image.Image] = None) -> None:
+        '''
+        Replaces the pixels of a result, dropping everything derived from the previous ones.
+        '''
+        self.discard()
+        self.drop_views()
+        self._array = array
+        self._image = image
+
+    @property
+    def image(self) -> Image.Image:
+        '''
+        The image for display, other than 8-bit pixels are normalized to their value range.
+        '''
+        if self._image is None:
+            self._image = display.to_image(self.array)
+        return self._image
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            array = self.array
+            self._gray = array if array.ndim == 2 else cv.cvtColor(
+                array, cv.COLOR_BGRA2GRAY if array.shape[2] == 4 else cv.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def float32(self) -> np.ndarray:
+        if self._float32 is None:
+            self._float32 = self.array.astype(np.float32)
+        return self._float32
+
+    @property
+    def photo(self) -> ImageTk.PhotoImage:
+        '''
+        PhotoImage of the whole image, for widgets showing it at once (large images go through viewer.py).
+        Needs a Tk root.
+        '''
+        if self._photo is None:
+            self._photo = ImageTk.PhotoImage(self.image)
+        return self._photo
+
+    def get_mode(self) -> str:
+        '''
+        Returns the color mode of the image.
+
+        "L" - greyscale
+
+        "RGB" | "RGBA" - color | color transparent
+        '''
+        return self.image.mode
+
+    mode = property(get_mode)
+
+    def memory(self) -> int:
+        '''
+        Returns the bytes held by the array and the derived views.
+        '''
+        total = array_memory(self._array) + self._image_memory()
+        if self._gray is not self._array:
+            total += array_memory(self._gray)
+        total += array_memory(self._float32)
+        if self._photo is not None:
+            # Tk keeps 4 bytes per pixel
+            total += self._photo.width() * self._photo.height() * 4
+        return total
+
+    def _image_memory(self) -> int:
+        image = self._image
+        if image is None or not image.readonly:
+            return image_memory(image)
+        # read-only images view an array, only the canonical one is counted already
+        buffer = display.image_buffer(image)
+        if buffer is None:
+            return image_memory(image)
+        if self._array is not None and np.shares_memory(buffer, self._array):
+            return 0
+        return array_memory(buffer)
+
+    def drop_views(self) -> None:
+        '''
+        Releases the derived views, they are created again when needed.
+        '''
+        self._image = None
+        self._gray = None
+        self._float32 = None
+        self._photo = None
+
+    def unload(self) -> None:
+        '''
+        Releases the array and the views of an image with a file, it's decoded again when needed.
+        '''
+        if self.path:
+            self._array = None
+        self.drop_views()
+
+    def spill(self, directory: str) -> None:
+        '''
+        Releases the array and the views, a result is written into the directory first.
+        '''
+        if not self.path and self._array is not None and self._spill_path is None:
+            with tracing.span("spill", "memory") as current:
+                current.input(self._array)
+                descriptor, path = tempfile.mkstemp(suffix=".npy", dir=directory)
+                with os.fdopen(descriptor, "wb") as file:
+                    np.save(file, self._array)
+                self._spill_path = path
+        if self.path:
+            # the decoded array is held by the shared cache as well
+            image_cache.shared.evict(self.path, cv.IMREAD_UNCHANGED)
+        if self.path or self._spill_path is not None:
+            self._array = None
+        self.drop_views()
+
+    def discard(self) -> None:
+        '''
+        Removes the spill file of an image which is closed (or gets new pixels).
+        '''
+        if self._spill_path is not None:
+            # the mapping has to be closed before its file can be removed on Windows
+            self._array = None
+            self.drop_views()
+            try:
+                os.remove(self._spill_path)
+            except OSError:
+                # still mapped somewhere, it's removed together with the spill directory
+                pass
+            self._spill_path = None
@@ -0,0 +1,565 @@
+'''
+Reference implementation of RasterLab.
+
+The operations of the original GUI (before the engine, see engine.py),
+transcribed without their windows: pixel loops over PIL images for the point
+operations and the OpenCV calls exactly as the menus made them. Results are
+returned in the form the engine returns them, so both can be compared.
+
+They are slow and only meant to check the engine: tests compare the two
+directly and `python benchmark.py --reference` checks the golden digests
+against them.
+
+Cases whose results were changed on purpose are listed in CHANGED, with the
+reason, and aren't expected to match.
+'''
+from typing import Any, Callable, Dict, List, Tuple
+import random
+import numpy as np
+import scipy.ndimage
+import cv2 as cv
+import imutils
+from PIL import Image
+
+
+def _image(array: np.ndarray) -> Image.Image:
+    return Image.fromarray(array)
+
+
+def _array(image: Image.Image) -> np.ndarray:
+    return np.asarray(image)
+
+
+def _getdata(image: Image.Image) -> List[Any]:
+    # getdata is deprecated since Pillow 12
+    if hasattr(image, 'get_flattened_data'):
+        return list(image.get_flattened_data())
+    return list(image.getdata())
+
+
+def negate(array: np.ndarray) -> np.ndarray:
+    new_image = _image(array)
+    if new_image.mode == 'L':
+        pixel_list: List[int] = _getdata(new_image)
+        negated_pixel_list: List[int] = []
+        # Convert pixel values to their opposites.
+        for pixel in pixel_list:
+            negated_pixel_list.append(abs(pixel - 255))
+    else:
+        pixel_rgb_list = _getdata(new_image)
+        negated_pixel_list = []
+        for pixel in pixel_rgb_list:
+            # Convert pixel values to their opposites.
+            new_pixel = (abs(pixel[0] - 255),
+                         abs(pixel[1] - 255), abs(pixel[2] - 255))
+            negated_pixel_list.append(new_pixel)
+    negated_image = Image.new(new_image.mode, new_image.size)
+    negated_image.putdata(negated_pixel_list)
+    return _array(negated_image)
+
+
+def threshold(array: np.ndarray, value: int, isSimple: bool) -> np.ndarray:
+    new_image = _image(array)
+    pixel_list = _getdata(new_image)
+    processed_pixel_list: List[int] = []
+    goal_table: List[int] = []
+    for i in range(value):
+        for j in range(int(255/value)):
+            goal_table.append(int(255/value * (i)))
+    for pixel in pixel_list:
+        if isSimple:
+            if pixel < (value):
+                processed_pixel_list.append(0)
+            else:
+                processed_pixel_list.append(255)
+        else:
+            processed_pixel_list.append(goal_table[pixel])
+    processed_image = Image.new(new_image.mode, new_image.size)
+    processed_image.putdata(processed_pixel_list)
+    return _array(processed_image)
+
+
+def posterize(array: np.ndarray, value: int) -> np.ndarray:
+    new_image = _image(array)
+    goal_table: List[int] = []
+    # Define bin values.
+    for i in range(value):
+        for j in range(int(256/value)):
+            goal_table.append(int(256/value * (i)))
+    pixel_rgb_list = _getdata(new_image)
+    negated_pixel_rgb_list: List[Tuple[int, int, int]] = []
+    for pixel in pixel_rgb_list:
+        new_pixel = (goal_table[pixel[0]],
+                     goal_table[pixel[1]],
+                     goal_table[pixel[2]]
+                     )
+        negated_pixel_rgb_list.append(new_pixel)
+    negated_image = Image.new(new_image.mode, new_image.size)
+    negated_image.putdata(negated_pixel_rgb_list)
+    return _array(negated_image)
+
+
+def generate_lut(pixel_list: List[int]):
+    lut = {}
+    for pixel in pixel_list:
+        if pixel in lut:
+            lut[pixel] += 1
+        else:
+            lut[pixel] = 0
+    for i in range(256):
+        if i not in lut:
+            lut[i] = 0
+    return lut
+
+
+def stretch(array: np.ndarray, p1=None, p2=None, q3=None, q4=None) -> np.ndarray:
+    new_image = _image(array)
+    pixel_list = _getdata(new_image)
+    processed_pixel_list: List[int] = []
+    lut_table = generate_lut(pixel_list)
+    end: int = 0
+    start: int = 0
+    if p1 and p2 and q3 and q4:
+        start = int(p1)
+        end = int(p2)
+        q3 = int(q3)
+        q4 = int(q4)
+    else:
+        q3 = 0
+        q4 = 255
+        for i in range(255):
+            if lut_table[i] != 0:
+                end = i
+        for i in range(255, 0, -1):
+            if lut_table[i] != 0:
+                start = i
+    for pixel in pixel_list:
+        if pixel < q3:
+            processed_pixel_list.append(q3)
+        elif pixel > q4:
+            processed_pixel_list.append(q4)
+        else:
+            processed_pixel_list.append(
+                int(((pixel - start) * q4) / (end - start))
+            )
+    processed_image = Image.new(new_image.mode, new_image.size)
+    processed_image.putdata(processed_pixel_list)
+    return _array(processed_image)
+
+
+def channel_histograms(array: np.ndarray) -> np.ndarray:
+    new_image = _image(array)
+    pixel_list = _getdata(new_image)
+    channels = len(new_image.getbands())
+    values: List[Dict[str, int]] = [{} for _ in range(channels)]
+    for pixel in pixel_list:
+        for channel, value in enumerate(pixel if channels > 1 else (pixel,)):
+            key = str(value)
+            if key in values[channel].keys():
+                values[channel][key] += 1
+            else:
+                values[channel][key] = 1
+    # the counts by level, as the engine returns them
+    counts = np.zeros((channels, 256), np.int64)
+    for channel, color_values in enumerate(values):
+        for key, count in color_values.items():
+            counts[channel, int(key)] = count
+    return counts
+
+
+def line_profile(array: np.ndarray, start: Tuple[int, int], end: Tuple[int, int]) -> np.ndarray:
+    x0, y0 = start
+    x1, y1 = end
+    x = np.linspace(
+        x0, x1, 100)
+    y = np.linspace(
+        y0, y1, 100)
+    return scipy.ndimage.map_coordinates(array, (y, x))
+
+
+def find_objects(img: np.ndarray) -> Dict[str, Any]:
+    ret, thresh = cv.threshold(img, 127, 255, 0)
+    # Save contour data.
+    contours, hierarchy = cv.findContours(
+        thresh, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
+    sorted_data = cv.moments(img)
+    cnt = contours[0]
+    x, y, w, h = cv.boundingRect(cnt)
+    area = cv.contourArea(cnt)
+    hull = cv.convexHull(cnt)
+    hull_area = cv.contourArea(hull)
+    # the values the window listed, under the names the engine uses
+    return {
+        "count": len(contours),
+        "area": cv.contourArea(cnt),
+        "perimeter": cv.arcLength(cnt, True),
+        "aspect_ratio": float(w)/h,
+        "extent": float(area)/(w*h),
+        "solidity": float(area)/hull_area,
+        "equivalent_diameter": np.sqrt(4*area/np.pi),
+        "moments": sorted_data,
+    }
+
+
+def draw_contours(img: np.ndarray) -> np.ndarray:
+    ret, thresh = cv.threshold(img, 127, 255, 0)
+    contours, hierarchy = cv.findContours(
+        thresh, cv.RETR_CCOMP, cv.CHAIN_APPROX_NONE)
+    img3 = cv.cvtColor(thresh, cv.COLOR_GRAY2RGB)
+    for cnt in contours:
+        cv.drawContours(img3, [cnt], 0, (random.randrange(
+            50, 200, 25), random.randrange(50, 200, 25), random.randrange(50, 200, 25)), 3)
+    return img3
+
+
+def filter_image(img: np.ndarray, filter_option: int, edge_option: int, a=0, b=0, c=0) -> np.ndarray:
+    match edge_option:
+        case 0:  # isolated
+            img = cv.copyMakeBorder(
+                img, 10, 10, 10, 10,
+                cv.BORDER_ISOLATED, None, value=0
+            )
+        case 1:  # reflect
+            img = cv.copyMakeBorder(
+                img, 10, 10, 10, 10,
+                cv.BORDER_REFLECT, None, value=0
+            )
+        case 2:  # replicate
+            img = cv.copyMakeBorder(
+                img, 10, 10, 10, 10,
+                cv.BORDER_REPLICATE, None, value=0
+            )
+    match filter_option:
+        case 0:
+            blur = cv.GaussianBlur(img, (5, 5), 0)
+        case 1:
+            blur = cv.blur(img, (5, 5))
+        case 2:
+            blur = cv.Sobel(img, cv.CV_64F, a, b, c)
+        case 3:
+            blur = cv.Laplacian(img, a)
+        case 4:
+            blur = cv.Canny(img, a, b)
+        case 5:
+            kernel = np.array([
+                [0, -1, 0],
+                [-1, 5, -1],
+                [0, -1, 0]
+            ])
+            blur = cv.filter2D(img, -1, kernel)
+        case 6:
+            kernel = np.array([
+                [-1, -1, -1],
+                [-1, 9, -1],
+                [-1, -1, -1]
+            ])
+            blur = cv.filter2D(img, -1, kernel)
+        case 7:
+            kernel = np.array([
+                [1, -2, 1],
+                [-2, 5, -2],
+                [1, -2, 1]
+            ])
+            blur = cv.filter2D(img, -1, kernel)
+        case 8:
+            match a:
+                case 0:
+                    kernel = np.array([
+                        [1, 1, 1],
+                        [1, -2, 1],
+                        [-1, -1, -1]
+                    ])
+                case 1:
+                    kernel = np.array([
+                        [1, 1, -1],
+                        [1, -2, -1],
+                        [1, 1, -1]
+                    ])
+                case 2:
+                    kernel = np.array([
+                        [-1, 1, 1],
+                        [-1, -2, 1],
+                        [-1, 1, 1]
+                    ])
+                case 3:
+                    kernel = np.array([
+                        [-1, -1, -1],
+                        [1, -2, 1],
+                        [1, 1, 1]
+                    ])
+                case 4:
+                    kernel = np.array([
+                        [1, 1, 1],
+                        [-1, -2, 1],
+                        [-1, -1, 1]
+                    ])
+                case 5:
+                    kernel = np.array([
+                        [1, 1, 1],
+                        [1, -2, -1],
+                        [1, -1, -1]
+                    ])
+                case 6:
+                    kernel = np.array([
+                        [1, -1, -1],
+                        [1, -2, -1],
+                        [1, 1, 1]
+                    ])
+                case 7:
+                    kernel = np.array([
+                        [-1, -1, 1],
+                        [-1, -2, 1],
+                        [1, 1, 1]
+                    ])
+            blur = cv.filter2D(img,  -1, kernel)
+        case 9:
+            kernel = a
+            blur = cv.filter2D(img,  -1, kernel)
+        case 10:
+            blur = cv.medianBlur(img, a)
+    return blur
+
+
+def two_point_operation(img1: np.ndarray, img2: np.ndarray, option: int,
+                        blend_a: float = 1, blend_b: float = 1) -> np.ndarray:
+    if blend_b:
+        blend_a = float(blend_a)
+        blend_b = float(blend_b)
+    # the menu passed the second image as the destination of bitwise_not
+    img2 = img2.copy()
+    match option:
+        case 0:  # add
+            result_image = cv.add(img1, img2)
+        case 1:  # subtract
+            result_image = cv.subtract(img1, img2)
+        case 2:  # blend
+            result_image = cv.addWeighted(img1, blend_a, img2, blend_b, 0)
+        case 3:  # and
+            result_image = cv.bitwise_and(img1, img2)
+        case 4:  # or
+            result_image = cv.bitwise_or(img1, img2)
+        case 5:  # not
+            result_image = cv.bitwise_not(img1, img2)
+        case 6:  # xor
+            result_image = cv.bitwise_xor(img1, img2)
+    return result_image
+
+
+def morph_image(img: np.ndarray, o1, o2, o3, o4) -> np.ndarray:
+    o1, o2, o3, o4 = int(o1), int(o2), int(o3), int(o4)
+    # edge mode
+    match o3:
+        case 1:  # constant
+            edge_mode = cv.BORDER_CONSTANT
+        case 2:  # replicate
+            edge_mode = cv.BORDER_REPLICATE
+        case 3:  # reflect
+            edge_mode = cv.BORDER_REFLECT
+        case 4:  # reflect101
+            edge_mode = cv.BORDER_REFLECT101
+        case 5:  # wrap
+            edge_mode = cv.BORDER_WRAP
+    # generate kernel
+    match o2:
+        case 1:  # rombus
+            r = o4
+            kernel = np.uint8(np.add.outer(*[np.r_[:r, r: -1: -1]]*2) >= r)
+        case 2:  # square
+            kernel = cv.getStructuringElement(cv.MORPH_RECT, (o4, o4))
+    # morph option
+    match o1:
+        case 1:  # Erode
+            result = cv.erode(img, kernel, iterations=2, borderType=edge_mode)
+        case 2:  # Dilate
+            result = cv.dilate(img, kernel, iterations=2, borderType=edge_mode)
+        case 3:  # Open
+            result = cv.morphologyEx(img, cv.MORPH_OPEN, kernel, iterations=2, borderType=edge_mode)
+        case 4:  # Close
+            result = cv.morphologyEx(img, cv.MORPH_CLOSE, kernel, iterations=2, borderType=edge_mode)
+    return result
+
+
+def mask_filter_image(img: np.ndarray, o1, o2, o3) -> np.ndarray:
+    o1, o2, o3 = int(o1), int(o2), int(o3)
+    match o3:
+        case 1:  # constant
+            edge_mode = cv.BORDER_CONSTANT
+        case 2:  # replicate
+            edge_mode = cv.BORDER_REPLICATE
+        case 3:  # reflect
+            edge_mode = cv.BORDER_REFLECT
+        case 4:  # reflect101
+            edge_mode = cv.BORDER_REFLECT101
+        case 5:  # wrap
+            edge_mode = cv.BORDER_WRAP
+    smoothen_mask = np.ones((3, 3))
+    sharpen_mask = np.array([
+        [1, -2, 1],
+        [-2, 4, -2],
+        [1, -2, 1]
+    ])
+    match o2:
+        case 1:
+            chosen_mask = sharpen_mask
+        case 2:
+            chosen_mask = smoothen_mask
+    match o1:  # stages
+        case 1:  # one stage
+            result = cv.filter2D(img, cv.CV_64F, chosen_mask, borderType=edge_mode)
+        case 2:  # two stage
+            result = cv.filter2D(img, cv.CV_64F, smoothen_mask, borderType=edge_mode)
+            result = cv.filter2D(result, cv.CV_64F, sharpen_mask, borderType=edge_mode)
+    return result
+
+
+def skeletonize(img: np.ndarray) -> np.ndarray:
+    img = img.copy()  # don't clobber original
+    skel = img.copy()
+    skel[:, :] = 0
+    kernel = cv.getStructuringElement(cv.MORPH_CROSS, (3, 3))
+    while True:
+        eroded = cv.morphologyEx(img, cv.MORPH_ERODE, kernel)
+        temp = cv.morphologyEx(eroded, cv.MORPH_DILATE, kernel)
+        temp = cv.subtract(img, temp)
+        skel = cv.bitwise_or(skel, temp)
+        img[:, :] = eroded[:, :]
+        if cv.countNonZero(img) == 0:
+            break
+    return skel
+
+
+def segment(img: np.ndarray, o1: int, o2: int = 0) -> np.ndarray:
+    '''
+    img is greyscale for modes 1-3 and BGR for watershed (4), as the menu read the file.
+    '''
+    match o1:
+        case 1:
+            ret, result = cv.threshold(img, o2, 255, cv.THRESH_BINARY)
+        case 2:
+            result = cv.adaptiveThreshold(img, 255, cv.ADAPTIVE_THRESH_MEAN_C,
+                                          cv.THRESH_BINARY, 11, 2)
+        case 3:
+            blur = cv.GaussianBlur(img, (5, 5), 0)
+            ret3, result = cv.threshold(
+                blur, 0, 255, cv.THRESH_BINARY+cv.THRESH_OTSU)
+        case 4:
+            img = img.copy()
+            # Convert to greyscale.
+            img_gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+            ret2, thresh = cv.threshold(
+                img_gray, 0, 255, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
+            kernel = np.ones((3, 3), np.uint8)
+            # Reduce the noise pollution.
+            opening = cv.morphologyEx(
+                thresh, cv.MORPH_OPEN, kernel, iterations=1)
+            sure_bg = cv.dilate(opening, kernel, iterations=1)
+            dist_transform = cv.distanceTransform(opening, cv.DIST_L2, 5)
+            # Find clean objects by distance transforming.
+            ret, sure_fg = cv.threshold(
+                dist_transform, 0.5*dist_transform.max(), 255, 0)
+            sure_fg = np.uint8(sure_fg)
+            # Find uncertain objects.
+            unknown = cv.subtract(sure_bg, sure_fg)
+            # Mark found objects.
+            ret, markers = cv.connectedComponents(sure_fg)
+            markers = markers+1
+            markers[unknown == 255] = 0
+            markers2 = cv.watershed(img, markers)
+            result = cv.applyColorMap(np.uint8(markers2*10), cv.COLORMAP_JET)
+    return result
+
+
+def stitch(images: List[np.ndarray], raw: bool) -> np.ndarray:
+    stitcher = cv.Stitcher_create()
+    error, stitched_img = stitcher.stitch(images)
+    if error:
+        raise RuntimeError(f"Stitching failed with status {error}.")
+    if not raw:
+        # add black padding to the image
+        stitched_img = cv.copyMakeBorder(
+            stitched_img, 10, 10, 10, 10,
+            cv.BORDER_CONSTANT, (0, 0, 0)
+        )
+        gray = cv.cvtColor(stitched_img, cv.COLOR_BGR2GRAY)
+        # isolate contours as black pixels
+        thresh_img = cv.threshold(gray, 0, 255, cv.THRESH_BINARY)[1]
+        contours = cv.findContours(
+            thresh_img.copy(), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+        contours = imutils.grab_contours(contours)
+        # from found contours locate area of interest
+        areaOI = max(contours, key=cv.contourArea)
+        mask = np.zeros(thresh_img.shape, dtype="uint8")
+        # create area to be cut from the original image
+        x, y, w, h = cv.boundingRect(areaOI)
+        cv.rectangle(mask, (x, y), (x + w, y + h), 255, -1)
+        minRectangle = mask.copy()
+        sub = mask.copy()
+        # find the minimum area with the image
+        while cv.countNonZero(sub) > 0:
+            minRectangle = cv.erode(minRectangle, None)
+            sub = cv.subtract(minRectangle, thresh_img)
+        contours = cv.findContours(
+            minRectangle.copy(), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+        contours = imutils.grab_contours(contours)
+        areaOI = max(contours, key=cv.contourArea)
+        x, y, w, h = cv.boundingRect(areaOI)
+        # from the original stitched image "cut" only the rectangle
+        stitched_img = stitched_img[y:y + h, x:x + w]
+    return stitched_img
+
+
+CUSTOM_KERNEL = [[0, -1, 0], [-1, 5, -1], [0, -1, 0]]
+
+# benchmark case name (see benchmark.CASES) -> (input kind, reference operation)
+CASES: Dict[str, Tuple[str, Callable[[Any], Any]]] = {
+    "negate": ("color", negate),
+    "threshold": ("gray", lambda image: threshold(image, 127, True)),
+    "threshold multilevel": ("gray", lambda image: threshold(image, 4, False)),
+    "posterize": ("color", lambda image: posterize(image, 4)),
+    "stretch": ("gray", stretch),
+    "stretch range": ("gray", lambda image: stretch(image, "50", "200", "0", "255")),
+    "histogram": ("color", channel_histograms),
+    "line profile": ("gray", lambda image: line_profile(
+        image, (0, 0), (image.shape[1] - 1, image.shape[0] - 1))),
+    "find objects": ("gray", find_objects),
+    "draw contours": ("gray", draw_contours),
+    "filter gaussian": ("color", lambda image: filter_image(image, 0, 1)),
+    "filter blur": ("color", lambda image: filter_image(image, 1, 1)),
+    "filter sobel": ("color", lambda image: filter_image(image, 2, 1, 1, 0, 3)),
+    "filter laplacian": ("color", lambda image: filter_image(image, 3, 1, cv.CV_64F)),
+    "filter canny": ("color", lambda image: filter_image(image, 4, 1, 100, 200)),
+    "filter sharpen a": ("color", lambda image: filter_image(image, 5, 1)),
+    "filter sharpen b": ("color", lambda image: filter_image(image, 6, 1)),
+    "filter sharpen c": ("color", lambda image: filter_image(image, 7, 1)),
+    "filter prewitt": ("color", lambda image: filter_image(image, 8, 1, 0)),
+    "filter custom": ("color", lambda image: filter_image(image, 9, 1, np.asarray(CUSTOM_KERNEL))),
+    "filter median": ("color", lambda image: filter_image(image, 10, 1, 5)),
+    "morph erode": ("color", lambda image: morph_image(image, 1, 2, 2, 3)),
+    "morph dilate": ("color", lambda image: morph_image(image, 2, 2, 2, 3)),
+    "morph open": ("color", lambda image: morph_image(image, 3, 1, 2, 3)),
+    "morph close": ("color", lambda image: morph_image(image, 4, 1, 2, 3)),
+    "mask filter": ("color", lambda image: mask_filter_image(image, 1, 1, 2)),
+    "mask filter two stage": ("color", lambda image: mask_filter_image(image, 2, 1, 2)),
+    "skeletonize": ("binary", skeletonize),
+    "segment normal": ("gray", lambda image: segment(image, 1, 127)),
+    "segment adaptive": ("gray", lambda image: segment(image, 2)),
+    "segment otsu": ("gray", lambda image: segment(image, 3)),
+    "segment watershed": ("color", lambda image: segment(image, 4)),
+    "two point add": ("pair", lambda pair: two_point_operation(*pair, 0)),
+    "two point subtract": ("pair", lambda pair: two_point_operation(*pair, 1)),
+    "two point blend": ("pair", lambda pair: two_point_operation(*pair, 2, 0.5, 0.5)),
+    "two point and": ("pair", lambda pair: two_point_operation(*pair, 3)),
+    "two point or": ("pair", lambda pair: two_point_operation(*pair, 4)),
+    "two point not": ("pair", lambda pair: two_point_operation(*pair, 5)),
+    "two point xor": ("pair", lambda pair: two_point_operation(*pair, 6)),
+    "stitch": ("stitch", lambda images: stitch(images, True)),
+    "stitch cropped": ("stitch", lambda images: stitch(images, False)),
+}
+
+# case name -> why the engine doesn't give the same result
+CHANGED: Dict[str, str] = {
+    "stretch": "the automatic range is the minimum and maximum of the image, "
+               "the original skipped levels present only once and the ends of the scale",
+    "threshold multilevel": "levels past the last full bin map to it, the original raised IndexError",
+    "find objects": "solidity of an object without area is 0, the original divided by zero",
+}
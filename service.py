@@ -0,0 +1,433 @@
+'''
+Local processing service of RasterLab.
+
+Serves the engine operations over HTTP on the loopback interface, so that
+other tools can use them without the Tk interface:
+
+    python service.py --port 8765 --workers 4
+
+    # the image is the request body, the result comes back encoded
+    curl --data-binary @examples/lena.bmp -o median.png \\
+        "http://127.0.0.1:8765/process?op=filter+filter_option=10+edge_option=1+a=5"
+    # a file on this machine, operations applied in order
+    curl -X POST -o edges.png \\
+        "http://127.0.0.1:8765/process?path=examples/lena.bmp&mode=gray&op=segment+mode=3&op=skeletonize"
+    curl http://127.0.0.1:8765/stats
+
+Operations are given like in stream.py, as their name followed by key=value
+parameters of the engine function; `mode` (color, gray or unchanged) picks how
+the input is decoded and `format` the extension of the result.
+
+Requests are processed by a pool of worker processes which is warmed up
+before the service starts listening. Once every worker is busy, requests
+arriving close together are sent to the pool in batches, which saves a round
+trip per image. Images travel to the workers and back in shared memory (see
+shared.py) instead of being pickled. Decoded inputs are cached (uploads by
+their digest, files by path), so repeated inputs aren't decoded again. At most
+--max-pending requests are processed at once, further ones are refused with
+503 instead of piling up. /stats reports the latency, throughput, batching,
+cache and transport counters.
+'''
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import numpy as np
+import cv2 as cv
+import export
+import image_cache
+import pipeline
+import shared
+import stream
+import tracing
+
+
+DEFAULT_PORT = 8765
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+DEFAULT_BATCH_SIZE = 4
+# how long the first request of a batch waits for others
+DEFAULT_BATCH_WAIT = 0.005
+DEFAULT_MAX_PENDING = 32
+MAX_BODY_BYTES = 256 * 1024 * 1024
+# latencies kept for the percentiles
+LATENCY_WINDOW = 1000
+
+DECODE_MODES = {
+    "color": cv.IMREAD_COLOR,
+    "gray": cv.IMREAD_GRAYSCALE,
+    "unchanged": cv.IMREAD_UNCHANGED,
+}
+
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+    ".bmp": "image/bmp",
+}
+
+# input and output blocks of a request with its operations
+Item = Tuple[shared.Descriptor, shared.Descriptor, List[stream.Operation]]
+
+
+def init_worker() -> None:
+    '''
+    Workers already run in parallel, keep OpenCV from spawning its own threads in each one.
+    '''
+    cv.setNumThreads(1)
+
+
+def warm() -> int:
+    '''
+    Runs a small operation so that OpenCV is initialized before the first request.
+    Returns the process id of the worker.
+    '''
+    stream.Chain([("filter", {"filter_option": 10, "edge_option": 1, "a": 3})])(np.zeros((16, 16), np.uint8))
+    return os.getpid()
+
+
+def process_batch(items: List[Item]) -> List[Tuple[Union[shared.Descriptor, np.ndarray, None], Optional[str]]]:
+    '''
+    Applies the operations of every item in a worker.
+    Returns the result (see shared.run) or an error message of each item.
+    '''
+    results: List[Tuple[Union[shared.Descriptor, np.ndarray, None], Optional[str]]] = []
+    for source, target, operations in items:
+        try:
+            results.append((shared.run(source, target, operations), None))
+        except Exception as error:
+            results.append((None, f"{type(error).__name__}: {error}"))
+    return results
+
+
+class Stats:
+    '''
+    Request counters and latencies of the service.
+    '''
+
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batched = 0
+        self.latencies: deque = deque(maxlen=window)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += not ok
+            self.latencies.append(seconds)
+
+    def reject(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def batch(self, size: int) -> None:
+        with self._lock:
+            self.batches += 1
+            self.batched += size
+
+    def summary(self) -> Dict[str, Any]:
+        '''
+        Returns the counters with latency percentiles (in milliseconds) of the recent requests.
+        '''
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            uptime = time.perf_counter() - self.started
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "uptime_seconds": uptime,
+                "requests_per_second": self.requests / uptime if uptime else 0.0,
+                "latency_ms": {
+                    "mean": float(latencies.mean()) if latencies.size else 0.0,
+                    "p50": float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+                    "p95": float(np.percentile(latencies, 95)) if latencies.size else 0.0,
+                    "max": float(latencies.max()) if latencies.size else 0.0,
+                },
+                "batches": self.batches,
+                "mean_batch_size": self.batched / self.batches if self.batches else 0.0,
+            }
+
+
+class Service:
+    '''
+    Worker pool fed with batches of requests.
+    '''
+
+    def __init__(self, workers: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 batch_wait: float = DEFAULT_BATCH_WAIT, max_pending: int = DEFAULT_MAX_PENDING,
+                 cache: Optional[image_cache.ImageCache] = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_pending = max_pending
+        self.cache = cache if cache is not None else image_cache.shared
+        self.stats = Stats()
+        # before the pool, see shared.SharedArrays
+        self.arrays = shared.SharedArrays()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._jobs: queue.Queue = queue.Queue()
+        self._closed = threading.Event()
+        # batches sent to the pool and not finished yet
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._batcher = threading.Thread(target=self._batch_loop, name="service-batcher", daemon=True)
+
+    def start(self) -> List[int]:
+        '''
+        Starts the worker processes and the batcher.
+        Returns the process ids of the warmed up workers.
+        '''
+        with tracing.span("warm up", "service", workers=self.workers):
+            # submitted together, so that every worker process gets started
+            futures = [self.pool.submit(warm) for _ in range(self.workers)]
+            pids = sorted({future.result() for future in futures})
+        self._batcher.start()
+        return pids
+
+    def acquire(self) -> bool:
+        '''
+        Takes a slot for a request, False if the service is at its limit.
+        '''
+        if self._slots.acquire(blocking=False):
+            return True
+        self.stats.reject()
+        return False
+
+    def release(self) -> None:
+        self._slots.release()
+
+    def submit(self, source: shared.Descriptor, target: shared.Descriptor,
+               operations: List[stream.Operation]) -> Future:
+        '''
+        Queues an image in a shared block for processing, the future gets the result (see shared.run).
+        '''
+        future: Future = Future()
+        self._jobs.put((source, target, operations, future))
+        return future
+
+    def _batch_loop(self) -> None:
+        while not self._closed.is_set():
+            try:
+                jobs = [self._jobs.get(timeout=stream.POLL_SECONDS)]
+            except queue.Empty:
+                continue
+            # while a worker is idle a job goes out alone right away, batching would only delay it
+            if self._in_flight >= self.workers:
+                deadline = time.perf_counter() + self.batch_wait
+                while len(jobs) < self.batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        jobs.append(self._jobs.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+            self.stats.batch(len(jobs))
+            try:
+                batch = self.pool.submit(process_batch, [job[:3] for job in jobs])
+            except RuntimeError as error:
+                # the pool was shut down
+                for *_, future in jobs:
+                    future.set_exception(error)
+                continue
+            with self._lock:
+                self._in_flight += 1
+            batch.add_done_callback(lambda done, jobs=jobs: self._deliver(done, jobs))
+
+    def _deliver(self, batch: Future, jobs: List[Tuple[shared.Descriptor, shared.Descriptor,
+                                                       List[stream.Operation], Future]]) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        error = batch.exception()
+        for index, (*_, future) in enumerate(jobs):
+            if error is not None:
+                future.set_exception(error)
+                continue
+            result, message = batch.result()[index]
+            if message is None:
+                future.set_result(result)
+            else:
+                future.set_exception(ValueError(message))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            **self.stats.summary(),
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "cache": self.cache.stats(),
+            "transport": self.arrays.stats(),
+        }
+
+    def close(self) -> None:
+        self._closed.set()
+        self.pool.shutdown(cancel_futures=True)
+        self.arrays.close()
+
+
+def parse_request(query: Dict[str, List[str]]) -> Tuple[List[stream.Operation], int, str]:
+    '''
+    Returns the operations, the decode flags and the result extension of a request.
+    '''
+    operations = [stream.parse_operation(value.split()) for value in query.get("op", [])]
+    if not operations:
+        raise ValueError(f"No operation given, use op=NAME key=value ... with one of: {', '.join(pipeline.OPERATIONS)}")
+    mode = query.get("mode", ["color"])[0]
+    if mode not in DECODE_MODES:
+        raise ValueError(f"Unknown mode: {mode}")
+    extension = "." + query.get("format", ["png"])[0].lstrip(".").lower()
+    if extension not in CONTENT_TYPES:
+        raise ValueError(f"Unknown format: {extension}")
+    return operations, DECODE_MODES[mode], extension
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    HTTP front of the service: POST /process, GET /stats and GET /operations.
+    '''
+    server: "Server"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_body(self, status: int, body: bytes, content_type: str, **headers) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name.replace("_", "-"), str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status: int, value: Any, **headers) -> None:
+        self.send_body(status, json.dumps(value, indent=1).encode(), "application/json", **headers)
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path
+        if path == "/stats":
+            self.send_json(200, self.server.service.summary())
+        elif path == "/operations":
+            self.send_json(200, sorted(pipeline.OPERATIONS))
+        else:
+            self.send_json(404, {"error": f"Not found: {path}"})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        # the body is read even when the request fails, the connection is kept alive
+        data = self.rfile.read(length) if length <= MAX_BODY_BYTES else None
+        if url.path != "/process":
+            self.send_json(404, {"error": f"Not found: {url.path}"})
+            return
+        if data is None:
+            self.close_connection = True
+            self.send_json(413, {"error": f"Body over {MAX_BODY_BYTES} bytes"})
+            return
+        service = self.server.service
+        if not service.acquire():
+            self.send_json(503, {"error": "Too many requests"}, Retry_After=1)
+            return
+        start = time.perf_counter()
+        ok = False
+        try:
+            with tracing.span("request", "service", path=self.path):
+                query = parse_qs(url.query)
+                operations, flags, extension = parse_request(query)
+                if "path" in query:
+                    image = service.cache.read(query["path"][0], flags)
+                elif data:
+                    image = service.cache.decode(data, flags)
+                else:
+                    raise ValueError("No image given, send it as the body or give a path")
+                with service.arrays.put(image) as source, service.arrays.empty(image.shape, image.dtype) as target:
+                    result = service.submit(source.descriptor, target.descriptor, operations).result()
+                    body = export.encode(target.view(result), extension).tobytes()
+            ok = True
+            self.send_body(200, body, CONTENT_TYPES[extension],
+                           X_Seconds=f"{time.perf_counter() - start:.6f}")
+        except (ValueError, TypeError, FileNotFoundError) as error:
+            self.send_json(400, {"error": str(error)})
+        except Exception as error:
+            self.send_json(500, {"error": f"{type(error).__name__}: {error}"})
+        finally:
+            service.release()
+            service.stats.record(time.perf_counter() - start, ok)
+
+
+class Server(ThreadingHTTPServer):
+    '''
+    Threaded HTTP server bound to a loopback address.
+    '''
+    daemon_threads = True
+
+    def __init__(self, service: Service, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+                 verbose: bool = False) -> None:
+        if host not in LOOPBACK_HOSTS:
+            raise ValueError(f"The service only listens on the loopback interface, not {host}")
+        if host == "::1":
+            self.address_family = socket.AF_INET6
+        self.service = service
+        self.verbose = verbose
+        super().__init__((host, port), Handler)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="service.py", description="Serve RasterLab operations over HTTP on localhost.")
+    parser.add_argument("--host", default="127.0.0.1", choices=LOOPBACK_HOSTS,
+                        help="loopback address to listen on (default: 127.0.0.1)")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT,
+                        help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"requests sent to a worker together at most (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--batch-wait", type=float, default=DEFAULT_BATCH_WAIT * 1000,
+                        help="milliseconds a request waits for others to batch with (default: 5)")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                        help=f"requests processed at once, more are refused (default: {DEFAULT_MAX_PENDING})")
+    parser.add_argument("--cache-mb", type=int, default=None,
+                        help="memory budget of the decoded input cache in MB")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.cache_mb is not None:
+        image_cache.shared.set_budget(args.cache_mb * 1024 * 1024)
+    service = Service(args.workers, args.batch_size, args.batch_wait / 1000, args.max_pending)
+    pids = service.start()
+    server = Server(service, args.host, args.port, args.verbose)
+    print(f"Serving on http://{args.host}:{args.port} with {len(pids)} warm workers", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+'''
+Memory budget of the images opened in RasterLab.
+
+Every image window (imported images and results) is registered in the
+session together with its viewer. When the memory they hold goes over the
+budget, the least recently focused images are spilled: their arrays and
+derived views are released (results are written to .npy files in a temporary
+directory first) and their viewers drop the zoom pyramid. A spilled image
+keeps showing its drawn tiles and is reloaded when it's focused again.
+
+    images = Session(budget_bytes=512 * 2 ** 20)
+    images.add(raster_image, view)
+    images.touch(raster_image)  # on focus, reloads it if it was spilled
+    images.remove(raster_image)  # on close
+
+Spill files are uncompressed so that they can be memory-mapped back instead
+of being read and decompressed.
+'''
+from __future__ import annotations
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+import shutil
+import tempfile
+import threading
+import tracing
+
+if TYPE_CHECKING:
+    # only for annotations, so that the session can be created before numpy is imported
+    from raster import RasterImage
+
+
+DEFAULT_BUDGET_BYTES = 1024 * 1024 * 1024
+# most recently focused images which are never spilled, two point operations use the last two
+KEEP_RECENT = 2
+
+
+class Session:
+    '''
+    Opened images in least recently focused order, kept under a memory budget.
+    '''
+
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_BYTES, spill_dir: Optional[str] = None,
+                 keep_recent: int = KEEP_RECENT) -> None:
+        self.budget_bytes = budget_bytes
+        self.keep_recent = keep_recent
+        self.spills = 0
+        self.reloads = 0
+        # id of the image -> (image, viewer), least recently focused first
+        self._entries: OrderedDict[int, Tuple[RasterImage, Any]] = OrderedDict()
+        self._spilled: Set[int] = set()
+        self._spill_dir = spill_dir
+        self._own_dir = spill_dir is None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def spill_dir(self) -> str:
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="rasterlab-")
+        return self._spill_dir
+
+    def images(self) -> List[RasterImage]:
+        '''
+        Returns the images, least recently focused first.
+        '''
+        with self._lock:
+            return [image for image, view in self._entries.values()]
+
+    def add(self, image: RasterImage, view=None) -> None:
+        '''
+        Registers an image and the viewer showing it (anything with release() and memory()).
+        '''
+        with self._lock:
+            self._entries[id(image)] = (image, view)
+            self.enforce()
+
+    def remove(self, image: RasterImage) -> None:
+        '''
+        Forgets a closed image, removing its spill file.
+        '''
+        with self._lock:
+            if self._entries.pop(id(image), None) is not None:
+                self._spilled.discard(id(image))
+                image.discard()
+
+    def touch(self, image: RasterImage) -> None:
+        '''
+        Marks an image as the most recently focused one, a spilled image gets reloaded by its next use.
+        '''
+        with self._lock:
+            if id(image) not in self._entries:
+                return
+            self._entries.move_to_end(id(image))
+            if id(image) in self._spilled:
+                self._spilled.discard(id(image))
+                self.reloads += 1
+                tracing.instant("reload", "memory", path=image.path)
+            self.enforce()
+
+    @staticmethod
+    def _memory(image: RasterImage, view) -> int:
+        # the viewer's pyramid starts with the display image, which the image counts already
+        return image.memory() + (view.memory(base=False) if view is not None else 0)
+
+    def memory(self) -> int:
+        '''
+        Returns the bytes held by the images and their viewers.
+        '''
+        with self._lock:
+            return sum(self._memory(image, view) for image, view in self._entries.values())
+
+    def enforce(self) -> None:
+        '''
+        Spills the least recently focused images until the session fits in the budget.
+        '''
+        with self._lock:
+            usage = self.memory()
+            candidates = list(self._entries.items())[:max(len(self._entries) - self.keep_recent, 0)]
+            for key, (image, view) in candidates:
+                if usage <= self.budget_bytes:
+                    break
+                if key in self._spilled:
+                    continue
+                before = self._memory(image, view)
+                image.spill(self.spill_dir)
+                if view is not None:
+                    view.release()
+                self._spilled.add(key)
+                self.spills += 1
+                usage -= before - self._memory(image, view)
+
+    def set_budget(self, budget_bytes: int) -> None:
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self.enforce()
+
+    def stats(self) -> Dict[str, Any]:
+        '''
+        Returns usage counters of the session.
+        '''
+        with self._lock:
+            return {
+                "images": len(self._entries),
+                "spilled": len(self._spilled),
+                "size_bytes": self.memory(),
+                "budget_bytes": self.budget_bytes,
+                "spills": self.spills,
+                "reloads": self.reloads,
+            }
+
+    def close(self) -> None:
+        '''
+        Forgets every image and removes the spill directory.
+        '''
+        with self._lock:
+            for image, view in self._entries.values():
+                image.discard()
+            self._entries.clear()
+            self._spilled.clear()
+            if self._own_dir and self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
@@ -0,0 +1,232 @@
+'''
+Shared-memory image transport of RasterLab.
+
+Arrays sent to worker processes are normally pickled: copied into bytes,
+written through a pipe, read and copied again on the other side, and the
+result goes the same way back. With a `SharedArrays` arena the input is copied
+once into a shared memory block which the worker reads in place, and the
+worker writes its result straight into another block; only a descriptor (the
+block name, shape and type) crosses the process boundary:
+
+    arrays = SharedArrays()
+    pool = ProcessPoolExecutor()  # after the arena, see SharedArrays
+    with arrays.put(image) as source, arrays.empty(image.shape, image.dtype) as target:
+        result = pool.submit(shared.run, source.descriptor, target.descriptor, [("negate", {})]).result()
+        view = target.view(result)  # valid until the block is released
+
+A result fits its block if it's not larger than the block, it may differ in
+shape and type (e.g. a greyscale result of a color image); a larger one comes
+back pickled. Released blocks are kept for reuse up to a byte budget, since
+creating a block and faulting its pages in costs more than the copy itself.
+Blocks are unlinked when the arena is closed or collected, or at exit at the
+latest. Workers keep their blocks mapped (up to a byte budget) between tasks.
+'''
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import Dict, List, NamedTuple, Tuple, Union
+import os
+import threading
+import weakref
+import numpy as np
+import stream
+import tracing
+
+
+# bytes of released blocks kept for reuse
+DEFAULT_FREE_BYTES = 512 * 1024 * 1024
+# bytes of blocks a worker keeps mapped between tasks
+MAX_ATTACHED_BYTES = 512 * 1024 * 1024
+# a free block is reused for arrays down to this fraction of its size
+MIN_FILL = 0.5
+
+
+class Descriptor(NamedTuple):
+    '''
+    Array in a shared memory block, what crosses the process boundary instead of the array.
+    '''
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def as_array(block: shared_memory.SharedMemory, descriptor: Descriptor) -> np.ndarray:
+    return np.ndarray(descriptor.shape, np.dtype(descriptor.dtype), buffer=block.buf)
+
+
+def free(block: shared_memory.SharedMemory) -> None:
+    '''
+    Unlinks a block, its memory goes away once arrays still viewing it are gone.
+    '''
+    block.unlink()
+    try:
+        block.close()
+    except BufferError:
+        pass
+
+
+def _unlink(blocks: Dict[str, shared_memory.SharedMemory]) -> None:
+    for block in blocks.values():
+        free(block)
+    blocks.clear()
+
+
+class Block:
+    '''
+    Shared memory block of an arena holding an array, released back to the arena when done.
+    '''
+
+    def __init__(self, arena: "SharedArrays", memory: shared_memory.SharedMemory, descriptor: Descriptor) -> None:
+        self.arena = arena
+        self.memory = memory
+        self.descriptor = descriptor
+        self.array = as_array(memory, descriptor)
+
+    def __enter__(self) -> "Block":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def view(self, result: Union[Descriptor, np.ndarray]) -> np.ndarray:
+        '''
+        Returns the result of a worker, an array in this block if it fit, else the pickled array.
+        '''
+        if isinstance(result, Descriptor):
+            return as_array(self.memory, result)
+        return result
+
+    def release(self) -> None:
+        # views handed out must not outlive the block, it's reused for other arrays
+        self.array = None
+        self.arena.release(self)
+
+
+class SharedArrays:
+    '''
+    Arena of shared memory blocks for arrays sent to worker processes.
+
+    Create it before the process pool: its processes then share the resource tracker
+    of this process, which otherwise would unlink blocks still in use when a worker exits.
+    '''
+
+    def __init__(self, free_bytes: int = DEFAULT_FREE_BYTES) -> None:
+        self.free_bytes = free_bytes
+        self.created = 0
+        self.reused = 0
+        # every block of the arena by name, the free ones in the order they were released
+        self._blocks: Dict[str, shared_memory.SharedMemory] = {}
+        self._free: OrderedDict[str, shared_memory.SharedMemory] = OrderedDict()
+        self._lock = threading.Lock()
+        if os.name == "posix":
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        self._finalizer = weakref.finalize(self, _unlink, self._blocks)
+
+    def _take(self, size: int) -> shared_memory.SharedMemory:
+        with self._lock:
+            fitting = [block for block in self._free.values() if MIN_FILL * block.size <= size <= block.size]
+            if fitting:
+                block = min(fitting, key=lambda candidate: candidate.size)
+                del self._free[block.name]
+                self.reused += 1
+                return block
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        with self._lock:
+            self._blocks[block.name] = block
+            self.created += 1
+        return block
+
+    def empty(self, shape: Tuple[int, ...], dtype) -> Block:
+        '''
+        Returns a block for an array of the given shape and type, its contents are undefined.
+        '''
+        dtype = np.dtype(dtype)
+        descriptor = Descriptor("", tuple(shape), dtype.str)
+        block = self._take(int(np.prod(shape)) * dtype.itemsize)
+        return Block(self, block, descriptor._replace(name=block.name))
+
+    def put(self, array: np.ndarray) -> Block:
+        '''
+        Returns a block holding a copy of the array.
+        '''
+        block = self.empty(array.shape, array.dtype)
+        with tracing.span("shared put", "transport") as current:
+            current.input(array)
+            block.array[...] = array
+        return block
+
+    def release(self, block: Block) -> None:
+        '''
+        Keeps a block for reuse, unlinking the oldest free blocks over the budget.
+        '''
+        with self._lock:
+            if block.memory.name not in self._blocks:
+                return
+            self._free[block.memory.name] = block.memory
+            while self._free and sum(memory.size for memory in self._free.values()) > self.free_bytes:
+                name, memory = self._free.popitem(last=False)
+                del self._blocks[name]
+                free(memory)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "blocks": len(self._blocks),
+                "free": len(self._free),
+                "size_bytes": sum(memory.size for memory in self._blocks.values()),
+                "created": self.created,
+                "reused": self.reused,
+            }
+
+    def close(self) -> None:
+        '''
+        Unlinks every block, the arrays of blocks in use become invalid.
+        '''
+        with self._lock:
+            self._free.clear()
+            self._finalizer()
+
+
+# blocks mapped in a worker process by name, least recently used first
+_attached: OrderedDict[str, shared_memory.SharedMemory] = OrderedDict()
+
+
+def attach(*descriptors: Descriptor) -> List[shared_memory.SharedMemory]:
+    '''
+    Maps the blocks of a task in a worker, keeping the recently used ones mapped.
+    '''
+    blocks = []
+    for descriptor in descriptors:
+        block = _attached.pop(descriptor.name, None)
+        if block is None:
+            block = shared_memory.SharedMemory(name=descriptor.name)
+        _attached[descriptor.name] = block
+        blocks.append(block)
+    # the blocks of this task were moved to the end, the ones unmapped come before them
+    while len(_attached) > len(descriptors) and sum(memory.size for memory in _attached.values()) > MAX_ATTACHED_BYTES:
+        name, memory = _attached.popitem(last=False)
+        memory.close()
+    return blocks
+
+
+def run(source: Descriptor, target: Descriptor, operations: List[stream.Operation]) -> Union[Descriptor, np.ndarray]:
+    '''
+    Applies operations (see stream.parse_operation) to an array in a block, writing the result into another.
+    Returns the descriptor of the result, or the result itself if it doesn't fit the block.
+    '''
+    source_block, block = attach(source, target)
+    image = as_array(source_block, source)
+    image.flags.writeable = False
+    result = stream.Chain(operations)(image)
+    if result.nbytes > block.size:
+        return result
+    written = Descriptor(target.name, result.shape, result.dtype.str)
+    as_array(block, written)[...] = result
+    return written
+
+
+def run_pickled(image: np.ndarray, operations: List[stream.Operation]) -> np.ndarray:
+    '''
+    Same as run with the arrays pickled, for comparison.
+    '''
+    return stream.Chain(operations)(image)
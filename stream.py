@@ -0,0 +1,349 @@
+'''
+Streaming mode of RasterLab.
+
+Runs a chain of engine operations on every frame of a video, of a numbered
+frame sequence (a printf pattern like frames/img_%04d.png) or of a directory
+of images, and writes the results as a video or as a directory of frames.
+
+Decoding, processing and encoding are pipelined: the reader, the processing
+workers and the writer run on their own threads, connected by bounded
+queues, so a slow stage holds the others back instead of piling frames up in
+memory. OpenCV releases the GIL, so several frames are processed at once; the
+writer puts them back in order.
+
+Operations are applied in the order given, with the parameters of the engine
+functions (see pipeline.OPERATIONS); chains of point operations are fused into
+a single lookup table:
+
+    python stream.py input.mp4 -o output/edges.mp4 --op filter filter_option=4 edge_option=1 a=100 b=200
+    python stream.py "frames/img_%04d.png" -o output/frames --gray \\
+        --op segment mode=3 --op morph operation=3 shape=2 edge=2 size=3
+'''
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import ast
+import glob
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+import cv2 as cv
+import batch
+import engine
+import export
+import pipeline
+import tracing
+
+
+VIDEO_CODECS = {".mp4": "mp4v", ".avi": "MJPG"}
+DEFAULT_FPS = 25.0
+DEFAULT_QUEUE_SIZE = 8
+# frames between progress reports
+PROGRESS_EVERY = 50
+# how often blocked stages check whether the stream was stopped
+POLL_SECONDS = 0.1
+
+Operation = Tuple[str, Dict[str, Any]]
+
+
+def parse_operation(tokens: List[str]) -> Operation:
+    '''
+    Parses an operation given as its name followed by key=value parameters.
+    '''
+    name, *assignments = tokens
+    if name not in pipeline.OPERATIONS:
+        raise ValueError(f"Unknown operation: {name}")
+    params: Dict[str, Any] = {}
+    for assignment in assignments:
+        key, separator, value = assignment.partition("=")
+        if not separator:
+            raise ValueError(f"Parameter of {name} isn't key=value: {assignment}")
+        try:
+            params[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            params[key] = value
+    return name, params
+
+
+def read_frames(source: str) -> Tuple[Iterator[np.ndarray], Optional[float]]:
+    '''
+    Returns the frames of a video, frame pattern or camera index, or of the images in a directory or glob,
+    and the frame rate if the source has one.
+    '''
+    if os.path.isdir(source) or (glob.has_magic(source) and "%" not in source):
+        paths = batch.collect_inputs([source])
+        return (batch.read_image(path, cv.IMREAD_COLOR) for path in paths), None
+    capture = cv.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f"Can't open {source}")
+    fps = capture.get(cv.CAP_PROP_FPS)
+
+    def frames() -> Iterator[np.ndarray]:
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                yield frame
+        finally:
+            capture.release()
+
+    return frames(), fps if fps and fps > 0 else None
+
+
+class FrameWriter:
+    '''
+    Writes frames into a video (by its extension) or numbered image files in a directory.
+    '''
+
+    def __init__(self, output: str, fps: float, frame_extension: str = ".png",
+                 options: Optional[Dict[str, Any]] = None) -> None:
+        self.output = output
+        self.fps = fps
+        self.frame_extension = frame_extension
+        self.options = options
+        self.video: Optional[cv.VideoWriter] = None
+        self.size: Optional[Tuple[int, int]] = None
+        self.count = 0
+        extension = os.path.splitext(output)[1].lower()
+        self.codec = VIDEO_CODECS.get(extension)
+        if self.codec is None:
+            os.makedirs(output, exist_ok=True)
+        elif os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    def write(self, frame: np.ndarray) -> None:
+        if self.codec is None:
+            name = f"frame_{self.count:06d}{self.frame_extension}"
+            export.save(frame, os.path.join(self.output, name), self.options)
+        else:
+            # videos hold 8-bit color frames of one size, set by the first one
+            frame = engine.to_uint8(frame)
+            if frame.ndim == 2:
+                frame = cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+            size = (frame.shape[1], frame.shape[0])
+            if self.video is None:
+                self.video = cv.VideoWriter(self.output, cv.VideoWriter_fourcc(*self.codec), self.fps, size)
+                if not self.video.isOpened():
+                    raise ValueError(f"Can't write video {self.output}")
+                self.size = size
+            elif size != self.size:
+                # the writer would drop the frame without a word
+                raise ValueError(f"Frame {self.count} is {size[0]}x{size[1]}, the video {self.output} is "
+                                 f"{self.size[0]}x{self.size[1]}; write frames of different sizes into a directory")
+            self.video.write(frame)
+        self.count += 1
+
+    def close(self) -> None:
+        if self.video is not None:
+            self.video.release()
+            self.video = None
+
+
+class Chain:
+    '''
+    Operations applied to every frame, as a pipeline fed with the frames one by one.
+    '''
+
+    def __init__(self, operations: List[Operation], gray: bool = False) -> None:
+        self.gray = gray
+        self.pipe = pipeline.Pipeline()
+        self.source = self.pipe.source(np.zeros((1, 1), np.uint8), "frame")
+        self.last = self.source
+        for name, params in operations:
+            self.last = self.last.then(name, **params)
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        if self.gray and frame.ndim == 3:
+            frame = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        self.pipe.feed(self.source, frame)
+        return self.pipe.compute(self.last)
+
+
+class Stage:
+    '''
+    Busy time of a pipeline stage, summed over its threads.
+    '''
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self.seconds += seconds
+
+
+def put(target: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    '''
+    Puts an item on a bounded queue, giving up if the stream is stopped meanwhile.
+    '''
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get(source: queue.Queue, stop: threading.Event) -> Any:
+    '''
+    Takes an item from a queue, None if the stream is stopped meanwhile.
+    '''
+    while not stop.is_set():
+        try:
+            return source.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return None
+
+
+def run_stream(source: str, output: str, operations: List[Operation], workers: int = 2,
+               queue_size: int = DEFAULT_QUEUE_SIZE, gray: bool = False, fps: Optional[float] = None,
+               frame_extension: str = ".png", limit: Optional[int] = None, out=sys.stdout) -> Dict[str, Any]:
+    '''
+    Reads, processes and writes the frames on separate threads.
+    Returns the number of frames, the time, the frame rate and the busy time of every stage.
+    '''
+    frames, source_fps = read_frames(source)
+    writer = FrameWriter(output, fps or source_fps or DEFAULT_FPS, frame_extension)
+    stages = {name: Stage(name) for name in ("decode", "process", "encode")}
+    decoded: queue.Queue = queue.Queue(maxsize=queue_size)
+    processed: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    # marks the end of the frames, every worker passes it on
+    done = (-1, None)
+
+    def fail(error: BaseException) -> None:
+        errors.append(error)
+        stop.set()
+
+    def read() -> None:
+        try:
+            index = 0
+            while limit is None or index < limit:
+                start = time.perf_counter()
+                with tracing.span("stream: decode", "stream"):
+                    frame = next(frames, None)
+                stages["decode"].add(time.perf_counter() - start)
+                if frame is None or not put(decoded, (index, frame), stop):
+                    break
+                index += 1
+        except BaseException as error:
+            fail(error)
+        finally:
+            for _ in range(workers):
+                put(decoded, done, stop)
+
+    def process() -> None:
+        chain = Chain(operations, gray)
+        try:
+            while True:
+                item = get(decoded, stop)
+                if item is None or item is done:
+                    break
+                index, frame = item
+                start = time.perf_counter()
+                with tracing.span("stream: process", "stream", frame=index):
+                    result = chain(frame)
+                stages["process"].add(time.perf_counter() - start)
+                if not put(processed, (index, result), stop):
+                    break
+        except BaseException as error:
+            fail(error)
+        finally:
+            put(processed, done, stop)
+
+    threads = [threading.Thread(target=read, name="stream-decode", daemon=True)]
+    threads += [threading.Thread(target=process, name=f"stream-process-{number}", daemon=True)
+                for number in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    # the writer runs on the calling thread, putting frames finished out of order back in order
+    pending: Dict[int, np.ndarray] = {}
+    finished_workers = 0
+    written = 0
+    try:
+        while finished_workers < workers:
+            item = get(processed, stop)
+            if item is None:
+                break
+            if item is done:
+                finished_workers += 1
+                continue
+            pending[item[0]] = item[1]
+            while written in pending:
+                start = time.perf_counter()
+                with tracing.span("stream: encode", "stream", frame=written):
+                    writer.write(pending.pop(written))
+                stages["encode"].add(time.perf_counter() - start)
+                written += 1
+                if written % PROGRESS_EVERY == 0:
+                    elapsed = time.perf_counter() - started
+                    print(f"{written} frames, {written / elapsed:.1f} fps", file=out)
+    except BaseException as error:
+        fail(error)
+    finally:
+        stop.set()
+        writer.close()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - started
+    busy = {name: stage.seconds for name, stage in stages.items()}
+    return {
+        "frames": written,
+        "seconds": elapsed,
+        "fps": written / elapsed if elapsed else 0.0,
+        "stages": busy,
+        # processing is spread over the workers
+        "bottleneck": max(busy, key=lambda name: busy[name] / (workers if name == "process" else 1)),
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="stream.py", description="Apply a chain of RasterLab operations to every frame of a video.")
+    parser.add_argument("input", help="video file, frame pattern (e.g. img_%%04d.png), camera index or directory")
+    parser.add_argument("-o", "--output", required=True,
+                        help="video file (.mp4, .avi) or directory for the frames")
+    parser.add_argument("--op", dest="operations", action="append", nargs="+", required=True,
+                        metavar="NAME [KEY=VALUE ...]",
+                        help=f"operation applied to every frame, repeat for a chain: {', '.join(pipeline.OPERATIONS)}")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="processing threads (default: 2)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="frames waiting between two stages at most (default: 8)")
+    parser.add_argument("--gray", action="store_true", help="convert the frames to greyscale first")
+    parser.add_argument("--fps", type=float, help="frame rate of the output video (default: the input's)")
+    parser.add_argument("--frame-format", default=".png", help="extension of written frames (default: .png)")
+    parser.add_argument("--limit", type=int, help="process at most this many frames")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        operations = [parse_operation(tokens) for tokens in args.operations]
+        stats = run_stream(args.input, args.output, operations, args.workers, args.queue_size,
+                           args.gray, args.fps, args.frame_format, args.limit)
+    except (ValueError, TypeError) as error:
+        # TypeError comes from parameters the engine function doesn't take
+        print(error, file=sys.stderr)
+        return 1
+    stages = ", ".join(f"{name} {seconds:.2f} s" for name, seconds in stats["stages"].items())
+    print(f"Processed {stats['frames']} frames in {stats['seconds']:.2f} s ({stats['fps']:.1f} fps); "
+          f"busy: {stages}; bottleneck: {stats['bottleneck']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import pytest
+import cv2 as cv
+import batch
+
+
+@pytest.fixture
+def images(tmp_path):
+    image = np.arange(48, dtype=np.uint8).reshape(4, 4, 3)
+    for name in ("a/x.png", "a/sub/x.png", "b/x.png", "b/y.npy"):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if name.endswith(".npy"):
+            np.save(path, image)
+        else:
+            cv.imwrite(str(path), image)
+    return tmp_path
+
+
+def test_output_paths_keep_relative_paths(images):
+    out = str(images / "out")
+    destinations = batch.output_paths([str(images / "*" / "sub" / "*.png"), str(images / "b")], out)
+    assert destinations == {
+        str(images / "a" / "sub" / "x.png"): os.path.join(out, "a", "sub", "x.png"),
+        str(images / "b" / "x.png"): os.path.join(out, "x.png"),
+        str(images / "b" / "y.npy"): os.path.join(out, "y.npy"),
+    }
+
+
+def test_output_paths_number_repeated_names(images):
+    out = str(images / "out")
+    destinations = batch.output_paths([str(images / "a"), str(images / "b" / "x.png")], out)
+    assert sorted(destinations.values()) == [os.path.join(out, "x.png"), os.path.join(out, "x_2.png")]
+    # a file given twice is processed once
+    assert len(batch.output_paths([str(images / "a"), str(images / "a" / "*.png")], out)) == 1
+
+
+def test_output_paths_refuse_to_overwrite_inputs(images):
+    with pytest.raises(ValueError, match="overwrite"):
+        batch.output_paths([str(images / "b")], str(images / "b"))
+    with pytest.raises(ValueError, match="overwrite"):
+        batch.output_paths([str(images / "b" / "*.npy")], str(images / "a" / ".." / "b"))
+    link = images / "link"
+    os.symlink(images / "b", link)
+    with pytest.raises(ValueError, match="overwrite"):
+        batch.output_paths([str(images / "b")], str(link))
+
+
+def test_main_writes_every_file(images):
+    out = images / "out"
+    assert batch.main(["-o", str(out), "--workers", "1", str(images / "a"), str(images / "b"), "negate"]) == 0
+    assert sorted(os.path.relpath(os.path.join(root, name), out)
+                  for root, _, names in os.walk(out) for name in names) == ["x.png", "x_2.png", "y.npy"]
+    assert np.array_equal(np.load(out / "y.npy"), 255 - np.load(images / "b" / "y.npy"))
+
+
+def test_main_refuses_output_in_input_directory(images):
+    before = np.load(images / "b" / "y.npy")
+    assert batch.main([str(images / "b"), "-o", str(images / "b"), "negate"]) == 1
+    assert np.array_equal(np.load(images / "b" / "y.npy"), before)
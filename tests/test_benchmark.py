@@ -0,0 +1,56 @@
+import io
+import numpy as np
+import pytest
+import cv2 as cv
+import benchmark
+import reference
+
+
+def broken(image):
+    raise RuntimeError("broken operation")
+
+
+@pytest.fixture
+def inputs():
+    color = cv.resize(cv.imread(benchmark.SYNTHETIC_SOURCE, cv.IMREAD_COLOR), (64, 48))
+    return [("small", benchmark.make_inputs(color))]
+
+
+def test_failed_case_is_counted(monkeypatch, inputs):
+    monkeypatch.setitem(benchmark.CASES, "broken", ("color", broken))
+    out = io.StringIO()
+    report = benchmark.run_suite(inputs, ["negate", "broken"], 1, benchmark.DEFAULT_THRESHOLD, {}, {}, out)
+    assert list(report["results"]) == ["negate @ small"]
+    assert report["failures"] == {"broken @ small": "RuntimeError: broken operation"}
+    assert "FAILED" in out.getvalue()
+
+
+def test_main_exits_with_failure(monkeypatch, tmp_path, inputs):
+    monkeypatch.setitem(benchmark.CASES, "broken", ("color", broken))
+    monkeypatch.setattr(benchmark, "corpus", lambda sizes, examples: inputs)
+    golden = tmp_path / "golden.json"
+    arguments = ["--only", "negate", "broken", "--repeat", "1", "--baseline", str(tmp_path / "baseline.json"),
+                 "--golden", str(golden)]
+    assert benchmark.main(arguments + ["--save-golden"]) == 1
+    assert list(benchmark.load(str(golden))) == ["negate @ small"]
+    assert benchmark.main(["--only", "negate", "--repeat", "1", "--golden", str(golden),
+                           "--baseline", str(tmp_path / "baseline.json")]) == 0
+
+
+def test_reference_check(inputs):
+    cases = ["negate", "posterize", "stretch", "filter median"]
+    image_inputs = inputs[0][1]
+    golden = {}
+    for name in cases:
+        kind, operation = benchmark.CASES[name]
+        golden[f"{name} @ small"] = benchmark.digest(benchmark.seeded(operation, image_inputs[kind]))
+    check = benchmark.check_reference(inputs, cases, golden, io.StringIO())
+    assert check["checked"] == [f"{name} @ small" for name in cases]
+    assert check["differences"] == []
+    # a wrong golden digest isn't hidden
+    golden["negate @ small"] = benchmark.digest(np.zeros(1))
+    assert benchmark.check_reference(inputs, cases, golden, io.StringIO())["differences"] == ["negate @ small"]
+
+
+def test_changed_cases_exist():
+    assert set(reference.CHANGED) <= set(reference.CASES) <= set(benchmark.CASES)
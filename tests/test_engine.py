@@ -0,0 +1,73 @@
+import random
+import numpy as np
+import pytest
+import cv2 as cv
+import benchmark
+import engine
+import reference
+
+SLOW = {"stitch", "stitch cropped"}
+
+
+def small_inputs():
+    lena = cv.resize(cv.imread(benchmark.SYNTHETIC_SOURCE, cv.IMREAD_COLOR), (61, 47))
+    noise = np.random.default_rng(0).integers(0, 256, (23, 37, 3), dtype=np.uint8)
+    return [("lena", benchmark.make_inputs(lena)), ("noise", benchmark.make_inputs(noise))]
+
+
+INPUTS = small_inputs()
+
+
+def run(operation, argument):
+    random.seed(0)
+    cv.setRNGSeed(0)
+    return operation(argument)
+
+
+def assert_same(result, expected):
+    if isinstance(expected, dict):
+        assert result.keys() == expected.keys()
+        for key in expected:
+            assert_same(result[key], expected[key])
+    elif isinstance(expected, np.ndarray):
+        assert result.shape == expected.shape and result.dtype == expected.dtype
+        assert np.array_equal(result, expected)
+    else:
+        assert result == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("image_name, inputs", INPUTS, ids=[name for name, _ in INPUTS])
+@pytest.mark.parametrize("name", [name for name in reference.CASES if name not in SLOW.union(reference.CHANGED)])
+def test_engine_matches_original(name, image_name, inputs):
+    kind, original = reference.CASES[name]
+    assert_same(run(benchmark.CASES[name][1], inputs[kind]), run(original, inputs[kind]))
+
+
+@pytest.mark.parametrize("name", sorted(SLOW))
+def test_stitch_matches_original(name):
+    images = [cv.imread(path, cv.IMREAD_COLOR) for path in benchmark.STITCH_IMAGES]
+    assert_same(run(benchmark.CASES[name][1], images), run(reference.CASES[name][1], images))
+
+
+def test_stretch_uses_the_whole_range():
+    image = np.array([[40, 41, 41, 100, 200, 200]], np.uint8)
+    assert engine.stretch(image).tolist() == [[0, 1, 1, 95, 255, 255]]
+    # the original skipped levels present only once
+    assert reference.stretch(image).tolist() == [[0, 0, 0, 94, 255, 255]]
+
+
+def test_multilevel_threshold_covers_the_top_levels():
+    image = np.arange(256, dtype=np.uint8).reshape(16, 16)
+    with pytest.raises(IndexError):
+        reference.threshold(image, 4, False)
+    result = engine.threshold(image, 4, False)
+    assert np.array_equal(result[image < 252], reference.threshold(np.minimum(image, 251), 4, False)[image < 252])
+    assert set(result[image >= 252].tolist()) == {191}
+
+
+def test_find_objects_without_area():
+    image = np.zeros((9, 9), np.uint8)
+    image[4, 2:7] = 255
+    with pytest.raises(ZeroDivisionError):
+        reference.find_objects(image)
+    assert engine.find_objects(image)["solidity"] == 0.0
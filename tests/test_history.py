@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+import engine
+import history
+
+IMAGE = np.random.default_rng(0).integers(0, 256, (40, 50, 3), dtype=np.uint8)
+
+
+def paint(array):
+    '''
+    Changes only the top left tile.
+    '''
+    result = array.copy()
+    result[:8, :8] = 7
+    return result
+
+
+RECIPES = [
+    ("negate", engine.negate),
+    ("paint", paint),
+    ("blur", lambda array: engine.apply_filter(array, 1, 1)),
+    ("crop", lambda array: array[5:30, 10:40].copy()),
+    ("posterize", lambda array: engine.posterize(array, 4)),
+]
+
+
+def states():
+    '''
+    The original image and the state after every recipe.
+    '''
+    found = [IMAGE]
+    for name, recipe in RECIPES:
+        found.append(recipe(found[-1]))
+    return found
+
+
+def walk(image_history, expected):
+    # undo everything, redo everything and back to the middle
+    for index in range(len(RECIPES) - 1, -1, -1):
+        assert np.array_equal(image_history.undo(), expected[index])
+    assert image_history.undo() is None
+    for index in range(1, len(RECIPES) + 1):
+        assert np.array_equal(image_history.redo(), expected[index])
+    assert image_history.redo() is None
+    for index in (4, 3):
+        assert np.array_equal(image_history.undo(), expected[index])
+    assert np.array_equal(image_history.redo(), expected[4])
+
+
+@pytest.mark.parametrize("budget_bytes", [1 << 30, 3000, 0])
+def test_undo_redo(budget_bytes):
+    budget = history.HistoryBudget(budget_bytes)
+    image_history = history.History(IMAGE, budget, tile_size=8)
+    expected = states()
+    for name, recipe in RECIPES:
+        image_history.apply(name, recipe)
+    walk(image_history, expected)
+    assert budget.memory() <= budget_bytes
+    if budget_bytes == 0:
+        assert budget.drops > 0
+        assert not any(step.has_delta for step in image_history.steps)
+
+
+def test_deltas_keep_only_changed_tiles():
+    image_history = history.History(IMAGE, tile_size=8)
+    image_history.apply("negate", engine.negate)
+    image_history.apply("paint", paint)
+    # the first step needs no delta, the painted one keeps one tile
+    assert [step.memory() for step in image_history.steps] == [0, 8 * 8 * 3]
+    image_history.apply("crop", lambda array: array[:10].copy())
+    assert image_history.steps[-1].full is not None
+    assert np.array_equal(image_history.undo(), paint(engine.negate(IMAGE)))
+
+
+def test_dropped_deltas_are_recomputed():
+    budget = history.HistoryBudget()
+    image_history = history.History(IMAGE, budget, tile_size=8)
+    expected = states()
+    for name, recipe in RECIPES:
+        image_history.apply(name, recipe)
+    image_history.undo()
+    image_history.undo()
+    budget.set_budget(0)
+    assert budget.memory() == 0
+    # undo replays the steps from the original, redo runs the step again
+    assert np.array_equal(image_history.undo(), expected[2])
+    assert np.array_equal(image_history.redo(), expected[3])
+    assert np.array_equal(image_history.redo(), expected[4])
+    assert np.array_equal(image_history.redo(), expected[5])
+    budget.set_budget(1 << 30)
+    walk(image_history, expected)
+
+
+def test_apply_after_undo_drops_redo_steps():
+    image_history = history.History(IMAGE)
+    image_history.apply("negate", engine.negate)
+    image_history.apply("paint", paint)
+    image_history.undo()
+    image_history.apply("posterize", lambda array: engine.posterize(array, 4))
+    assert [step.name for step in image_history.steps] == ["negate", "posterize"]
+    assert not image_history.can_redo
+    assert np.array_equal(image_history.undo(), engine.negate(IMAGE))
+
+
+def test_cheapest_deltas_are_dropped_first():
+    budget = history.HistoryBudget()
+    histories = [history.History(IMAGE, budget, tile_size=8) for _ in range(2)]
+    for image_history, cost in zip(histories, (0.001, 1.0)):
+        image_history.apply("negate", engine.negate)
+        image_history.apply("paint", paint)
+        image_history.steps[0].cost = cost
+    budget.set_budget(budget.memory() - 1)
+    assert [image_history.steps[1].has_delta for image_history in histories] == [False, True]
+    histories[0].close()
+    assert budget.stats()["histories"] == 1
+
+
+def test_states_are_read_only():
+    image_history = history.History(IMAGE)
+    result = image_history.apply("negate", engine.negate)
+    image_history.apply("paint", paint)
+    for state in (result, image_history.undo(), image_history.redo()):
+        assert not state.flags.writeable
@@ -0,0 +1,98 @@
+import struct
+import numpy as np
+import pytest
+import cv2 as cv
+from PIL import Image
+import image_cache
+import mapped
+
+FLAGS = [cv.IMREAD_UNCHANGED, cv.IMREAD_GRAYSCALE, cv.IMREAD_COLOR]
+
+
+def write_bmp(path, pixels, bits, top_down=False, palette=None):
+    '''
+    Writes an uncompressed bitmap with a BITMAPINFOHEADER, pixels in BGR(X) order.
+    '''
+    height, width = pixels.shape[:2]
+    stride = (width * bits // 8 + 3) // 4 * 4
+    rows = np.zeros((height, stride), np.uint8)
+    rows[:, :width * bits // 8] = pixels.reshape(height, -1)
+    if not top_down:
+        rows = rows[::-1]
+    if bits == 8 and palette is None:
+        palette = np.repeat(np.arange(256, dtype=np.uint8), 4).reshape(256, 4)
+    colors = b"" if palette is None else palette.tobytes()
+    offset = 14 + 40 + len(colors)
+    with open(path, "wb") as file:
+        file.write(struct.pack("<2sIHHI", b"BM", offset + rows.size, 0, 0, offset))
+        file.write(struct.pack("<IiiHHIIiiII", 40, width, -height if top_down else height, 1, bits, 0,
+                               rows.size, 2835, 2835, 0, 0))
+        file.write(colors)
+        file.write(rows.tobytes())
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.mark.parametrize("bits", [8, 24, 32])
+@pytest.mark.parametrize("top_down", [False, True])
+@pytest.mark.parametrize("width", [7, 8])
+@pytest.mark.parametrize("flags", FLAGS)
+def test_read_matches_imread(tmp_path, rng, bits, top_down, width, flags):
+    path = str(tmp_path / "image.bmp")
+    shape = (5, width) if bits == 8 else (5, width, bits // 8)
+    write_bmp(path, rng.integers(0, 256, shape, np.uint8), bits, top_down)
+    assert mapped.open_bmp(path) is not None
+    read = image_cache.ImageCache().read(path, flags)
+    np.testing.assert_array_equal(read, cv.imread(path, flags))
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+@pytest.mark.parametrize("flags", FLAGS)
+def test_read_matches_imread_for_pillow_bitmaps(tmp_path, rng, mode, flags):
+    path = str(tmp_path / "image.bmp")
+    shape = (5, 7) if mode == "L" else (5, 7, len(mode))
+    Image.fromarray(rng.integers(0, 256, shape, np.uint8), mode).save(path)
+    read = image_cache.ImageCache().read(path, flags)
+    np.testing.assert_array_equal(read, cv.imread(path, flags))
+
+
+def test_32_bit_bitmap_is_a_view_without_the_reserved_byte(tmp_path, rng):
+    path = str(tmp_path / "image.bmp")
+    pixels = rng.integers(0, 256, (5, 7, 4), np.uint8)
+    write_bmp(path, pixels, 32)
+    view = mapped.open_bmp(path)
+    assert view.shape == (5, 7, 3)
+    assert isinstance(view.base, np.memmap) or isinstance(view, np.memmap)
+    np.testing.assert_array_equal(view, pixels[:, :, :3])
+
+
+def test_decoded_when_not_mappable(tmp_path, rng):
+    # a palette other than a grayscale ramp has to be applied by the decoder
+    path = str(tmp_path / "palette.bmp")
+    palette = rng.integers(0, 256, (256, 4), np.uint8)
+    write_bmp(path, rng.integers(0, 256, (5, 7), np.uint8), 8, palette=palette)
+    assert mapped.open_bmp(path) is None
+    np.testing.assert_array_equal(image_cache.ImageCache().read(path, cv.IMREAD_COLOR),
+                                  cv.imread(path, cv.IMREAD_COLOR))
+
+
+def test_core_header_is_not_mapped(tmp_path, rng):
+    path = str(tmp_path / "core.bmp")
+    pixels = rng.integers(0, 256, (4, 4, 3), np.uint8)
+    offset = 14 + 12
+    with open(path, "wb") as file:
+        file.write(struct.pack("<2sIHHI", b"BM", offset + pixels.size, 0, 0, offset))
+        file.write(struct.pack("<IHHHH", 12, 4, 4, 1, 24))
+        file.write(pixels[::-1].tobytes())
+    assert mapped.open_bmp(path) is None
+
+
+@pytest.mark.parametrize("extension", [".npy", ".raw"])
+def test_npy_and_raw_round_trip(tmp_path, rng, extension):
+    path = str(tmp_path / f"image{extension}")
+    pixels = rng.integers(0, 65536, (6, 5, 3), np.uint16)
+    mapped.save(path, pixels)
+    np.testing.assert_array_equal(mapped.open_mapped(path), pixels)
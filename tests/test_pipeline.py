@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import cv2 as cv
+import benchmark
+import engine
+import pipeline
+
+IMAGE = cv.resize(cv.imread(benchmark.SYNTHETIC_SOURCE, cv.IMREAD_COLOR), (53, 41))
+
+
+def test_point_operations_are_fused():
+    pipe = pipeline.Pipeline()
+    source = pipe.source(IMAGE)
+    last = source.then("stretch", p1=30, p2=220, q3=0, q4=255).then("negate").then("posterize", bins=5)
+    expected = engine.posterize(engine.negate(engine.stretch(IMAGE, 30, 220, 0, 255)), 5)
+    assert np.array_equal(last.compute(), expected)
+    # the source and one fused table
+    assert pipe.runs == 2
+
+
+def test_automatic_stretch_is_not_fused():
+    gray = cv.cvtColor(IMAGE, cv.COLOR_BGR2GRAY)
+    pipe = pipeline.Pipeline()
+    last = pipe.source(gray).then("negate").then("stretch").then("threshold", value=4, simple=False)
+    expected = engine.threshold(engine.stretch(engine.negate(gray)), 4, False)
+    assert np.array_equal(last.compute(), expected)
+    assert pipe.runs == 4
+
+
+def test_chain_matches_sequential_engine_calls():
+    gray = cv.cvtColor(IMAGE, cv.COLOR_BGR2GRAY)
+    pipe = pipeline.Pipeline()
+    median = pipe.source(gray).then("filter", filter_option=10, edge_option=1, a=5)
+    skeleton = median.then("segment", mode=3).then(
+        "morph", operation=3, shape=2, edge=2, size=3).then("skeletonize")
+    expected = engine.skeletonize(engine.morph(engine.segment(engine.apply_filter(gray, 10, 1, 5), 3), 3, 2, 2, 3))
+    assert np.array_equal(skeleton.compute(), expected)
+
+
+def test_update_recomputes_downstream_only():
+    pipe = pipeline.Pipeline()
+    blur = pipe.source(IMAGE).then("filter", filter_option=1, edge_option=1)
+    threshold = blur.then("negate").then("threshold", value=100)
+    threshold.compute()
+    runs = pipe.runs
+    blurred = blur.compute()
+    threshold.set(value=200)
+    assert blur.compute() is blurred
+    assert np.array_equal(threshold.compute(), engine.threshold(engine.negate(blurred), 200))
+    # negate and threshold fused again, the filter isn't run
+    assert pipe.runs == runs + 1
+
+
+def test_computed_point_operation_is_reused():
+    pipe = pipeline.Pipeline()
+    negate = pipe.source(IMAGE).then("negate")
+    negate.compute()
+    posterize = negate.then("posterize", bins=4)
+    assert np.array_equal(posterize.compute(), engine.posterize(255 - IMAGE, 4))
+    assert pipe.runs == 3
+
+
+def test_feed_replaces_the_source():
+    pipe = pipeline.Pipeline()
+    source = pipe.source(IMAGE)
+    negate = source.then("negate")
+    negate.compute()
+    pipe.feed(source, IMAGE[::-1])
+    assert np.array_equal(negate.compute(), 255 - IMAGE[::-1])
+
+
+def test_results_are_read_only():
+    pipe = pipeline.Pipeline()
+    image = IMAGE.copy()
+    result = pipe.source(image).then("negate").compute()
+    with pytest.raises(ValueError):
+        result[0, 0] = 0
+    assert image.flags.writeable
+
+
+def test_unknown_operation():
+    with pytest.raises(ValueError):
+        pipeline.Pipeline().source(IMAGE).then("sharpen")
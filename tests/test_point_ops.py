@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+import point_ops
+import reference
+
+LEVELS = np.arange(256, dtype=np.uint8).reshape(16, 16)
+COLOR = np.stack([LEVELS, LEVELS[::-1], LEVELS.T], axis=2)
+
+
+def covered(bins, span):
+    '''
+    Levels the original tables had an entry for.
+    '''
+    return LEVELS < int(span / bins) * bins
+
+
+def test_negate():
+    assert np.array_equal(point_ops.apply_lut(LEVELS, point_ops.negate_lut()), reference.negate(LEVELS))
+    assert np.array_equal(point_ops.apply_lut(COLOR, point_ops.negate_lut()), reference.negate(COLOR))
+
+
+@pytest.mark.parametrize("value", [0, 1, 2, 127, 200, 255, 256])
+def test_threshold(value):
+    assert np.array_equal(point_ops.apply_lut(LEVELS, point_ops.threshold_lut(value)),
+                          reference.threshold(LEVELS, value, True))
+
+
+@pytest.mark.parametrize("bins", [1, 2, 3, 4, 7, 16, 255])
+def test_multilevel(bins):
+    result = point_ops.apply_lut(LEVELS, point_ops.multilevel_lut(bins, 255))
+    mask = covered(bins, 255)
+    expected = reference.threshold(np.where(mask, LEVELS, 0).astype(np.uint8), bins, False)
+    assert np.array_equal(result[mask], expected[mask])
+    assert np.all(result[~mask] == result[mask].max())
+
+
+@pytest.mark.parametrize("bins", [1, 2, 3, 4, 5, 8, 256])
+def test_posterize(bins):
+    result = point_ops.apply_lut(COLOR, point_ops.multilevel_lut(bins, 256))
+    mask = COLOR < int(256 / bins) * bins
+    expected = reference.posterize(np.where(mask, COLOR, 0).astype(np.uint8), bins)
+    assert np.array_equal(result[mask], expected[mask])
+
+
+def test_multilevel_rejects_no_bins():
+    with pytest.raises(ValueError):
+        point_ops.multilevel_lut(0, 255)
+
+
+@pytest.mark.parametrize("start, end, q3, q4", [(50, 200, 0, 255), (0, 255, 10, 240), (100, 101, 0, 255),
+                                                (30, 60, 20, 200), (200, 50, 0, 255)])
+def test_stretch(start, end, q3, q4):
+    # the menu passed the entries as strings
+    expected = reference.stretch(LEVELS, str(start), str(end), str(q3), str(q4))
+    assert np.array_equal(point_ops.apply_lut(LEVELS, point_ops.stretch_lut(start, end, q3, q4)), expected)
+
+
+def test_stretch_of_one_level_is_identity():
+    assert np.array_equal(point_ops.stretch_lut(7, 7, 0, 255), point_ops.identity_lut())
+
+
+def test_compose_applies_tables_in_order():
+    luts = [point_ops.stretch_lut(50, 200, 0, 255), point_ops.negate_lut(), point_ops.multilevel_lut(5, 256)]
+    sequential = COLOR
+    for lut in luts:
+        sequential = point_ops.apply_lut(sequential, lut)
+    assert np.array_equal(point_ops.apply_lut(COLOR, point_ops.compose(*luts)), sequential)
+
+
+def test_compose_with_channel_tables():
+    per_channel = np.stack([point_ops.negate_lut(), point_ops.identity_lut(), point_ops.threshold_lut(100)], axis=1)
+    luts = [point_ops.threshold_lut(128), per_channel, point_ops.negate_lut()]
+    sequential = COLOR
+    for lut in luts:
+        sequential = point_ops.apply_lut(sequential, lut)
+    assert np.array_equal(point_ops.apply_lut(COLOR, point_ops.compose(*luts)), sequential)
+
+
+def test_alpha_is_kept():
+    image = np.dstack([COLOR, LEVELS])
+    result = point_ops.apply_lut(image, point_ops.negate_lut())
+    assert np.array_equal(result[:, :, :3], 255 - COLOR)
+    assert np.array_equal(result[:, :, 3], LEVELS)
+
+
+def test_only_8_bit_images():
+    with pytest.raises(ValueError):
+        point_ops.apply_lut(LEVELS.astype(np.uint16), point_ops.negate_lut())
@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import cv2 as cv
+import image_cache
+from raster import RasterImage
+from session import Session
+
+SIZE = (256, 256, 3)
+
+
+class View:
+    '''
+    Stands in for a viewer holding a pyramid.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.released = 0
+
+    def memory(self, base=True):
+        return self.size
+
+    def release(self):
+        self.released += 1
+        self.size = 0
+
+
+def result(value):
+    return RasterImage.from_array(np.full(SIZE, value, np.uint8))
+
+
+def test_least_recently_focused_results_are_spilled(tmp_path):
+    images = [result(value) for value in range(4)]
+    session = Session(budget_bytes=2 * images[0].memory(), spill_dir=str(tmp_path))
+    views = [View(1000) for _ in images]
+    for image, view in zip(images, views):
+        session.add(image, view)
+    # the two most recent images are kept
+    assert [image.loaded for image in images] == [False, False, True, True]
+    assert [view.released for view in views] == [1, 1, 0, 0]
+    assert len(os.listdir(tmp_path)) == 2
+    assert session.memory() <= session.budget_bytes + 2000
+    assert session.stats()["spilled"] == 2
+
+    session.touch(images[0])
+    assert np.array_equal(images[0].array, np.full(SIZE, 0, np.uint8))
+    # mapped back from the spill file, so it doesn't count
+    assert isinstance(images[0].array, np.memmap)
+    assert session.stats()["reloads"] == 1
+    assert session.stats()["spilled"] == 2
+
+
+def test_spilled_file_image_is_decoded_again(tmp_path):
+    path = str(tmp_path / "image.png")
+    pixels = np.random.default_rng(0).integers(0, 256, SIZE, dtype=np.uint8)
+    cv.imwrite(path, pixels)
+    image = RasterImage(path)
+    assert np.array_equal(image.array, pixels)
+    session = Session(budget_bytes=0, spill_dir=str(tmp_path / "spill"), keep_recent=0)
+    session.add(image)
+    assert not image.loaded and image.memory() == 0
+    assert image_cache.shared.evict(path) == 0
+    # files are decoded again rather than written out
+    assert not os.path.exists(tmp_path / "spill")
+    assert np.array_equal(image.array, pixels)
+
+
+def test_remove_and_close_delete_spill_files():
+    session = Session(budget_bytes=0, keep_recent=0)
+    first, second = result(1), result(2)
+    session.add(first)
+    session.add(second)
+    directory = session.spill_dir
+    assert len(os.listdir(directory)) == 2
+    session.remove(first)
+    assert len(os.listdir(directory)) == 1
+    session.close()
+    assert not os.path.exists(directory)
+    assert len(session) == 0
+
+
+def test_raising_the_budget_spills_nothing_more():
+    images = [result(value) for value in range(3)]
+    session = Session(budget_bytes=0, keep_recent=1)
+    for image in images:
+        session.add(image)
+    assert session.stats()["spills"] == 2
+    session.set_budget(1 << 30)
+    for image in images:
+        session.touch(image)
+    assert session.stats()["spills"] == 2
+    assert all(np.array_equal(image.array, np.full(SIZE, value, np.uint8)) for value, image in enumerate(images))
+    session.close()
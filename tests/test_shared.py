@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pytest
+import shared
+import stream
+
+IMAGE = np.random.default_rng(0).integers(0, 256, (31, 45, 3), dtype=np.uint8)
+OPERATIONS = [
+    [("negate", {})],
+    [("filter", {"filter_option": 10, "edge_option": 1, "a": 3}), ("posterize", {"bins": 4})],
+    # a greyscale result of a color image
+    [("segment", {"mode": 3})],
+]
+
+
+@pytest.fixture
+def arena():
+    arrays = shared.SharedArrays()
+    yield arrays
+    # blocks the tests mapped in place of a worker
+    while shared._attached:
+        shared._attached.popitem()[1].close()
+    arrays.close()
+
+
+@pytest.mark.parametrize("operations", OPERATIONS)
+def test_round_trip(arena, operations):
+    expected = stream.Chain(operations)(IMAGE)
+    with arena.put(IMAGE) as source, arena.empty(expected.shape, expected.dtype) as target:
+        result = shared.run(source.descriptor, target.descriptor, operations)
+        assert isinstance(result, shared.Descriptor)
+        assert np.array_equal(target.view(result), expected)
+        # the input is read in place, not changed
+        assert np.array_equal(source.array, IMAGE)
+
+
+def test_result_larger_than_the_block_comes_back_pickled(arena):
+    operations = [("filter", {"filter_option": 0, "edge_option": 1})]
+    with arena.put(IMAGE) as source, arena.empty((4,), np.uint8) as target:
+        result = shared.run(source.descriptor, target.descriptor, operations)
+        assert isinstance(result, np.ndarray)
+        assert np.array_equal(target.view(result), stream.Chain(operations)(IMAGE))
+
+
+def test_released_blocks_are_reused(arena):
+    with arena.put(IMAGE):
+        pass
+    with arena.empty(IMAGE.shape, IMAGE.dtype):
+        pass
+    # too small for the free block
+    with arena.empty((2, 2), np.uint8):
+        pass
+    assert arena.stats()["created"] == 2
+    assert arena.stats()["reused"] == 1
+
+
+def test_blocks_over_the_free_budget_are_unlinked():
+    arrays = shared.SharedArrays(free_bytes=0)
+    block = arrays.put(IMAGE)
+    name = block.descriptor.name
+    block.release()
+    assert arrays.stats()["blocks"] == 0
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+    arrays.close()
+
+
+def test_close_unlinks_every_block():
+    arrays = shared.SharedArrays()
+    names = [arrays.put(IMAGE).descriptor.name, arrays.empty((10,), np.float32).descriptor.name]
+    arrays.close()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+def test_round_trip_through_a_worker(arena):
+    operations = OPERATIONS[1]
+    expected = stream.Chain(operations)(IMAGE)
+    with ProcessPoolExecutor(1) as pool:
+        for _ in range(2):
+            with arena.put(IMAGE) as source, arena.empty(IMAGE.shape, IMAGE.dtype) as target:
+                result = pool.submit(shared.run, source.descriptor, target.descriptor, operations).result()
+                assert np.array_equal(target.view(result), expected)
+        assert np.array_equal(pool.submit(shared.run_pickled, IMAGE, operations).result(), expected)
+    assert arena.stats()["reused"] == 2
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+import cv2 as cv
+import engine
+import tiling
+
+
+@pytest.fixture(params=[(40, 300, 3), (372, 493, 3), (33, 17), (5, 7, 3)])
+def image(request):
+    return np.random.default_rng(0).integers(0, 256, request.param, np.uint8)
+
+
+@pytest.mark.parametrize("tile_size", [20, 32, 128, 305, 306, 308])
+@pytest.mark.parametrize("edge_option", sorted(engine.PADDING_MODES) + [3])
+@pytest.mark.parametrize("filter_option, a", [(0, 0), (1, 0), (10, 5), (5, 0)])
+def test_filter_tiled_matches_whole(image, tile_size, edge_option, filter_option, a):
+    # edge tiles may cover fewer image pixels than the padding, or none at all
+    whole = engine.apply_filter(image, filter_option, edge_option, a)
+    tiled = engine.apply_filter(image, filter_option, edge_option, a, tile_size=tile_size, workers=2)
+    np.testing.assert_array_equal(tiled, whole)
+
+
+@pytest.mark.parametrize("tile_size", [16, 128])
+@pytest.mark.parametrize("operation", [1, 2, 3, 4])
+def test_morph_tiled_matches_whole(image, tile_size, operation):
+    whole = engine.morph(image, operation, 2, 2, 3)
+    tiled = engine.morph(image, operation, 2, 2, 3, tile_size=tile_size)
+    np.testing.assert_array_equal(tiled, whole)
+
+
+@pytest.mark.parametrize("border", [cv.BORDER_CONSTANT, cv.BORDER_REFLECT, cv.BORDER_REFLECT_101,
+                                    cv.BORDER_REPLICATE, cv.BORDER_WRAP])
+def test_read_region_matches_padded_image(border):
+    image = np.arange(6 * 9 * 3, dtype=np.uint8).reshape(6, 9, 3)
+    pad = 5
+    padded = cv.copyMakeBorder(image, pad, pad, pad, pad, border, None, value=0)
+    for rect in [(0, 0, 3, 3), (0, 12, 16, 19), (14, 17, 16, 19), (2, 2, 14, 17)]:
+        top, left, bottom, right = rect
+        np.testing.assert_array_equal(tiling.read_region(image, rect, pad, border),
+                                      padded[top:bottom, left:right])
@@ -0,0 +1,129 @@
+'''
+Tiled execution of neighbourhood operations.
+
+The image is split into tiles, each tile is read together with a halo as wide
+as the reach (radius) of the operation, processed on its own and only its
+inner part is written into the output. Results are identical to processing the
+whole image at once, while temporary buffers are bounded by the tile size.
+
+An operation which pads the image first can be run on a virtually padded image:
+the padding is added per tile, so the padded copy is never allocated.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union
+import os
+import numpy as np
+import cv2 as cv
+
+
+DEFAULT_TILE_SIZE = 1024
+# images with more pixels than this are processed in tiles by the GUI
+LARGE_IMAGE_PIXELS = 16 * 1024 * 1024
+
+Rect = Tuple[int, int, int, int]
+# output array, or a function creating it from the shape and type of the result
+Output = Union[np.ndarray, Callable[[Tuple[int, ...], np.dtype], np.ndarray], None]
+
+
+def tile_size_for(image: np.ndarray) -> Optional[int]:
+    '''
+    Returns the tile size to use for an image, None if it's small enough to be processed at once.
+    '''
+    if image.shape[0] * image.shape[1] > LARGE_IMAGE_PIXELS:
+        return DEFAULT_TILE_SIZE
+    return None
+
+
+def options_for(image: np.ndarray) -> Dict[str, Any]:
+    '''
+    Returns tile_size and workers arguments of the engine operations suitable for the image.
+    '''
+    return {"tile_size": tile_size_for(image), "workers": os.cpu_count() or 1}
+
+
+def tiles(height: int, width: int, tile_size: int) -> Iterator[Rect]:
+    '''
+    Yields (top, left, bottom, right) rectangles covering the area in row order.
+    '''
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            yield top, left, min(top + tile_size, height), min(left + tile_size, width)
+
+
+def border_indices(start: int, stop: int, length: int, border: int) -> np.ndarray:
+    '''
+    Returns the indices of the image rows (or columns) start..stop, the ones outside the image
+    mapped inside like cv.copyMakeBorder maps them, -1 where BORDER_CONSTANT fills in a value.
+    '''
+    return np.array([cv.borderInterpolate(index, length, border) for index in range(start, stop)], np.intp)
+
+
+def read_region(image: np.ndarray, rect: Rect, pad: int = 0, pad_border: int = cv.BORDER_CONSTANT) -> np.ndarray:
+    '''
+    Returns a region of the image padded by pad pixels on every side (coordinates include the padding).
+    Parts of the region lying in the padding are filled with pad_border, like cv.copyMakeBorder would
+    fill them for the whole image.
+    '''
+    top, left, bottom, right = rect
+    height, width = image.shape[:2]
+    # region in coordinates of the original image
+    y0, x0, y1, x1 = top - pad, left - pad, bottom - pad, right - pad
+    if y0 >= 0 and x0 >= 0 and y1 <= height and x1 <= width:
+        return image[y0:y1, x0:x1]
+    # the border is reflected (or wrapped) from the whole image, a tile may not even reach into it
+    # BORDER_ISOLATED only matters for ROIs, the image itself is the whole array here
+    pad_border &= ~cv.BORDER_ISOLATED
+    rows = border_indices(y0, y1, height, pad_border)
+    columns = border_indices(x0, x1, width, pad_border)
+    region = image[np.ix_(np.maximum(rows, 0), np.maximum(columns, 0))]
+    if pad_border == cv.BORDER_CONSTANT:
+        region[rows < 0] = 0
+        region[:, columns < 0] = 0
+    return region
+
+
+def run_tiled(image: np.ndarray, operation: Callable[[np.ndarray], np.ndarray], radius: int,
+              tile_size: int = DEFAULT_TILE_SIZE, pad: int = 0, pad_border: int = cv.BORDER_CONSTANT,
+              workers: int = 1, out: Output = None) -> np.ndarray:
+    '''
+    Applies an operation reaching radius pixels around every pixel tile by tile.
+    With pad the operation sees the image padded by pad_border, and the output is larger by 2 * pad.
+    Tiles are processed by several threads when workers > 1. Results are written into out if given,
+    out may also be a function allocating the output (e.g. a memory-mapped file) once its type is known.
+    '''
+    if tile_size < 2 * pad:
+        raise ValueError("Tiles have to be at least twice as large as the padding.")
+    height, width = image.shape[0] + 2 * pad, image.shape[1] + 2 * pad
+
+    def process(rect: Rect) -> Tuple[Rect, np.ndarray]:
+        top, left, bottom, right = rect
+        # extend the tile by the halo, but not past the (padded) image
+        halo = (max(top - radius, 0), max(left - radius, 0),
+                min(bottom + radius, height), min(right + radius, width))
+        result = operation(read_region(image, halo, pad, pad_border))
+        inner = result[top - halo[0]:bottom - halo[0], left - halo[1]:right - halo[1]]
+        return rect, inner
+
+    def write(rect: Rect, inner: np.ndarray) -> None:
+        nonlocal out
+        if out is None or callable(out):
+            allocate = out or np.empty
+            out = allocate((height, width) + inner.shape[2:], inner.dtype)
+        top, left, bottom, right = rect
+        out[top:bottom, left:right] = inner
+
+    rects = list(tiles(height, width, tile_size))
+    if workers <= 1 or len(rects) == 1:
+        for rect in rects:
+            write(*process(rect))
+        return out
+    # the first tile tells the shape and type of the output
+    write(*process(rects[0]))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # keep only a couple of tiles per worker in flight to bound memory
+        window = 2 * workers
+        pending = rects[1:]
+        for start in range(0, len(pending), window):
+            for rect, inner in pool.map(process, pending[start:start + window]):
+                write(rect, inner)
+    return out
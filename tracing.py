@@ -0,0 +1,275 @@
+'''
+Profiling and tracing of RasterLab.
+
+Operations, decodes, renders and saves are recorded as spans with their wall
+and CPU time and the size of the arrays they took and returned. Stages of
+multi-step operations (e.g. watershed) are nested spans. With memory tracing
+on, the peak of memory allocated while a span ran is recorded too, using
+`tracemalloc`; it slows allocations down, so it's off by default.
+
+    with tracing.span("stitch: crop", "operation") as current:
+        ...
+        current.output(result)
+
+    @tracing.traced("operation")
+    def negate(image): ...
+
+Recorded spans are kept in a bounded buffer of the shared `tracer` and can be
+exported as plain JSON or in the Chrome trace event format, which can be opened
+in chrome://tracing or https://ui.perfetto.dev.
+'''
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+MAX_SPANS = 10000
+
+
+def is_array(value: Any) -> bool:
+    return hasattr(value, "shape") and hasattr(value, "dtype") and hasattr(value, "nbytes")
+
+
+def array_info(value: Any) -> Optional[Dict[str, Any]]:
+    '''
+    Describes an array (or a list of arrays) by its shape, type and size, None for other values.
+    Arrays are recognized by their attributes, so that tracing doesn't need numpy to be imported.
+    '''
+    if is_array(value):
+        return {"shape": list(value.shape), "dtype": str(value.dtype), "bytes": int(value.nbytes)}
+    if isinstance(value, (list, tuple)) and value and all(is_array(item) for item in value):
+        return {"count": len(value), "bytes": int(sum(item.nbytes for item in value))}
+    return None
+
+
+class Span:
+    '''
+    Timed region of the program.
+    '''
+
+    def __init__(self, name: str, category: str, args: Dict[str, Any]) -> None:
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread = threading.get_ident()
+        self.depth = 0
+        self.start = 0.0
+        self.wall = 0.0
+        self.cpu = 0.0
+        # bytes allocated at most while the span ran, above the amount at its start
+        self.peak_memory: Optional[int] = None
+        self.inputs: List[Dict[str, Any]] = []
+        self.outputs: List[Dict[str, Any]] = []
+        self._memory_start = 0
+        self._memory_peak = 0
+
+    def input(self, value: Any) -> None:
+        info = array_info(value)
+        if info is not None:
+            self.inputs.append(info)
+
+    def output(self, value: Any) -> None:
+        info = array_info(value)
+        if info is not None:
+            self.outputs.append(info)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "category": self.category,
+            "thread": self.thread,
+            "depth": self.depth,
+            "start": self.start,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "peak_memory": self.peak_memory,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "args": self.args,
+        }
+
+
+class Tracer:
+    '''
+    Records spans of every thread into a bounded buffer.
+    '''
+
+    def __init__(self, max_spans: int = MAX_SPANS) -> None:
+        self.enabled = True
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+        # number of spans recorded so far, including the ones which no longer fit in the buffer
+        self.recorded = 0
+        # called with every finished span, from the thread which ran it
+        self.listeners: List[Callable[[Span], None]] = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def memory(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def set_memory(self, enabled: bool) -> None:
+        '''
+        Turns peak memory tracing on or off.
+        '''
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name: str, category: str = "operation", **args) -> Iterator[Span]:
+        '''
+        Records the time (and memory) spent in the with block.
+        '''
+        current = Span(name, category, args)
+        if not self.enabled:
+            yield current
+            return
+        stack = self._stack()
+        current.depth = len(stack)
+        memory = self.memory
+        if memory:
+            current._memory_start = tracemalloc.get_traced_memory()[0]
+            # peaks of spans still running were already folded into their parents
+            for parent in stack:
+                parent._memory_peak = max(parent._memory_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(current)
+        cpu = time.thread_time()
+        start = time.perf_counter()
+        try:
+            yield current
+        finally:
+            current.wall = time.perf_counter() - start
+            current.cpu = time.thread_time() - cpu
+            current.start = start - self.origin
+            stack.pop()
+            if memory and self.memory:
+                peak = max(current._memory_peak, tracemalloc.get_traced_memory()[1])
+                current.peak_memory = max(peak - current._memory_start, 0)
+                if stack:
+                    stack[-1]._memory_peak = max(stack[-1]._memory_peak, peak)
+            self._record(current)
+
+    def instant(self, name: str, category: str = "event", **args) -> None:
+        '''
+        Records an event without duration.
+        '''
+        if self.enabled:
+            current = Span(name, category, args)
+            current.start = time.perf_counter() - self.origin
+            current.depth = len(self._stack())
+            self._record(current)
+
+    def _record(self, current: Span) -> None:
+        with self._lock:
+            self.spans.append(current)
+            self.recorded += 1
+        for listener in self.listeners:
+            listener(current)
+
+    def snapshot(self) -> List[Span]:
+        with self._lock:
+            return list(self.spans)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        '''
+        Returns count, total and maximum wall time and total CPU time of the spans grouped by name.
+        '''
+        result: Dict[str, Dict[str, float]] = {}
+        for current in self.snapshot():
+            entry = result.setdefault(current.name, {"count": 0, "wall": 0.0, "max_wall": 0.0, "cpu": 0.0})
+            entry["count"] += 1
+            entry["wall"] += current.wall
+            entry["max_wall"] = max(entry["max_wall"], current.wall)
+            entry["cpu"] += current.cpu
+        return result
+
+    def export_json(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump([current.to_dict() for current in self.snapshot()], file, indent=1)
+
+    def chrome_events(self) -> List[Dict[str, Any]]:
+        '''
+        Returns the spans as Chrome trace events, times are in microseconds.
+        '''
+        pid = os.getpid()
+        events: List[Dict[str, Any]] = []
+        for current in self.snapshot():
+            args: Dict[str, Any] = dict(current.args)
+            args["cpu_ms"] = round(current.cpu * 1000, 3)
+            if current.peak_memory is not None:
+                args["peak_memory"] = current.peak_memory
+            if current.inputs:
+                args["inputs"] = current.inputs
+            if current.outputs:
+                args["outputs"] = current.outputs
+            event = {
+                "name": current.name,
+                "cat": current.category,
+                "pid": pid,
+                "tid": current.thread,
+                "ts": round(current.start * 1e6, 3),
+                "args": args,
+            }
+            if current.category == "event":
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=round(current.wall * 1e6, 3))
+            events.append(event)
+        return events
+
+    def export_chrome(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.chrome_events(), "displayTimeUnit": "ms"}, file)
+
+
+# tracer shared by the whole program
+tracer = Tracer()
+
+
+def span(name: str, category: str = "operation", **args):
+    return tracer.span(name, category, **args)
+
+
+def instant(name: str, category: str = "event", **args) -> None:
+    tracer.instant(name, category, **args)
+
+
+def traced(category: str = "operation", name: Optional[str] = None):
+    '''
+    Decorator recording every call of a function as a span, with the arrays it took and returned.
+    '''
+    def decorator(fn: Callable) -> Callable:
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(label, category) as current:
+                for value in args:
+                    current.input(value)
+                result = fn(*args, **kwargs)
+                current.output(result)
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,342 @@
+'''
+Image viewer of RasterLab.
+
+Images are shown on a scrollable canvas split into tiles. Only tiles in view
+are converted into PhotoImages, tiles which scroll out of view are evicted, so
+the cost of displaying an image depends on the window size rather than on the
+image size.
+
+Zooming resamples from a mip-map pyramid of the decoded image instead of the
+file on disk. Levels are built lazily, each one half the size of the previous.
+Mouse wheel bursts are coalesced: every tick is rendered with a fast filter and
+only the final zoom level is rendered again at full quality once the wheel
+settles.
+
+PhotoImages are reused: tiles which leave the view are kept in a pool and
+filled again with `paste()`, and replacing the image with one of the same size
+(e.g. frames of a live preview) repaints the existing tiles in place.
+
+A viewer given a way to reload its image can release the pyramid to save
+memory; tiles already drawn stay on the canvas and the pyramid is built again
+once a new tile is needed.
+'''
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import tkinter as tk
+from PIL import Image, ImageTk
+import tracing
+
+
+ZOOM_STEP = 1.05
+TILE_SIZE = 256
+# part of the screen an image window may take at most
+SCREEN_FRACTION = 0.9
+# modes PIL can reduce, others are converted first
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "I", "F")
+# delay after the last wheel tick before rendering at full quality
+SETTLE_MS = 150
+# PhotoImages of evicted tiles kept for reuse
+MAX_FREE_TILES = 64
+
+
+class ZoomPyramid:
+    '''
+    Lazily built mip-map pyramid of a PIL image.
+    '''
+
+    def __init__(self, image: Image.Image, min_size: int = 32) -> None:
+        if image.mode not in REDUCIBLE_MODES:
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        self.min_size = min_size
+        self.levels: List[Image.Image] = [image]
+
+    @property
+    def base(self) -> Image.Image:
+        return self.levels[0]
+
+    def level(self, index: int) -> Image.Image:
+        '''
+        Returns the pyramid level with the given index, building missing levels.
+        Level 0 is the image itself, every next level is half the size.
+        '''
+        while len(self.levels) <= index:
+            previous = self.levels[-1]
+            if min(previous.size) // 2 < self.min_size:
+                break
+            self.levels.append(previous.reduce(2))
+        return self.levels[min(index, len(self.levels) - 1)]
+
+    def level_for(self, width: int, height: int) -> Image.Image:
+        '''
+        Returns the smallest level which is still at least as large as the requested size.
+        '''
+        index = 0
+        while True:
+            candidate = self.level(index + 1)
+            if candidate is self.levels[index] or candidate.width < width or candidate.height < height:
+                return self.levels[index]
+            index += 1
+
+    def memory(self, base: bool = True) -> int:
+        '''
+        Returns the bytes held by the levels, optionally without the base image.
+        '''
+        levels = self.levels if base else self.levels[1:]
+        return sum(level.width * level.height * len(level.getbands()) for level in levels)
+
+    def resize(self, width: int, height: int, resample: int = Image.LANCZOS) -> Image.Image:
+        '''
+        Resamples the nearest pyramid level to the requested size.
+        '''
+        width, height = max(width, 1), max(height, 1)
+        source = self.level_for(width, height)
+        if source.size == (width, height):
+            return source
+        return source.resize((width, height), resample)
+
+
+class ImageViewer:
+    '''
+    Scrollable and pannable canvas showing an image.
+    Only tiles intersecting the visible region are converted into PhotoImages.
+    '''
+
+    def __init__(self, window: tk.Toplevel, image: Image.Image,
+                 tile_size: int = TILE_SIZE, settle_ms: int = SETTLE_MS,
+                 reload: Optional[Callable[[], Image.Image]] = None) -> None:
+        self.window = window
+        self._pyramid: Optional[ZoomPyramid] = ZoomPyramid(image)
+        # size and mode of the image, known even while the pyramid is released
+        self.image_size = self._pyramid.base.size
+        self.mode = self._pyramid.base.mode
+        self.reload = reload
+        self.tile_size = tile_size
+        self.settle_ms = settle_ms
+        self.scale = 1.0
+        self.quality = Image.LANCZOS
+        # (tile column, tile row) -> (canvas item, PhotoImage)
+        self.tiles: Dict[Tuple[int, int], Tuple[int, ImageTk.PhotoImage]] = {}
+        # (tile width, tile height, mode) -> PhotoImages of evicted tiles
+        self.free: Dict[Tuple[int, int, str], List[ImageTk.PhotoImage]] = {}
+        self.free_count = 0
+        # tiles showing a replaced image, they are repainted in place
+        self.stale: Set[Tuple[int, int]] = set()
+        self._tiles_key: Tuple[float, int] = (self.scale, self.quality)
+        self._pending: Optional[str] = None
+        self._draw_pending = False
+
+        # never make the window larger than the screen
+        max_width = int(window.winfo_screenwidth() * SCREEN_FRACTION)
+        max_height = int(window.winfo_screenheight() * SCREEN_FRACTION)
+        self.h_bar = tk.Scrollbar(window, orient=tk.HORIZONTAL)
+        self.v_bar = tk.Scrollbar(window, orient=tk.VERTICAL)
+        self.canvas = tk.Canvas(
+            window,
+            width=min(image.width, max_width),
+            height=min(image.height, max_height),
+            highlightthickness=0,
+            xscrollcommand=lambda *args: self._on_scroll(self.h_bar, *args),
+            yscrollcommand=lambda *args: self._on_scroll(self.v_bar, *args),
+        )
+        self.h_bar["command"] = self.canvas.xview
+        self.v_bar["command"] = self.canvas.yview
+        self.canvas.grid(column=0, row=0, sticky="nsew")
+        self.v_bar.grid(column=1, row=0, sticky="ns")
+        self.h_bar.grid(column=0, row=1, sticky="ew")
+        window.grid_rowconfigure(0, weight=1)
+        window.grid_columnconfigure(0, weight=1)
+        self.canvas.configure(scrollregion=(0, 0, *self.size()))
+
+    def set_image(self, image: Image.Image) -> None:
+        '''
+        Replaces the shown image (e.g. after changing its display window), keeping the zoom.
+        Tiles of an image of the same size and mode are repainted in place.
+        '''
+        pyramid = ZoomPyramid(image)
+        same_layout = (pyramid.base.size, pyramid.base.mode) == (self.image_size, self.mode)
+        if not same_layout:
+            self.clear_tiles()
+        self._pyramid = pyramid
+        self.image_size = pyramid.base.size
+        self.mode = pyramid.base.mode
+        if same_layout:
+            self.stale.update(self.tiles)
+        else:
+            self.canvas.configure(scrollregion=(0, 0, *self.size()))
+        self.schedule_draw()
+
+    @property
+    def pyramid(self) -> ZoomPyramid:
+        if self._pyramid is None:
+            with tracing.span("reload pyramid", "render"):
+                self._pyramid = ZoomPyramid(self.reload())
+        return self._pyramid
+
+    def release(self) -> None:
+        '''
+        Drops the pyramid of a viewer which can reload its image, the drawn tiles stay.
+        '''
+        if self.reload is not None:
+            self._pyramid = None
+
+    def memory(self, base: bool = True) -> int:
+        '''
+        Returns the bytes held by the pyramid (optionally without the image itself) and the PhotoImages.
+        '''
+        total = self._pyramid.memory(base) if self._pyramid is not None else 0
+        photos = [tk_image for item, tk_image in self.tiles.values()]
+        photos += [tk_image for free in self.free.values() for tk_image in free]
+        # Tk keeps 4 bytes per pixel
+        return total + sum(tk_image.width() * tk_image.height() * 4 for tk_image in photos)
+
+    def size(self) -> Tuple[int, int]:
+        width, height = self.image_size
+        return max(int(width * self.scale), 1), max(int(height * self.scale), 1)
+
+    def to_image(self, x: int, y: int) -> List[int]:
+        '''
+        Translates canvas widget coordinates into coordinates of the original image.
+        '''
+        return [int(self.canvas.canvasx(x) / self.scale), int(self.canvas.canvasy(y) / self.scale)]
+
+    def visible_region(self) -> Tuple[int, int, int, int]:
+        '''
+        Returns the (left, top, right, bottom) box of the original image which is visible.
+        '''
+        width, height = self.image_size
+        left, top = self.to_image(0, 0)
+        right, bottom = self.to_image(self.canvas.winfo_width(), self.canvas.winfo_height())
+        return max(left, 0), max(top, 0), min(right, width), min(bottom, height)
+
+    def _on_scroll(self, bar: tk.Scrollbar, *args) -> None:
+        bar.set(*args)
+        self.schedule_draw()
+
+    def schedule_draw(self, event=None) -> None:
+        '''
+        Redraws the visible tiles once the event loop is idle, coalescing repeated requests.
+        '''
+        if not self._draw_pending:
+            self._draw_pending = True
+            self.window.after_idle(self.draw)
+
+    def visible_tiles(self) -> Set[Tuple[int, int]]:
+        '''
+        Returns indices of the tiles intersecting the visible region, with a margin of one tile.
+        '''
+        width, height = self.size()
+        t = self.tile_size
+        x0 = int(self.canvas.canvasx(0))
+        y0 = int(self.canvas.canvasy(0))
+        x1 = x0 + self.canvas.winfo_width()
+        y1 = y0 + self.canvas.winfo_height()
+        columns = range(max(x0 // t - 1, 0), min(x1 // t + 2, -(-width // t)))
+        rows = range(max(y0 // t - 1, 0), min(y1 // t + 2, -(-height // t)))
+        return {(column, row) for column in columns for row in rows}
+
+    def render_tile(self, column: int, row: int) -> Image.Image:
+        '''
+        Resamples one tile of the zoomed image from the nearest pyramid level.
+        '''
+        width, height = self.size()
+        t = self.tile_size
+        left, top = column * t, row * t
+        right, bottom = min(left + t, width), min(top + t, height)
+        level = self.pyramid.level_for(width, height)
+        fx, fy = level.width / width, level.height / height
+        box = (left * fx, top * fy, right * fx, bottom * fy)
+        return level.resize((right - left, bottom - top), self.quality, box=box)
+
+    def draw(self) -> None:
+        '''
+        Converts tiles which came into view and evicts the ones which left it.
+        '''
+        self._draw_pending = False
+        with tracing.span("draw", "render", scale=round(self.scale, 3)) as current:
+            current.args["converted"] = self._draw()
+
+    def _draw(self) -> int:
+        if (self.scale, self.quality) != self._tiles_key:
+            self.clear_tiles()
+            self._tiles_key = (self.scale, self.quality)
+        visible = self.visible_tiles()
+        for key in list(self.tiles):
+            if key not in visible:
+                self._evict(key)
+        for key in self.stale & visible:
+            self.tiles[key][1].paste(self.render_tile(*key))
+        self.stale.clear()
+        missing = visible - self.tiles.keys()
+        for column, row in missing:
+            tk_image = self._photo(self.render_tile(column, row))
+            item = self.canvas.create_image(
+                column * self.tile_size, row * self.tile_size, image=tk_image, anchor="nw")
+            self.canvas.tag_lower(item)
+            self.tiles[(column, row)] = (item, tk_image)
+        return len(missing)
+
+    def _photo(self, tile: Image.Image) -> ImageTk.PhotoImage:
+        '''
+        Returns a PhotoImage showing the tile, reusing a free one of the same size if there is any.
+        '''
+        free = self.free.get((*tile.size, tile.mode))
+        if not free:
+            return ImageTk.PhotoImage(tile)
+        tk_image = free.pop()
+        self.free_count -= 1
+        tk_image.paste(tile)
+        return tk_image
+
+    def _evict(self, key: Tuple[int, int]) -> None:
+        item, tk_image = self.tiles.pop(key)
+        self.canvas.delete(item)
+        if self.free_count < MAX_FREE_TILES:
+            layout = (tk_image.width(), tk_image.height(), self.mode)
+            self.free.setdefault(layout, []).append(tk_image)
+            self.free_count += 1
+
+    def clear_tiles(self) -> None:
+        for key in list(self.tiles):
+            self._evict(key)
+        self.stale.clear()
+
+    def _settle(self) -> None:
+        self._pending = None
+        self.quality = Image.LANCZOS
+        self.schedule_draw()
+
+    def zoom(self, factor: float, x: int = 0, y: int = 0) -> None:
+        '''
+        Zooms by factor keeping the point under the (x, y) widget position in place.
+        Renders quickly right away and at full quality once zooming settles.
+        '''
+        image_x, image_y = self.to_image(x, y)
+        self.scale *= factor
+        width, height = self.size()
+        self.canvas.configure(scrollregion=(0, 0, width, height))
+        self.canvas.xview_moveto((image_x * self.scale - x) / width)
+        self.canvas.yview_moveto((image_y * self.scale - y) / height)
+        self.quality = Image.NEAREST
+        self.schedule_draw()
+        if self._pending is not None:
+            self.window.after_cancel(self._pending)
+        self._pending = self.window.after(self.settle_ms, self._settle)
+
+    def on_wheel(self, event) -> None:
+        '''
+        Depending on the scroll direction zooms the image in and out.
+        '''
+        if event.delta > 0 or getattr(event, "num", None) == 4:
+            self.zoom(ZOOM_STEP, event.x, event.y)
+        elif event.delta < 0 or getattr(event, "num", None) == 5:
+            self.zoom(1 / ZOOM_STEP, event.x, event.y)
+
+    def bind(self) -> None:
+        '''
+        Binds wheel zooming (Windows/macOS and X11 style), right button panning and resizing.
+        '''
+        self.canvas.bind("<MouseWheel>", self.on_wheel)
+        self.canvas.bind("<Button-4>", self.on_wheel)
+        self.canvas.bind("<Button-5>", self.on_wheel)
+        self.canvas.bind("<ButtonPress-3>", lambda event: self.canvas.scan_mark(event.x, event.y))
+        self.canvas.bind("<B3-Motion>", lambda event: self.canvas.scan_dragto(event.x, event.y, gain=1))
+        self.canvas.bind("<Configure>", self.schedule_draw)
@@ -0,0 +1,186 @@
+'''
+Background workers of RasterLab.
+
+Operations are submitted to a thread (or process) pool so the Tk event loop
+never waits for them. OpenCV releases the GIL, so threads process several
+images at once. Finished futures are put on a queue which is polled from the
+Tk thread with `after()`, and only there are result callbacks run, since Tk
+widgets mustn't be touched from other threads.
+'''
+# ProcessPoolExecutor is imported only when needed, multiprocessing slows the startup down
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+import functools
+import os
+import queue
+import time
+import traceback
+import tkinter as tk
+from tkinter import ttk
+import tracing
+
+
+# how often the Tk thread checks for finished tasks
+POLL_MS = 50
+
+
+class Task:
+    '''
+    Operation submitted to the pool.
+    Cancelling stops a task which hasn't started yet; a running one finishes but its result is dropped.
+    '''
+
+    def __init__(self, name: str, future: Future,
+                 on_done: Optional[Callable[[Any], None]],
+                 on_error: Optional[Callable[[BaseException], None]]) -> None:
+        self.name = name
+        self.future = future
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = False
+        self.started = time.perf_counter()
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self.future.cancel()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+def print_error(error: BaseException) -> None:
+    '''
+    Default error handler, prints the traceback to the console like a failing callback would.
+    '''
+    traceback.print_exception(type(error), error, error.__traceback__)
+
+
+def traced_task(name: str, fn: Callable, *args, **kwargs) -> Any:
+    '''
+    Runs a task recording it as a span, the operations it calls are nested in it.
+    '''
+    with tracing.span(name, "task") as current:
+        result = fn(*args, **kwargs)
+        current.output(result)
+        return result
+
+
+class TaskRunner:
+    '''
+    Runs operations in a pool and marshals their results back to the Tk thread.
+    '''
+
+    def __init__(self, root: tk.Misc, max_workers: Optional[int] = None,
+                 processes: bool = False, poll_ms: int = POLL_MS) -> None:
+        self.root = root
+        self.poll_ms = poll_ms
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.processes = processes
+        if processes:
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor: Executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.tasks: List[Task] = []
+        # called with the list of unfinished tasks whenever it changes
+        self.listeners: List[Callable[[List[Task]], None]] = []
+        self._finished: "queue.Queue[Task]" = queue.Queue()
+        self._polling = False
+
+    def submit(self, name: str, fn: Callable, *args,
+               on_done: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[BaseException], None]] = print_error,
+               **kwargs) -> Task:
+        '''
+        Runs fn(*args, **kwargs) in the pool. on_done gets the result and on_error the raised exception,
+        both are called on the Tk thread.
+        '''
+        if not self.processes:
+            # spans of other processes wouldn't reach this tracer
+            fn = functools.partial(traced_task, name, fn)
+        future = self.executor.submit(fn, *args, **kwargs)
+        task = Task(name, future, on_done, on_error)
+        self.tasks.append(task)
+        # called from the worker thread, only hand the task over
+        future.add_done_callback(lambda f: self._finished.put(task))
+        self._notify()
+        self._schedule()
+        return task
+
+    def cancel_all(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        self._notify()
+
+    def running(self) -> List[Task]:
+        return [task for task in self.tasks if not task.cancelled]
+
+    def _schedule(self) -> None:
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self) -> None:
+        self._polling = False
+        while True:
+            try:
+                task = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            if task in self.tasks:
+                self.tasks.remove(task)
+            self._finish(task)
+            self._notify()
+        if self.tasks:
+            self._schedule()
+
+    def _finish(self, task: Task) -> None:
+        if task.cancelled or task.future.cancelled():
+            return
+        error = task.future.exception()
+        if error is not None:
+            if task.on_error is not None:
+                task.on_error(error)
+        elif task.on_done is not None:
+            task.on_done(task.future.result())
+
+    def _notify(self) -> None:
+        running = self.running()
+        for listener in self.listeners:
+            listener(running)
+
+    def shutdown(self) -> None:
+        '''
+        Cancels queued tasks and stops the pool without waiting for running ones.
+        '''
+        self.cancel_all()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TaskPanel:
+    '''
+    Progress indicator of a runner with a button cancelling every task.
+    '''
+
+    def __init__(self, parent: tk.Misc, runner: TaskRunner) -> None:
+        self.frame = tk.Frame(parent)
+        self.label = tk.Label(self.frame, text="idle", font=("consolas", 10), anchor="w")
+        self.progress = ttk.Progressbar(self.frame, mode="indeterminate", length=150)
+        self.cancel_button = tk.Button(
+            self.frame, text="cancel", font=("consolas", 10), command=runner.cancel_all, state="disabled")
+        self.label.grid(column=1, row=1, padx=5, sticky="w")
+        self.progress.grid(column=2, row=1, padx=5)
+        self.cancel_button.grid(column=3, row=1, padx=5)
+        runner.listeners.append(self.update)
+
+    def update(self, tasks: List[Task]) -> None:
+        if tasks:
+            names = ", ".join(task.name for task in tasks[:3])
+            more = f" +{len(tasks) - 3}" if len(tasks) > 3 else ""
+            self.label["text"] = f"{len(tasks)} running: {names}{more}"
+            self.progress.start(10)
+            self.cancel_button["state"] = "normal"
+        else:
+            self.label["text"] = "idle"
+            self.progress.stop()
+            self.cancel_button["state"] = "disabled"